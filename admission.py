@@ -0,0 +1,256 @@
+import asyncio
+import collections
+import time
+from dataclasses import dataclass
+
+from limits import QueueFullError
+from metrics import ADMISSION_SHED
+
+
+class RateLimitedError(Exception):
+    """Raised when a client has used up its token bucket; ``retry_after`` is in seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(QueueFullError):
+    """Raised when a request can no longer get a model answer before its deadline.
+
+    A subclass of ``QueueFullError`` so every caller that already answers an
+    overloaded queue with 503 sheds these the same way.
+    """
+
+    def __init__(self, message: str, retry_after: float = 5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass
+class Ticket:
+    """Who is asking for a model slot, how much they weigh and when they stop caring."""
+    client: str = "anonymous"
+    priority: str = "default"
+    # Absolute deadline on the event loop clock (``loop.time()``), or None to wait as long as the queue allows
+    deadline: float | None = None
+
+
+def parse_weights(spec: str) -> dict:
+    """Parse ``"paid=4,senior=2,tutor=1"`` into a weight per priority class."""
+    weights = {}
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            weights[name.strip()] = max(0.01, float(value))
+    return weights
+
+
+class TokenBucket:
+    """Refills ``rate`` tokens per second up to ``burst``; each admitted call takes one."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """Take a token; returns 0 on success or the seconds until one will be available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """One token bucket per client, keeping the ``max_clients`` most recently seen."""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_clients = max_clients
+        self._buckets = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, client: str, now: float = None) -> float:
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.rate, self.burst, now)
+            # An evicted client comes back with a full bucket, which is what an idle one would have anyway
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        return bucket.take(now)
+
+
+class FairScheduler:
+    """Admission control in front of the model: rate limits, fair queueing and deadlines.
+
+    Takes the place of ``ConcurrencyLimiter`` for model calls, used through
+    ``slot(ticket)`` or ``acquire(ticket)`` / ``release(started)``. Admission
+    happens in three steps:
+
+    1. The client's token bucket must have a token, otherwise ``RateLimitedError``
+       (429). Only model calls are charged: cache hits never reach the scheduler,
+       and a request shed up front for its deadline (step 3) is shed before it
+       takes a token.
+    2. If every slot is taken the request queues per client. Freed slots go to
+       the client with the lowest virtual finish time, which advances by
+       ``1 / weight`` per call, so a client with a hundred queued requests gets
+       the same share as one with a single request, and a ``weight=2`` class
+       gets twice the share of a ``weight=1`` class.
+    3. A request whose deadline cannot be met is shed with
+       ``DeadlineExceededError`` (503): up front when the estimated queue wait
+       plus the typical model call already overshoots it, or while queued once
+       the latest useful start time passes. Either way no model call is spent
+       on an answer nobody will read.
+
+    The typical call duration is a moving average of how long slots are held.
+    """
+
+    def __init__(self, limit: int, queue_limit: int, weights: dict = None,
+                 rate: float = 0, burst: float = 0, max_clients: int = 10000):
+        self.limit = max(1, limit)
+        self.queue_limit = max(0, queue_limit)
+        self.weights = weights or {}
+        self.rate_limiter = RateLimiter(rate, burst or rate, max_clients) if rate > 0 else None
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = collections.Counter()
+        self.service_time = None
+        self._queues = {}
+        self._finish = {}
+        self._clock = 0.0
+
+    def weight(self, priority: str) -> float:
+        return self.weights.get(priority, 1.0)
+
+    def queue_depths(self) -> dict:
+        """Live waiters per priority class."""
+        depths = collections.Counter()
+        for queue in self._queues.values():
+            for waiter, ticket in queue:
+                if not waiter.done():
+                    depths[ticket.priority] += 1
+        return depths
+
+    def estimated_wait(self) -> float:
+        """Rough time until a request queued now would get a slot."""
+        if self.service_time is None or self.active < self.limit:
+            return 0.0
+        return (self.waiting // self.limit + 1) * self.service_time
+
+    def _shed(self, reason: str, ticket: Ticket, error: Exception):
+        self.shed[reason] += 1
+        ADMISSION_SHED.inc(reason=reason, priority=ticket.priority)
+        raise error
+
+    async def acquire(self, ticket: Ticket = None) -> float:
+        """Wait for a slot; returns the start time to hand back to ``release()``."""
+        ticket = ticket or Ticket()
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        # Latest moment a call can start and still be expected to finish in time
+        latest_start = None
+        if ticket.deadline is not None:
+            latest_start = ticket.deadline - (self.service_time or 0.0)
+            if now + self.estimated_wait() > latest_start:
+                self._shed("deadline", ticket, DeadlineExceededError(
+                    "Request cannot be answered before its deadline", self.estimated_wait()))
+
+        if self.rate_limiter is not None:
+            retry_after = self.rate_limiter.take(ticket.client)
+            if retry_after:
+                self._shed("rate_limited", ticket,
+                           RateLimitedError(f"Rate limit exceeded for {ticket.client}", retry_after))
+
+        if self.active < self.limit and not self.waiting:
+            return self._start()
+        if self.waiting >= self.queue_limit:
+            self._shed("queue_full", ticket,
+                       QueueFullError(f"{self.waiting} requests already waiting for a model slot"))
+
+        waiter = loop.create_future()
+        queue = self._queues.get(ticket.client)
+        if queue is None:
+            queue = self._queues[ticket.client] = collections.deque()
+            # A client that was idle starts at the current virtual time, not with credit saved up
+            self._finish[ticket.client] = max(self._finish.get(ticket.client, 0.0), self._clock)
+        queue.append((waiter, ticket))
+        self.waiting += 1
+        try:
+            if latest_start is None:
+                await waiter
+            else:
+                await asyncio.wait_for(waiter, max(0.0, latest_start - now))
+        except asyncio.TimeoutError:
+            # The slot may have been handed over just as the timer fired; then it is still ours to use
+            if waiter.cancelled() or not waiter.done():
+                self._shed("deadline", ticket, DeadlineExceededError(
+                    "Request expired while waiting for a model slot", self.estimated_wait()))
+        except BaseException:
+            # Cancelled just after being handed a slot: pass it on instead of leaking it
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            self.waiting -= 1
+        return waiter.result()
+
+    def _start(self) -> float:
+        self.active += 1
+        self.admitted += 1
+        return time.monotonic()
+
+    def release(self, started: float = None):
+        if started is not None:
+            elapsed = time.monotonic() - started
+            self.service_time = elapsed if self.service_time is None else 0.8 * self.service_time + 0.2 * elapsed
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.active < self.limit and self._queues:
+            client = min(self._queues, key=self._finish.__getitem__)
+            queue = self._queues[client]
+            waiter, ticket = queue.popleft()
+            if not queue:
+                del self._queues[client]
+            # Skip waiters that already timed out or were cancelled
+            if waiter.done():
+                continue
+            self._clock = self._finish[client]
+            self._finish[client] += 1.0 / self.weight(ticket.priority)
+            waiter.set_result(self._start())
+        # Forget idle clients that hold no credit beyond the current virtual time
+        if len(self._finish) > len(self._queues) * 2 + 64:
+            self._finish = {c: f for c, f in self._finish.items() if c in self._queues or f > self._clock}
+
+    def slot(self, ticket: Ticket = None):
+        """``async with scheduler.slot(ticket):`` holds a slot for the block and times it."""
+        return _Slot(self, ticket)
+
+
+class _Slot:
+    def __init__(self, scheduler: FairScheduler, ticket: Ticket):
+        self.scheduler = scheduler
+        self.ticket = ticket
+        self.started = None
+
+    async def __aenter__(self):
+        self.started = await self.scheduler.acquire(self.ticket)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.scheduler.release(self.started)
+        return False
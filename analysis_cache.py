@@ -0,0 +1,161 @@
+"""Content-addressed cache for model analyses.
+
+Two tiers: an in-process LRU with size and TTL eviction, backed by a SQLite
+file that every uvicorn worker on the host shares and that survives restarts.
+"""
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_code(code: str) -> str:
+    """Drop differences that never change a review: line endings, trailing spaces, outer blank lines."""
+    lines = code.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+
+def cache_key(code: str, language: str, persona: str, model_name: str, prompt_version: int, *extra) -> str:
+    h = hashlib.sha256()
+    for part in (normalize_code(code), language, persona, model_name, str(prompt_version), *map(str, extra)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class LRUCache:
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max(0, max_entries)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        if not self.max_entries:
+            return
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+
+class DiskCache:
+    PRUNE_EVERY = 100
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS analysis (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM analysis WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        value, created = row
+        if created + self.ttl < time.time():
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value, created
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO analysis VALUES (?, ?, ?)", (key, value, now))
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._conn.execute("DELETE FROM analysis WHERE created < ?", (now - self.ttl,))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+
+
+class AnalysisCache:
+    """Memory LRU in front of an optional shared SQLite tier.
+
+    Memory hits are answered synchronously; the SQLite tier is consulted off
+    the event loop so a busy database never stalls other requests.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 86400, path: str = None):
+        self.memory = LRUCache(max_entries, ttl)
+        self.disk = DiskCache(path, ttl) if path else None
+
+    async def get(self, key):
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+        row = await asyncio.to_thread(self.disk.get, key)
+        if row is None:
+            return None
+        value, created = row
+        # Promote with whatever lifetime the shared entry has left
+        self.memory.set(key, value, ttl=created + self.disk.ttl - time.time())
+        return value
+
+    async def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, value)
+
+    def stats(self) -> dict:
+        stats = {
+            "memory": {
+                "entries": len(self.memory),
+                "max_entries": self.memory.max_entries,
+                "hits": self.memory.hits,
+                "misses": self.memory.misses,
+                "evictions": self.memory.evictions,
+                "expirations": self.memory.expirations,
+            },
+        }
+        if self.disk is not None:
+            stats["disk"] = {
+                "path": self.disk.path,
+                "hits": self.disk.hits,
+                "misses": self.disk.misses,
+                "expirations": self.disk.expirations,
+            }
+        stats["hits"] = self.memory.hits + (self.disk.hits if self.disk else 0)
+        stats["misses"] = self.disk.misses if self.disk else self.memory.misses
+        return stats
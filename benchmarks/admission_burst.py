@@ -0,0 +1,125 @@
+"""Simulated burst against /analyze: one client floods while others use the app normally.
+
+The flooding client fires ``--flood`` requests at once; a handful of regular
+clients (tutor, senior and one paid tenant) send ``--per-client`` requests one
+after another. With admission control the flood is rate limited and queued
+behind its own requests, so the regular clients keep near single-request
+latency and every one of their requests succeeds. ``--fifo`` puts everybody
+into one anonymous queue without rate limits or deadlines to show what the
+flood does without it. Exits non-zero when the regular clients were not
+protected, so it doubles as a check:
+
+    python benchmarks/admission_burst.py --flood 300 --latency 0.2
+    python benchmarks/admission_burst.py --fifo
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+os.environ.update({
+    "MODEL_BACKEND": "stub",
+    "ANALYSIS_CACHE_SIZE": "0",
+    "ANALYSIS_CACHE_PATH": "",
+    "PAID_API_KEYS": "paid-tenant",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import main
+from admission import FairScheduler, Ticket, parse_weights
+from analysis_cache import AnalysisCache
+from model_backends import StubBackend
+
+REGULAR_CLIENTS = [("alice", "tutor"), ("bob", "senior"), ("carol", "tutor"), ("paid-tenant", "senior")]
+
+
+def payload(client, i, persona):
+    return {"code": f"# {client} {i}\nint main() {{ return {i}; }}", "language": "C++", "persona": persona}
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] if ordered else 0.0
+
+
+async def timed_post(client, api_key, body, timeout=None):
+    headers = {"X-API-Key": api_key}
+    if timeout:
+        headers["X-Request-Timeout"] = str(timeout)
+    start = time.perf_counter()
+    response = await client.post("/analyze", json=body, headers=headers)
+    return response.status_code, time.perf_counter() - start
+
+
+async def run(args):
+    main.backend = StubBackend(latency=args.latency, chunk_delay=0)
+    main.analysis_cache = AnalysisCache(max_entries=0)
+    if args.fifo:
+        main.model_limiter = FairScheduler(args.concurrency, args.flood + 100)
+        main.request_ticket = lambda request, persona, timeout=None: Ticket()
+    else:
+        main.model_limiter = FairScheduler(args.concurrency, args.queue_limit, parse_weights(args.weights),
+                                           rate=args.rate, burst=args.burst)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # Warm up the moving average of model call time that deadline shedding relies on
+        await timed_post(client, "warmup", payload("warmup", 0, "tutor"))
+
+        async def regular(api_key, persona):
+            await asyncio.sleep(args.latency)
+            results = []
+            for i in range(args.per_client):
+                results.append(await timed_post(client, api_key, payload(api_key, i, persona)))
+            return results
+
+        start = time.perf_counter()
+        flood = [timed_post(client, "flooder", payload("flooder", i, "senior"), args.flood_timeout)
+                 for i in range(args.flood)]
+        flood_results, *regular_results = await asyncio.gather(
+            asyncio.gather(*flood), *(regular(key, persona) for key, persona in REGULAR_CLIENTS))
+        elapsed = time.perf_counter() - start
+        stats = (await client.get("/api/admission/stats")).json()
+        exposition = (await client.get("/metrics")).text
+
+    print(f"{'fifo' if args.fifo else 'admission control'}: model latency {args.latency * 1000:.0f} ms, "
+          f"{args.concurrency} slots, flood of {args.flood}, burst took {elapsed:.2f} s\n")
+    rows = [("flooder", "senior", flood_results)]
+    rows += [(key, persona, results) for (key, persona), results in zip(REGULAR_CLIENTS, regular_results)]
+    protected = True
+    for key, persona, results in rows:
+        codes = {}
+        for status, _ in results:
+            codes[status] = codes.get(status, 0) + 1
+        ok = [latency for status, latency in results if status == 200]
+        print(f"{key:<12} {persona:<7} ok {len(ok):4d}/{len(results):<4d}  "
+              f"p50 {percentile(ok, 0.5) * 1000:8.1f} ms  p95 {percentile(ok, 0.95) * 1000:8.1f} ms  {codes}")
+        if key != "flooder" and (len(ok) < len(results) or percentile(ok, 0.95) > args.max_regular_latency):
+            protected = False
+
+    print(f"\nshed: {stats['shed']}  admitted: {stats['admitted']}  "
+          f"service time: {(stats['service_time'] or 0) * 1000:.1f} ms")
+    print("\n".join(line for line in exposition.splitlines() if line.startswith("admission_")))
+    print(f"\nregular clients protected: {'yes' if protected else 'NO'}")
+    return protected
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--flood", type=int, default=300, help="requests the flooding client sends at once")
+    parser.add_argument("--per-client", type=int, default=5, help="sequential requests per regular client")
+    parser.add_argument("--latency", type=float, default=0.2, help="stubbed model latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=4, help="model slots")
+    parser.add_argument("--queue-limit", type=int, default=64)
+    parser.add_argument("--rate", type=float, default=2, help="model calls per second per client")
+    parser.add_argument("--burst", type=float, default=40, help="token bucket size per client")
+    parser.add_argument("--weights", default="paid=4,senior=2,tutor=1")
+    parser.add_argument("--flood-timeout", type=float, default=2.0, help="X-Request-Timeout the flooder sends")
+    parser.add_argument("--max-regular-latency", type=float, default=1.0,
+                        help="p95 in seconds regular clients must stay under")
+    parser.add_argument("--fifo", action="store_true", help="one shared FIFO queue, no admission control")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
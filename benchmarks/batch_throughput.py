@@ -0,0 +1,59 @@
+"""Throughput of /analyze/batch versus sequential /analyze calls against the latency-injecting stub backend.
+
+    python benchmarks/batch_throughput.py --items 40 --latency 0.25 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("MODEL_BACKEND", "stub")
+os.environ["ANALYSIS_CACHE_PATH"] = ""
+# Every item comes from the one test client, so the per-client rate limit is off
+os.environ["CLIENT_RATE"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import main
+from analysis_cache import AnalysisCache
+from model_backends import StubBackend
+
+
+def make_items(n, run):
+    # Distinct code per item and per run so neither the cache nor single-flight hides model latency
+    return [{"code": f"int f{run}_{i}() {{ return {i}; }}", "language": "C++", "persona": "senior"} for i in range(n)]
+
+
+async def run(n, latency, concurrency):
+    main.backend = StubBackend(latency=latency, chunk_delay=0)
+    main.analysis_cache = AnalysisCache(max_entries=0)
+    main.BATCH_CONCURRENCY = concurrency
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        for item in make_items(n, "seq"):
+            await client.post("/analyze", json=item)
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        response = await client.post("/analyze/batch", json={"items": make_items(n, "batch"), "concurrency": concurrency})
+        batch = time.perf_counter() - start
+
+    results = [json.loads(line) for line in response.text.splitlines()]
+    errors = sum(1 for r in results if "error" in r)
+    print(f"items={n} model latency={latency * 1000:.0f} ms concurrency={concurrency}")
+    print(f"sequential /analyze : {sequential:6.2f} s  {n / sequential:7.1f} items/s")
+    print(f"/analyze/batch      : {batch:6.2f} s  {n / batch:7.1f} items/s  ({sequential / batch:.1f}x)")
+    print(f"results={len(results)} errors={errors} first indices={[r['index'] for r in results[:8]]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.25, help="stub backend latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(run(args.items, args.latency, args.concurrency))
@@ -0,0 +1,148 @@
+"""Model work saved by cancelling requests whose client left or sent a newer one.
+
+Runs main.py under uvicorn with the stub model (a slow one, ``--latency``)
+and only ``--slots`` model slots, then:
+
+* abandon – ``--clients`` clients each submit different code to ``/analyze``
+  and hang up after ``--give-up`` seconds. A fresh request sent right after
+  shows whether the abandoned calls still hold the model slots
+* rerun   – one session (``X-Session-Id``) streams ``--edits`` successive
+  versions of its code from ``/analyze/stream`` ``--interval`` seconds apart,
+  without aborting the earlier ones, the way an impatient user clicks Run
+
+Each part prints the model calls that finished and were cancelled, the
+estimated tokens saved, and the time the last request took.
+
+    python benchmarks/cancellation.py --clients 8 --slots 4 --latency 3 --give-up 0.5
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server at {url} did not come up")
+
+
+def submission(i: int) -> dict:
+    code = "".join(f"def step_{i}_{n}(items):\n    return [x * {n} for x in items if x > {i}]\n\n" for n in range(30))
+    return {"code": code, "language": "Python", "persona": "senior"}
+
+
+async def counters(client) -> dict:
+    """Totals of the server's model-call and cancellation metrics."""
+    totals = {"finished": 0, "cancelled": 0, "superseded": 0, "tokens_saved": 0}
+    for line in (await client.get("/metrics")).text.splitlines():
+        name, _, value = line.rpartition(" ")
+        if name.startswith("model_call_duration_seconds_count") and 'outcome="ok"' in name:
+            totals["finished"] += float(value)
+        elif name.startswith("model_calls_cancelled_total"):
+            totals["cancelled"] += float(value)
+        elif name.startswith('requests_cancelled_total{reason="superseded"}'):
+            totals["superseded"] += float(value)
+        elif name.startswith("model_tokens_saved_total"):
+            totals["tokens_saved"] += float(value)
+    return totals
+
+
+def report(name, before, after, last):
+    delta = {name: after[name] - before[name] for name in after}
+    print(f"{name:<8} model calls finished {delta['finished']:3.0f}  cancelled {delta['cancelled']:3.0f}  "
+          f"superseded {delta['superseded']:3.0f}  tokens saved ~{delta['tokens_saved']:6.0f}  "
+          f"last request {last * 1000:6.0f} ms")
+
+
+async def abandon(client, args):
+    before = await counters(client)
+
+    async def give_up(i):
+        try:
+            await client.post("/analyze", json=submission(i), timeout=args.give_up)
+        except httpx.TimeoutException:
+            pass
+
+    await asyncio.gather(*(give_up(i) for i in range(args.clients)))
+    start = time.perf_counter()
+    (await client.post("/analyze", json=submission(10_000))).raise_for_status()
+    last = time.perf_counter() - start
+    await asyncio.sleep(0.2)
+    report("abandon", before, await counters(client), last)
+
+
+async def rerun(client, args):
+    before = await counters(client)
+    headers = {"X-Session-Id": "bench-session"}
+
+    async def stream(i):
+        start = time.perf_counter()
+        async with client.stream("POST", "/analyze/stream", json=submission(20_000 + i), headers=headers) as response:
+            events = [line async for line in response.aiter_lines() if line.startswith("event:")]
+        return events, time.perf_counter() - start
+
+    tasks = []
+    for i in range(args.edits):
+        tasks.append(asyncio.create_task(stream(i)))
+        await asyncio.sleep(args.interval)
+    results = await asyncio.gather(*tasks)
+    await asyncio.sleep(0.2)
+    report("rerun", before, await counters(client), results[-1][1])
+    outcomes = [events[-1].split(":", 1)[1].strip() if events else "none" for events, _ in results]
+    print(f"         stream outcomes: {' '.join(outcomes)}")
+
+
+async def bench(args):
+    port = free_port()
+    env = {"MODEL_BACKEND": "stub", "STUB_LATENCY": str(args.latency), "STUB_CHUNK_DELAY": "0.02",
+           "MODEL_CONCURRENCY": str(args.slots), "ANALYSIS_CACHE_PATH": "", "CLIENT_RATE": "0",
+           "NEAR_DUPLICATE_MAX_ENTRIES": "0",
+           "JOB_PATH": os.path.join(ROOT, ".bench_cancellation_jobs.sqlite3"), "PREWARM": "0"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=dict(os.environ, **env),
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        wait_for(base + "/api/cache/stats")
+        print(f"stub latency {args.latency:g} s, {args.slots} model slots\n")
+        async with httpx.AsyncClient(base_url=base, timeout=None) as client:
+            await abandon(client, args)
+            await rerun(client, args)
+    finally:
+        server.terminate()
+        server.wait()
+        for suffix in ("", "-wal", "-shm"):
+            path = env["JOB_PATH"] + suffix
+            if os.path.exists(path):
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--slots", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=3.0, help="stub delay before the first chunk in seconds")
+    parser.add_argument("--give-up", type=float, default=0.5, help="seconds before an abandoning client hangs up")
+    parser.add_argument("--edits", type=int, default=4)
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between a session's resubmissions")
+    asyncio.run(bench(parser.parse_args()))
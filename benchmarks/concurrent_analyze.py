@@ -0,0 +1,72 @@
+"""N concurrent /analyze requests against a stubbed model.
+
+With the model latency stubbed to L seconds, N concurrent requests should finish
+in roughly L (not N * L) as long as N <= MODEL_CONCURRENCY. GET / is timed while
+the burst is in flight to show the event loop stays responsive.
+
+    python benchmarks/concurrent_analyze.py --requests 20 --latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("MODEL_BACKEND", "stub")
+os.environ["ANALYSIS_CACHE_PATH"] = ""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import main
+from admission import FairScheduler
+from analysis_cache import AnalysisCache
+from model_backends import StubBackend
+
+
+def payload(i):
+    # Distinct code per request so neither the cache nor single-flight hides model latency
+    return {"code": f"int main() {{ return {i}; }}", "language": "C++", "persona": "senior"}
+
+
+async def run(n, latency, concurrency, queue_limit):
+    main.backend = StubBackend(latency=latency, chunk_delay=0)
+    main.analysis_cache = AnalysisCache(max_entries=0)
+    # No per-client rate limit: every request comes from the same test client
+    main.model_limiter = FairScheduler(concurrency, queue_limit)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        await client.post("/analyze", json=payload(-1))
+        single = time.perf_counter() - start
+
+        async def timed_index():
+            await asyncio.sleep(latency / 4)
+            t = time.perf_counter()
+            await client.get("/")
+            return time.perf_counter() - t
+
+        start = time.perf_counter()
+        index_task = asyncio.create_task(timed_index())
+        responses = await asyncio.gather(*(client.post("/analyze", json=payload(i)) for i in range(n)))
+        burst = time.perf_counter() - start
+        index_latency = await index_task
+
+    codes = {}
+    for r in responses:
+        codes[r.status_code] = codes.get(r.status_code, 0) + 1
+    print(f"model latency      : {latency * 1000:.0f} ms")
+    print(f"single request     : {single * 1000:.1f} ms")
+    print(f"{n} concurrent      : {burst * 1000:.1f} ms  ({burst / single:.2f}x single)")
+    print(f"GET / during burst : {index_latency * 1000:.1f} ms")
+    print(f"status codes       : {codes}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5, help="stubbed model latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=None, help="model slots (default: --requests)")
+    parser.add_argument("--queue-limit", type=int, default=32)
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.latency, args.concurrency or args.requests, args.queue_limit))
@@ -0,0 +1,108 @@
+"""Edit-and-resubmit loop: full re-analysis against incremental (per-unit) re-analysis.
+
+Generates a Python file of ``--functions`` functions, analyzes it once, then
+edits one function per round and resubmits, ``--rounds`` times, in both
+``full`` and ``incremental`` mode. The stub model's latency grows with the
+prompt (``--ms-per-1k-tokens`` on top of ``--latency``), like a real model's
+prefill, so the printout shows whether latency and prompt tokens per edit
+follow the size of the file or the size of the edit. Near-duplicate reuse is
+switched off, as it is by default, so every ``full`` edit reaches the model
+(it never answers a caller's own resubmissions either):
+
+    python benchmarks/incremental_edits.py --functions 10 40 160 --rounds 5
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+os.environ.update({"MODEL_BACKEND": "stub", "ANALYSIS_CACHE_PATH": "", "CLIENT_RATE": "0",
+                   "NEAR_DUPLICATE_THRESHOLD": ""})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import main
+from admission import FairScheduler
+from analysis_cache import AnalysisCache
+from compaction import estimate_tokens
+from model_backends import StubBackend
+
+
+class PrefillStub(StubBackend):
+    """Stub whose latency grows with the prompt, and which counts the prompt tokens it was sent."""
+
+    def __init__(self, per_token: float, **kwargs):
+        super().__init__(**kwargs)
+        self.per_token = per_token
+        self.prompt_tokens = 0
+
+    async def generate_async(self, prompt: str) -> str:
+        tokens = estimate_tokens(prompt)
+        self.prompt_tokens += tokens
+        await asyncio.sleep(tokens * self.per_token)
+        return await super().generate_async(prompt)
+
+
+def function(i, version):
+    return (f"def step_{i}(items, limit={version}):\n"
+            f"    \"\"\"Step {i} of the pipeline.\"\"\"\n"
+            f"    total = 0\n"
+            f"    for item in items:\n"
+            f"        if item % {i + 2} == {version % (i + 2)}:\n"
+            f"            total += item * {i}\n"
+            f"        elif item > limit:\n"
+            f"            total -= limit\n"
+            f"    return total\n")
+
+
+def source(versions):
+    return "import sys\n\n\n" + "\n\n".join(function(i, v) for i, v in enumerate(versions))
+
+
+async def edit_loop(client, backend, functions, rounds, mode, seed):
+    rng = random.Random(seed)
+    versions = [0] * functions
+    payload = {"language": "Python", "persona": "senior", "mode": mode}
+    start = time.perf_counter()
+    await client.post("/analyze", json={**payload, "code": source(versions)})
+    first, first_tokens = time.perf_counter() - start, backend.prompt_tokens
+    latencies, tokens = [], []
+    for _ in range(rounds):
+        versions[rng.randrange(functions)] += 1
+        before = backend.prompt_tokens
+        start = time.perf_counter()
+        response = await client.post("/analyze", json={**payload, "code": source(versions)})
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        tokens.append(backend.prompt_tokens - before)
+    return first, first_tokens, sum(latencies) / rounds, sum(tokens) / rounds
+
+
+async def bench(args):
+    print(f"stub latency {args.latency * 1000:.0f} ms + {args.ms_per_1k_tokens:.0f} ms per 1k prompt tokens, "
+          f"{args.rounds} one-function edits per run\n")
+    print(f"{'functions':>9} {'mode':<12} {'first':>9} {'tokens':>7} {'per edit':>10} {'tokens':>7}")
+    for functions in args.functions:
+        for mode in ("full", "incremental"):
+            main.backend = backend = PrefillStub(args.ms_per_1k_tokens / 1e6, latency=args.latency, chunk_delay=0)
+            main.analysis_cache = AnalysisCache(max_entries=100000)
+            main.model_limiter = FairScheduler(64, 1024)
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                first, first_tokens, per_edit, edit_tokens = await edit_loop(client, backend, functions, args.rounds,
+                                                                             mode, args.seed)
+            print(f"{functions:9d} {mode:<12} {first * 1000:7.0f} ms {first_tokens:7d} "
+                  f"{per_edit * 1000:8.0f} ms {edit_tokens:7.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--functions", type=int, nargs="+", default=[10, 40, 160])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.2, help="stubbed model latency per call in seconds")
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=100, help="extra stub latency per 1k prompt tokens")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(bench(parser.parse_args()))
@@ -0,0 +1,82 @@
+"""Job throughput of POST /jobs against worker count, over a single client connection.
+
+Submits ``--jobs`` analyses through ``POST /jobs`` and waits for them with
+long-polling ``GET /jobs/{id}?wait=``, all from one HTTP connection, for each
+worker count in ``--workers``. The stub model takes ``--latency`` seconds, so
+throughput should grow with the worker count, not with connections:
+
+    python benchmarks/job_throughput.py --jobs 64 --workers 1 2 4 8 --latency 0.25
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+os.environ.update({
+    "MODEL_BACKEND": "stub",
+    "ANALYSIS_CACHE_PATH": "",
+    "CLIENT_RATE": "0",
+    "JOB_PATH": os.path.join(tempfile.mkdtemp(prefix="job-bench-"), "jobs.sqlite3"),
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import main
+from admission import FairScheduler
+from analysis_cache import AnalysisCache
+from jobs import JobQueue, JobStore
+from model_backends import StubBackend
+
+
+def payload(run, i):
+    return {"code": f"# run {run} job {i}\nint main() {{ return {i}; }}", "language": "C++", "persona": "senior"}
+
+
+async def run(workers, jobs, latency, directory):
+    main.backend = StubBackend(latency=latency, chunk_delay=0)
+    main.analysis_cache = AnalysisCache(max_entries=0)
+    main.model_limiter = FairScheduler(64, 1024)
+    main.job_queue = queue = JobQueue(JobStore(os.path.join(directory, f"jobs-{workers}.sqlite3")),
+                                      main.run_job, workers=workers, poll_interval=0.1)
+    queue.start()
+    limits = httpx.Limits(max_connections=1)
+    transport = httpx.ASGITransport(app=main.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None,
+                                     limits=limits) as client:
+            start = time.perf_counter()
+            ids = []
+            for i in range(jobs):
+                response = await client.post("/jobs", json=payload(workers, i))
+                ids.append(response.json()["id"])
+            submitted = time.perf_counter() - start
+            statuses = {}
+            for job_id in ids:
+                while True:
+                    job = (await client.get(f"/jobs/{job_id}", params={"wait": 30})).json()
+                    if job["status"] in ("done", "failed"):
+                        break
+                statuses[job["status"]] = statuses.get(job["status"], 0) + 1
+            elapsed = time.perf_counter() - start
+    finally:
+        await queue.stop()
+    print(f"workers {workers:3d}  submit {submitted * 1000:7.1f} ms  all finished {elapsed:6.2f} s  "
+          f"{jobs / elapsed:7.1f} jobs/s  {statuses}")
+
+
+async def bench(args):
+    directory = tempfile.mkdtemp(prefix="job-bench-")
+    print(f"{args.jobs} jobs, model latency {args.latency * 1000:.0f} ms, one client connection")
+    for workers in args.workers:
+        await run(workers, args.jobs, args.latency, directory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=64)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--latency", type=float, default=0.25, help="stubbed model latency in seconds")
+    asyncio.run(bench(parser.parse_args()))
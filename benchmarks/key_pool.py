@@ -0,0 +1,119 @@
+"""Throughput under per-key quotas: one API key against a routed pool of keys and model tiers.
+
+Every stub key allows ``--rpm`` requests and ``--tpm`` tokens per
+``--window`` seconds and answers anything beyond that with a quota error (the
+real API's 429). Requests arrive at ``--rate`` per second for
+``--duration`` seconds, with prompts of mixed sizes, and go through the
+resilience layer as in the app. Four setups:
+
+* ``single``   – one key, no router: quota errors reach the caller
+* ``reactive`` – ``--keys`` keys, routed on quota errors and cool-downs alone
+  (no ``MODEL_LIMITS``)
+* ``aware``    – the same keys with their limits known, so calls go where
+  there is headroom and wait briefly rather than hit a 429
+* ``tiered``   – ``aware`` plus a second model tier on the same keys
+
+For each it prints the share of requests answered, how many failed with a
+quota error (a 503 in the app), the 429s the upstream sent, p50/p95 latency,
+and how the answered calls were spread over the keys.
+
+    python benchmarks/key_pool.py --rate 16 --duration 20 --keys 3 --rpm 5 --tpm 20000
+"""
+import argparse
+import asyncio
+import collections
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_backends import QuotaExceededError, StubBackend
+from resilience import ResilientBackend
+from routing import Route, RoutedBackend, key_label
+
+SETUPS = ("single", "reactive", "aware", "tiered")
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] if ordered else 0.0
+
+
+def make_stub(args, key, model):
+    return StubBackend(latency=args.latency, chunk_delay=0, seed=args.seed, model_name=model, api_key=key,
+                       rpm=args.rpm, tpm=args.tpm, quota_window=args.window)
+
+
+def make_setup(name, args):
+    """The backend to call and the stubs behind it."""
+    if name == "single":
+        stub = make_stub(args, "key-0", "flash")
+        return ResilientBackend(stub, timeout=30), [stub]
+    models = ["flash", "flash-lite"] if name == "tiered" else ["flash"]
+    limits = {"rpm": args.rpm, "tpm": args.tpm} if name != "reactive" else {}
+    tiers = [[Route(make_stub(args, f"key-{k}", model), key_label(f"key-{k}"), window=args.window, **limits)
+              for k in range(args.keys)] for model in models]
+    router = RoutedBackend(tiers, max_wait=args.max_wait, cooldown=args.window)
+    return ResilientBackend(router, timeout=30), [route.backend for route in router.routes]
+
+
+def prompt(i, rng):
+    # Mostly small submissions with the occasional large one
+    lines = rng.choice([20] * 8 + [200, 800])
+    return f"Review request {i}.\nCODE:\n" + "".join(f"value_{i}_{n} = compute({n}, limit={n * 7})\n"
+                                                     for n in range(lines))
+
+
+async def run_setup(name, args):
+    backend, stubs = make_setup(name, args)
+    rng = random.Random(args.seed)
+    latencies, quota, errors = [], 0, 0
+
+    async def one(i):
+        nonlocal quota, errors
+        start = time.perf_counter()
+        try:
+            await backend.generate_async(prompt(i, rng))
+            latencies.append(time.perf_counter() - start)
+        except QuotaExceededError:
+            quota += 1
+        except Exception:
+            errors += 1
+
+    tasks, start, total = [], time.perf_counter(), int(args.rate * args.duration)
+    for i in range(total):
+        await asyncio.sleep(max(0.0, start + i / args.rate - time.perf_counter()))
+        tasks.append(asyncio.create_task(one(i)))
+    await asyncio.gather(*tasks)
+    upstream_429 = sum(stub.quota_errors for stub in stubs)
+    spread = collections.Counter()
+    for stub in stubs:
+        spread[stub.api_key] += stub.calls
+    print(f"{name:<9} ok {len(latencies) / total:6.1%}  quota {quota:4d}  other errors {errors:3d}  "
+          f"upstream 429s {upstream_429:4d}  p50 {percentile(latencies, 0.5) * 1000:6.0f}  "
+          f"p95 {percentile(latencies, 0.95) * 1000:6.0f} ms  calls per key "
+          + " ".join(str(spread[key]) for key in sorted(spread)))
+
+
+async def bench(args):
+    print(f"{args.rate:g} requests/s for {args.duration:g} s; each key allows {args.rpm} requests and "
+          f"{args.tpm} tokens per {args.window:g} s; stub latency {args.latency * 1000:.0f} ms\n")
+    for name in args.setups:
+        await run_setup(name, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=16, help="requests per second")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--keys", type=int, default=3)
+    parser.add_argument("--rpm", type=int, default=5, help="requests per key and window")
+    parser.add_argument("--tpm", type=int, default=20000, help="tokens per key and window")
+    parser.add_argument("--window", type=float, default=1.0, help="quota window in seconds (60 upstream)")
+    parser.add_argument("--max-wait", type=float, default=2.0, help="ROUTER_MAX_WAIT")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--setups", nargs="+", choices=SETUPS, default=list(SETUPS))
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(bench(parser.parse_args()))
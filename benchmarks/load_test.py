@@ -0,0 +1,323 @@
+"""End-to-end load test of main.py and main_new.py with the stub model backend.
+
+Drives ``GET /``, ``POST /analyze`` (``/api/assess`` for main_new) and
+``POST /api/download`` at a fixed concurrency with code payloads from 1 KB to
+1 MB and short or long report feedback. For every scenario it reports
+throughput, p50/p95/p99 latency and, when the app runs in-process, the event
+loop lag sampled while the scenario was running. Results can be written as
+JSON and compared against an earlier run:
+
+    python benchmarks/load_test.py --app main --concurrency 16 --requests 200 --output before.json
+    python benchmarks/load_test.py --app main --concurrency 16 --requests 200 --compare before.json
+    python benchmarks/load_test.py --app main main_new --scenarios index analyze --code-kb 1 64
+
+``--server uvicorn`` runs each app in a uvicorn subprocess instead; loop lag is
+then not available from the client side. Payloads are unique per request and
+the analysis cache is disabled, so caches never hide the work being measured
+(``--repeat`` sends one payload over and over to measure the cached path).
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx
+
+FEEDBACK_KB = {"short": 1, "long": 200}
+ANALYZE_PATH = {"main": "/analyze", "main_new": "/api/assess"}
+
+FUNCTION = '''def transform_{n}(items, limit={n}):
+    """Filter and square the values below the limit."""
+    result = []
+    for item in items:
+        if item < limit and item not in result:
+            result.append(item * item)
+    return result
+
+'''
+FINDING = ("## Finding {n}\nThe loop on **line {n}** recomputes `len(items)` on every pass; hoist it out of the loop "
+           "and use a set for the membership test.\n\n- Complexity drops from O(n^2) to O(n)\n\n")
+
+
+def server_env(latency, chunk_delay, pdf_cache_dir):
+    return {
+        "MODEL_BACKEND": "stub",
+        "STUB_LATENCY": str(latency),
+        "STUB_CHUNK_DELAY": str(chunk_delay),
+        "ANALYSIS_CACHE_SIZE": "0",
+        "ANALYSIS_CACHE_PATH": "",
+        "PDF_CACHE_DIR": pdf_cache_dir,
+        "PDF_QUEUE_LIMIT": "100000",
+        "MODEL_QUEUE_LIMIT": "100000",
+        # All load comes from one client address; admission control is measured by admission_burst.py
+        "CLIENT_RATE": "0",
+        "REQUEST_DEADLINE": "3600",
+    }
+
+
+def make_code(kb, seed):
+    body = FUNCTION * max(1, kb * 1024 // len(FUNCTION))
+    return f"# request {seed}\n" + body.replace("transform_{n}", f"transform_{seed}_{{n}}").format(n=seed)
+
+
+def make_feedback(kind, seed):
+    size = FEEDBACK_KB[kind] * 1024
+    text = f"# Review {seed}\n\n" + FINDING.format(n=seed) * max(1, size // len(FINDING))
+    return text
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def summarize_ms(samples):
+    return {
+        "p50": round(percentile(samples, 0.50) * 1000, 2),
+        "p95": round(percentile(samples, 0.95) * 1000, 2),
+        "p99": round(percentile(samples, 0.99) * 1000, 2),
+        "max": round(max(samples) * 1000, 2),
+        "mean": round(sum(samples) / len(samples) * 1000, 2),
+    } if samples else None
+
+
+class LoopLagSampler:
+    """Sleeps ``interval`` in a loop and records how late each wake-up is."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+    def start(self):
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return self.samples
+
+
+def build_request(app_name, scenario, payload, seed, language="Python"):
+    if scenario == "index":
+        return "GET", "/", None
+    if scenario == "analyze":
+        body = {"code": make_code(payload, seed), "language": language, "persona": "senior"}
+        return "POST", ANALYZE_PATH[app_name], body
+    # main_new's FPDF export only handles latin-1, so the feedback stays ASCII
+    return "POST", "/api/download", {"feedback": make_feedback(payload, seed), "language": language}
+
+
+async def run_scenario(client, app_name, scenario, payload, concurrency, total, repeat, lag_sampler):
+    # Build the bodies up front so payload generation is not part of the timings
+    requests = [build_request(app_name, scenario, payload, 0 if repeat else i) for i in range(total)]
+    # One warm-up request outside the measurement (imports, fonts, process pool start-up)
+    method, path, body = build_request(app_name, scenario, payload, -1)
+    await client.request(method, path, json=body)
+
+    latencies, statuses, errors = [], {}, 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < total:
+            method, path, body = requests[next_index]
+            next_index += 1
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                await response.aread()
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+                statuses["error"] = statuses.get("error", 0) + 1
+            latencies.append(time.perf_counter() - start)
+
+    if lag_sampler:
+        lag_sampler.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    lag = await lag_sampler.stop() if lag_sampler else []
+
+    return {
+        "app": app_name,
+        "scenario": scenario,
+        "payload": f"{payload}kb" if isinstance(payload, int) else payload,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "status": {str(k): v for k, v in sorted(statuses.items(), key=str)},
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2),
+        "latency_ms": summarize_ms(latencies),
+        "loop_lag_ms": summarize_ms(lag),
+    }
+
+
+def scenario_payloads(scenario, args):
+    if scenario == "index":
+        return ["-"]
+    if scenario == "analyze":
+        return args.code_kb
+    return args.feedback
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server at {url} did not come up")
+
+
+async def bench_app(app_name, args, env):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    server, lag_sampler = None, None
+    if args.server == "uvicorn":
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", f"{app_name}:app", "--port", str(port), "--log-level", "warning"],
+            cwd=ROOT, env=dict(os.environ, **env),
+        )
+        base = f"http://127.0.0.1:{port}"
+        wait_for(base + "/")
+        client = httpx.AsyncClient(base_url=base, timeout=None, limits=limits)
+    else:
+        os.environ.update(env)
+        module = importlib.import_module(app_name)
+        # App errors become 500s in the results instead of aborting the run
+        transport = httpx.ASGITransport(app=module.app, raise_app_exceptions=False)
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench",
+                                   timeout=None, limits=limits)
+        lag_sampler = LoopLagSampler()
+
+    results = []
+    try:
+        async with client:
+            for scenario in args.scenarios:
+                for payload in scenario_payloads(scenario, args):
+                    result = await run_scenario(client, app_name, scenario, payload, args.concurrency,
+                                                args.requests, args.repeat, lag_sampler)
+                    results.append(result)
+                    print_row(result)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        elif hasattr(sys.modules.get(app_name), "pdf_renderer"):
+            sys.modules[app_name].pdf_renderer.shutdown()
+    return results
+
+
+def print_row(r):
+    lat, lag = r["latency_ms"], r["loop_lag_ms"]
+    lag_text = f"lag p99 {lag['p99']:7.1f} max {lag['max']:7.1f}" if lag else "lag n/a"
+    print(f"{r['app']:<9} {r['scenario']:<8} {r['payload']:>6}  {r['throughput_rps']:8.1f} req/s  "
+          f"p50 {lat['p50']:8.1f}  p95 {lat['p95']:8.1f}  p99 {lat['p99']:8.1f} ms  {lag_text}  "
+          f"errors {r['errors']}")
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(r["app"], r["scenario"], r["payload"]): r for r in json.load(f)["results"]}
+    print(f"\ncompared with {baseline_path} (ratio new/old; throughput higher is better, latency lower is better)")
+    for r in results:
+        old = baseline.get((r["app"], r["scenario"], r["payload"]))
+        if old is None:
+            continue
+        ratios = [f"rps {r['throughput_rps'] / old['throughput_rps']:5.2f}x"]
+        for p in ("p50", "p99"):
+            if old["latency_ms"][p]:
+                ratios.append(f"{p} {r['latency_ms'][p] / old['latency_ms'][p]:5.2f}x")
+        print(f"{r['app']:<9} {r['scenario']:<8} {r['payload']:>6}  " + "  ".join(ratios))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args):
+    pdf_cache_dir = tempfile.mkdtemp(prefix="load-test-pdf-")
+    env = server_env(args.latency, args.chunk_delay, pdf_cache_dir)
+    results = []
+    for app_name in args.app:
+        results += await bench_app(app_name, args, env)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "server": args.server,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "stub_latency": args.latency,
+            "stub_chunk_delay": args.chunk_delay,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nwrote {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", nargs="+", choices=sorted(ANALYZE_PATH), default=["main", "main_new"])
+    parser.add_argument("--server", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--scenarios", nargs="+", choices=["index", "analyze", "download"],
+                        default=["index", "analyze", "download"])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario and payload")
+    parser.add_argument("--code-kb", type=int, nargs="+", default=[1, 64, 1024], help="analyze payload sizes")
+    parser.add_argument("--feedback", nargs="+", choices=sorted(FEEDBACK_KB), default=["short", "long"],
+                        help="report sizes for /api/download")
+    parser.add_argument("--latency", default="0.2", help="stub latency: seconds or a distribution spec")
+    parser.add_argument("--chunk-delay", default="0", help="stub delay between streamed chunks")
+    parser.add_argument("--repeat", action="store_true", help="send the same payload every time")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare against")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,75 @@
+"""Local pre-analysis time per submission, including valid code nested deeper than a recursive walk allows.
+
+Times ``static_analysis.analyze``, ``compaction.compact`` and
+``incremental.split_units`` on generated Python: a file of ``--functions``
+ordinary functions, and chains of ``--terms`` additions (``x = 1 + 1 + ...``,
+``TABLE = [0] + [1] + ...``), which parse fine but nest one level per term.
+Each case is then sent to ``/analyze`` in every mode with the stub model;
+all of them must answer 200, with the deep ones reported as not analyzable
+rather than failing the request.
+
+    python benchmarks/local_analysis.py --functions 200 --terms 800 20000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+os.environ.update({"MODEL_BACKEND": "stub", "ANALYSIS_CACHE_PATH": "", "CLIENT_RATE": "0",
+                   "NEAR_DUPLICATE_MAX_ENTRIES": "0"})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import main
+from compaction import compact
+from incremental import split_units
+from model_backends import StubBackend
+from static_analysis import analyze
+
+
+def functions(n):
+    return "".join(f"def step_{i}(items):\n    return [x * {i} for x in items if x > {i}]\n\n" for i in range(n))
+
+
+def cases(args):
+    yield f"{args.functions} functions", functions(args.functions)
+    for terms in args.terms:
+        yield f"x = 1+1... ({terms})", "x = 1" + "+1" * terms + "\n"
+        yield f"[0]+[1]... ({terms})", "TABLE = [0]" + " + [1]" * terms + "\n\n" + functions(3)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+async def bench(args):
+    main.backend = StubBackend(latency=0, chunk_delay=0)
+    transport = httpx.ASGITransport(app=main.app)
+    failed = 0
+    print(f"{'case':<26} {'analyze':>9} {'compact':>9} {'units':>9}  parse error / status per mode")
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for name, code in cases(args):
+            report, analyze_ms = timed(analyze, code, "Python")
+            _, compact_ms = timed(compact, code, "Python", report)
+            _, units_ms = timed(split_units, code, "Python")
+            statuses = []
+            for mode in ("full", "fast", "incremental"):
+                response = await client.post("/analyze", json={"code": code, "language": "Python",
+                                                               "persona": "senior", "mode": mode})
+                statuses.append(f"{mode} {response.status_code}")
+                failed += response.status_code != 200
+            print(f"{name:<26} {analyze_ms:7.1f} ms {compact_ms:7.1f} ms {units_ms:7.1f} ms  "
+                  f"{report['parse_error'] or '-'}; {', '.join(statuses)}")
+    if failed:
+        sys.exit(f"{failed} requests did not answer 200")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--functions", type=int, default=200)
+    parser.add_argument("--terms", type=int, nargs="+", default=[800, 20000])
+    asyncio.run(bench(parser.parse_args()))
@@ -0,0 +1,199 @@
+"""Near-duplicate index: lookup latency and memory at scale, and reuse on a simulated classroom.
+
+Two parts:
+
+* scale – fills one shard with ``--entries`` synthetic signatures, then times
+  lookups for perturbed copies of stored entries (hits) and for fresh ones
+  (misses), and reports bytes per entry
+* classroom – ``--students`` submit each of a few assignments with renamed
+  variables, reformatting and small edits, one by one. Reports how many
+  model calls the index saves, whether any submission was matched to a
+  different assignment, and the time to sign a submission
+
+    python benchmarks/near_duplicates.py --entries 1000000 --lookups 2000
+    python benchmarks/near_duplicates.py --entries 100000 --students 200 --threshold 0.85
+"""
+import argparse
+import os
+import random
+import re
+import resource
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from near_duplicate import BANDS, ROWS, SLOTS, NearDuplicateIndex, Signature, _hash64, signature
+
+ASSIGNMENTS = {
+    "bubble_sort": '''def bubble_sort(arr):
+    n = len(arr)
+    for i in range(n):
+        swapped = False
+        for j in range(0, n - i - 1):
+            if arr[j] > arr[j + 1]:
+                arr[j], arr[j + 1] = arr[j + 1], arr[j]
+                swapped = True
+        if not swapped:
+            break
+    return arr
+
+
+print(bubble_sort([64, 34, 25, 12, 22, 11, 90]))
+''',
+    "word_count": '''def word_count(path):
+    counts = {}
+    with open(path) as handle:
+        for line in handle:
+            for word in line.lower().split():
+                word = word.strip(".,;:!?")
+                if word:
+                    counts[word] = counts.get(word, 0) + 1
+    return sorted(counts.items(), key=lambda item: -item[1])[:10]
+
+
+for word, count in word_count("book.txt"):
+    print(word, count)
+''',
+    "binary_search": '''def binary_search(items, target):
+    low, high = 0, len(items) - 1
+    while low <= high:
+        mid = (low + high) // 2
+        if items[mid] == target:
+            return mid
+        if items[mid] < target:
+            low = mid + 1
+        else:
+            high = mid - 1
+    return -1
+
+
+data = list(range(0, 100, 3))
+print(binary_search(data, 42), binary_search(data, 43))
+''',
+    "fizzbuzz": '''def fizzbuzz(limit):
+    out = []
+    for number in range(1, limit + 1):
+        if number % 15 == 0:
+            out.append("FizzBuzz")
+        elif number % 3 == 0:
+            out.append("Fizz")
+        elif number % 5 == 0:
+            out.append("Buzz")
+        else:
+            out.append(str(number))
+    return out
+
+
+print("\\n".join(fizzbuzz(30)))
+''',
+}
+NAMES = ["a", "b", "x", "y", "data", "values", "result", "tmp", "idx", "k", "total", "acc", "lst", "seq", "item"]
+
+
+def variant(code, rng):
+    """A student's take on an assignment: renamed locals, different spacing and comments, maybe a small edit."""
+    keep = {"def", "for", "in", "range", "len", "if", "not", "break", "return", "print", "with", "open", "as",
+            "while", "else", "elif", "lambda", "sorted", "list", "str", "and", "or", "True", "False"}
+    idents = sorted({w for w in re.findall(r"\b[a-z_][a-z_0-9]*\b", code)} - keep)
+    renamed = {name: rng.choice(NAMES) + str(rng.randrange(100)) for name in idents if rng.random() < 0.7}
+    lines = []
+    for line in re.sub(r"\b[a-z_][a-z_0-9]*\b", lambda m: renamed.get(m[0], m[0]), code).splitlines():
+        if rng.random() < 0.1:
+            lines.append(line[:len(line) - len(line.lstrip())] + "# " + rng.choice(["TODO", "step", "check this"]))
+        lines.append(line.replace(" = ", "=") if rng.random() < 0.2 else line)
+        if rng.random() < 0.05:
+            lines.append("")
+    if rng.random() < 0.3:
+        # A small real edit: one extra statement in the body
+        at = rng.randrange(1, len(lines) - 3)
+        indent = lines[at][:len(lines[at]) - len(lines[at].lstrip())] or "    "
+        lines.insert(at, f"{indent}debug = {rng.randrange(10)}")
+    return "\n".join(lines) + "\n"
+
+
+def synthetic(slots: bytes) -> Signature:
+    bands = tuple(_hash64(slots[b * ROWS:(b + 1) * ROWS]) & 0xFFFFFFFF for b in range(BANDS))
+    return Signature(slots, bands, SLOTS)
+
+
+def perturb(slots: bytes, changed: int, rng) -> bytes:
+    out = bytearray(slots)
+    for i in rng.sample(range(SLOTS), changed):
+        out[i] = (out[i] + 1 + rng.randrange(255)) % 256
+    return bytes(out)
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def scale(args):
+    rng = random.Random(args.seed)
+    index = NearDuplicateIndex(threshold=args.threshold, max_entries=args.entries)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    stored = []
+    start = time.perf_counter()
+    for i in range(args.entries):
+        slots = rng.randbytes(SLOTS)
+        if i % (args.entries // args.lookups or 1) == 0:
+            stored.append(slots)
+        index.add("scope", synthetic(slots), f"{i:064x}")
+    elapsed = time.perf_counter() - start
+    rss = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) * 1024
+    print(f"scale: {len(index):,} entries added in {elapsed:.1f} s ({elapsed / args.entries * 1e6:.1f} us each); "
+          f"index {index.memory_bytes() / len(index):.0f} B/entry ({index.memory_bytes() / 2 ** 20:.0f} MB), "
+          f"peak RSS growth {rss / 2 ** 20:.0f} MB")
+
+    # A hit differs in a few slots (similarity ~0.95); a miss shares nothing with any stored entry
+    changed = max(0, round(SLOTS * (1 - (1 + args.threshold) / 2)))
+    for label, queries in (("hit", [synthetic(perturb(s, changed, rng)) for s in stored[:args.lookups]]),
+                           ("miss", [synthetic(rng.randbytes(SLOTS)) for _ in range(args.lookups)])):
+        timings, found = [], 0
+        for sig in queries:
+            t = time.perf_counter()
+            found += index.lookup("scope", sig) is not None
+            timings.append(time.perf_counter() - t)
+        print(f"  lookup {label:<4} p50 {percentile(timings, 0.5) * 1e6:6.1f} us  "
+              f"p99 {percentile(timings, 0.99) * 1e6:6.1f} us  found {found}/{len(queries)}")
+
+
+def classroom(args):
+    rng = random.Random(args.seed)
+    index = NearDuplicateIndex(threshold=args.threshold)
+    owner, calls, reused, wrong, sign_times = {}, 0, 0, 0, []
+    submissions = [(name, variant(code, rng)) for _ in range(args.students) for name, code in ASSIGNMENTS.items()]
+    rng.shuffle(submissions)
+    for i, (assignment, code) in enumerate(submissions):
+        t = time.perf_counter()
+        sig = signature(code, "Python")
+        sign_times.append(time.perf_counter() - t)
+        found = index.lookup("Python", sig)
+        if found is not None:
+            reused += 1
+            wrong += owner[found[0]] != assignment
+            continue
+        # Miss: the model would be called, and the submission indexed
+        calls += 1
+        key = f"{i:064x}"
+        owner[key] = assignment
+        index.add("Python", sig, key)
+    print(f"\nclassroom: {len(submissions)} submissions ({args.students} students x {len(ASSIGNMENTS)} assignments), "
+          f"threshold {args.threshold}")
+    print(f"  model calls {calls} (without the index: {len(submissions)}), reused {reused}, "
+          f"matched to the wrong assignment {wrong}")
+    print(f"  signing a submission: median {statistics.median(sign_times) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    scale(args)
+    classroom(args)
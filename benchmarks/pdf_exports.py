@@ -0,0 +1,91 @@
+"""Concurrent PDF exports while GET / latency is sampled.
+
+Runs the app in-process with the local stub backend. With --workers 0 the
+reports are rendered in a thread of the server process, which still shares the
+GIL with the event loop and shows up as GET / latency spikes; with a process
+pool they should stay flat.
+
+    python benchmarks/pdf_exports.py --exports 16 --feedback-kb 200 --workers 2
+    python benchmarks/pdf_exports.py --exports 16 --feedback-kb 200 --workers 0
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("MODEL_BACKEND", "stub")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import main
+from pdf_export import PDFRenderer
+
+
+def make_feedback(kb, seed):
+    paragraph = f"## Finding {seed}\nThe loop on **line 12** recomputes `len(items)` on every pass; hoist it.\n\n"
+    return paragraph * max(1, kb * 1024 // len(paragraph))
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def run(exports, feedback_kb, workers):
+    main.pdf_renderer = PDFRenderer(workers=workers, timeout=120, queue_limit=exports, cache_dir=tempfile.mkdtemp())
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await client.get("/")
+        done = asyncio.Event()
+        index_latencies = []
+
+        async def sample_index():
+            # Measured from when the request was due, so time spent waiting for a blocked loop counts
+            while not done.is_set():
+                due = time.perf_counter() + 0.01
+                await asyncio.sleep(0.01)
+                await client.get("/")
+                index_latencies.append(time.perf_counter() - due)
+
+        async def export(i):
+            body = {"feedback": make_feedback(feedback_kb, i), "language": "Python"}
+            return await client.post("/api/download", json=body)
+
+        sampler = asyncio.create_task(sample_index())
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(export(i) for i in range(exports)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await sampler
+
+        # Re-export of the same report: served from the render cache, then as a 304
+        body = {"feedback": make_feedback(feedback_kb, 0), "language": "Python"}
+        t = time.perf_counter()
+        repeat = await client.post("/api/download", json=body)
+        cached = time.perf_counter() - t
+        t = time.perf_counter()
+        not_modified = await client.post("/api/download", json=body, headers={"If-None-Match": repeat.headers["etag"]})
+        revalidated = time.perf_counter() - t
+
+    main.pdf_renderer.shutdown()
+    codes = {}
+    for r in responses:
+        codes[r.status_code] = codes.get(r.status_code, 0) + 1
+    print(f"workers={workers} exports={exports} feedback={feedback_kb} KB  status={codes}")
+    print(f"all exports finished in {elapsed:.2f} s")
+    print(f"GET / during exports: n={len(index_latencies)} p50={statistics.median(index_latencies) * 1000:.1f} ms "
+          f"p99={percentile(index_latencies, 0.99) * 1000:.1f} ms max={max(index_latencies) * 1000:.1f} ms")
+    print(f"cached re-export: {cached * 1000:.1f} ms   If-None-Match: {not_modified.status_code} in {revalidated * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--exports", type=int, default=16)
+    parser.add_argument("--feedback-kb", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=2, help="PDF process pool size; 0 renders in a thread")
+    args = parser.parse_args()
+    asyncio.run(run(args.exports, args.feedback_kb, args.workers))
@@ -0,0 +1,120 @@
+"""Cold start: import time per module and time until uvicorn accepts connections.
+
+Two measurements, each in fresh interpreter processes so nothing is cached:
+
+* ``python -X importtime -c "import main"``: the modules that dominate the
+  import, by cumulative time (``--top``)
+* uvicorn started as in the Dockerfile; the time from spawning it until the
+  port accepts a TCP connection ("bind") and until ``GET /`` answers
+  ("first response"), median of ``--runs``
+
+With ``--budget-ms`` the script exits non-zero when the median bind time is
+over budget, so it can gate a deploy:
+
+    python benchmarks/startup_time.py --runs 5 --budget-ms 1500
+    python benchmarks/startup_time.py --app main_new --output startup.json
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def import_profile(app, env):
+    """Cumulative import time in ms per module, from ``-X importtime``."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {app}"], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, self_us, cumulative_us, name = (part.strip() for part in line.replace("import time:", "|").split("|"))
+        # Indentation of the name is its depth in the import tree
+        depth = (len(line.rsplit("|", 1)[1]) - len(line.rsplit("|", 1)[1].lstrip()) - 1) // 2
+        modules.append({"module": name, "depth": depth, "self_ms": int(self_us) / 1000,
+                        "cumulative_ms": int(cumulative_us) / 1000})
+    return modules
+
+
+def time_to_bind(app, env, timeout=60):
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", f"{app}:app", "--port", str(port),
+                               "--log-level", "warning"], cwd=ROOT, env=env)
+    try:
+        bound = None
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with {server.returncode}")
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.05):
+                    bound = time.perf_counter() - start
+                    break
+            except OSError:
+                time.sleep(0.002)
+        if bound is None:
+            raise RuntimeError("server did not bind in time")
+        httpx.get(f"http://127.0.0.1:{port}/", timeout=timeout)
+        first_response = time.perf_counter() - start
+        return bound, first_response
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(args):
+    env = dict(os.environ, MODEL_BACKEND=args.backend, PREWARM="0" if args.no_prewarm else "1")
+    env.setdefault("GEMINI_API_KEY", "startup-benchmark")
+    env.setdefault("PYTHONWARNINGS", "ignore")
+    modules = import_profile(args.app, env)
+    total = next(m["cumulative_ms"] for m in reversed(modules) if m["module"] == args.app)
+    print(f"import {args.app}: {total:.0f} ms (MODEL_BACKEND={args.backend})\n")
+    print(f"{'cumulative':>10} {'self':>8}  module")
+    direct = [m for m in modules if m["depth"] == 1]
+    for m in sorted(direct, key=lambda m: -m["cumulative_ms"])[:args.top]:
+        print(f"{m['cumulative_ms']:8.1f} ms {m['self_ms']:6.1f} ms  {m['module']}")
+
+    binds, firsts = [], []
+    for _ in range(args.runs):
+        bound, first = time_to_bind(args.app, env)
+        binds.append(bound)
+        firsts.append(first)
+    bind_ms, first_ms = statistics.median(binds) * 1000, statistics.median(firsts) * 1000
+    print(f"\nuvicorn {args.app}:app over {args.runs} runs: bind {bind_ms:.0f} ms "
+          f"(min {min(binds) * 1000:.0f}, max {max(binds) * 1000:.0f}), first response {first_ms:.0f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"app": args.app, "backend": args.backend, "import_ms": total, "bind_ms": bind_ms,
+                       "first_response_ms": first_ms, "modules": direct}, f, indent=2)
+    if args.budget_ms is not None:
+        within = bind_ms <= args.budget_ms
+        print(f"budget {args.budget_ms:.0f} ms: {'ok' if within else 'EXCEEDED'}")
+        return 0 if within else 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", choices=["main", "main_new"], default="main")
+    parser.add_argument("--backend", default="gemini", help="MODEL_BACKEND for the measured process")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="modules to list")
+    parser.add_argument("--no-prewarm", action="store_true", help="turn background pre-warming off (PREWARM=0)")
+    parser.add_argument("--budget-ms", type=float, help="fail when the median bind time is over this")
+    parser.add_argument("--output", help="write the measurements as JSON")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,74 @@
+"""Time-to-first-byte of /analyze versus /analyze/stream using the local stub backend.
+
+Starts the app under uvicorn (in-process ASGI transports buffer the whole body,
+which would hide the streaming gain) with MODEL_BACKEND=stub.
+
+    python benchmarks/stream_ttfb.py --latency 1.0 --chunk-delay 0.2
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAYLOAD = {"code": "def add(a, b):\n    return a + b\n" * 20, "language": "Python", "persona": "tutor"}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server at {url} did not come up")
+
+
+def measure(client, path):
+    start = time.perf_counter()
+    first = None
+    with client.stream("POST", path, json=PAYLOAD) as response:
+        for _ in response.iter_raw():
+            if first is None:
+                first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def run(latency, chunk_delay):
+    port = free_port()
+    env = dict(os.environ, MODEL_BACKEND="stub",
+               STUB_LATENCY=str(latency), STUB_CHUNK_DELAY=str(chunk_delay),
+               ANALYSIS_CACHE_SIZE="0", ANALYSIS_CACHE_PATH="")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    try:
+        base = f"http://127.0.0.1:{port}"
+        wait_for(base + "/")
+        with httpx.Client(base_url=base, timeout=None) as client:
+            for path in ("/analyze", "/analyze/stream"):
+                ttfb, total = measure(client, path)
+                print(f"{path:<16} TTFB {ttfb * 1000:8.1f} ms   total {total * 1000:8.1f} ms")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=1.0, help="stub backend delay before the first chunk")
+    parser.add_argument("--chunk-delay", type=float, default=0.2, help="stub backend delay between chunks")
+    args = parser.parse_args()
+    run(args.latency, args.chunk_delay)
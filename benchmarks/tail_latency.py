@@ -0,0 +1,107 @@
+"""Tail latency of model calls with and without the resilience layer, against the stub backend.
+
+The stub draws a heavy-tailed latency (lognormal by default) and fails a
+fraction of calls, fresh on every call (``per_call``) the way a real upstream
+would. The same request stream is sent through four setups:
+
+* ``plain``   – the bare backend, as before resilience.py
+* ``retries`` – timeouts plus budgeted, jittered retries
+* ``hedged``  – retries plus a hedge after the p95 of recent call times
+* ``outage``  – hedged, against a backend that always fails, to show the
+  circuit breaker failing fast (and answering from the fallback model)
+
+For each it prints success rate, p50/p95/p99/max latency and how many
+upstream calls were made per request (the load that retries and hedges add).
+
+    python benchmarks/tail_latency.py --requests 400 --latency lognormal:0.2,1.0 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_backends import StubBackend
+from resilience import CircuitBreaker, FallbackAnswer, ResilientBackend, RetryBudget
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] if ordered else 0.0
+
+
+def make_stub(args, error_rate=None, model_name="stub"):
+    return StubBackend(latency=args.latency, chunk_delay=0, error_rate=args.error_rate if error_rate is None
+                       else error_rate, seed=args.seed, model_name=model_name, per_call=True)
+
+
+def make_setup(name, args):
+    if name == "plain":
+        stub = make_stub(args)
+        return stub, stub, None
+    stub = make_stub(args, error_rate=1.0 if name == "outage" else None)
+    fallback = make_stub(args, error_rate=0.0, model_name="stub-lite") if name == "outage" else None
+    resilient = ResilientBackend(
+        stub, fallback=fallback, timeout=args.timeout, retries=args.retries, backoff=args.backoff,
+        budget=RetryBudget(ratio=args.budget), hedge=name in ("hedged", "outage"),
+        hedge_quantile=args.hedge_quantile, breaker=CircuitBreaker(failures=5, cooldown=args.cooldown),
+    )
+    return resilient, stub, fallback
+
+
+async def run_setup(name, args):
+    backend, stub, fallback = make_setup(name, args)
+    latencies, failures, fallbacks = [], 0, 0
+    queue = iter(range(args.requests))
+
+    async def worker():
+        nonlocal failures, fallbacks
+        for i in queue:
+            start = time.perf_counter()
+            try:
+                text = await backend.generate_async(f"review request {i}")
+                fallbacks += isinstance(text, FallbackAnswer)
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                failures += 1
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    ok = args.requests - failures
+    upstream = stub.calls / args.requests
+    events = dict(backend.events) if isinstance(backend, ResilientBackend) else {}
+    print(f"{name:<8} ok {ok / args.requests:6.1%}  p50 {percentile(latencies, 0.5) * 1000:7.1f}  "
+          f"p95 {percentile(latencies, 0.95) * 1000:7.1f}  p99 {percentile(latencies, 0.99) * 1000:7.1f}  "
+          f"max {max(latencies) * 1000:7.1f} ms  calls/request {upstream:4.2f}  "
+          f"fallbacks {fallbacks}  ({elapsed:.1f} s)")
+    if events:
+        print(f"{'':<8} {events}")
+
+
+async def main(args):
+    print(f"stub latency {args.latency}, error rate {args.error_rate:g}, {args.requests} requests "
+          f"at concurrency {args.concurrency}\n")
+    for name in args.setups:
+        await run_setup(name, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", default="lognormal:0.2,1.0", help="stub latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=3.0, help="per-attempt model timeout")
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--backoff", type=float, default=0.05)
+    parser.add_argument("--budget", type=float, default=0.2, help="retries and hedges allowed per call")
+    parser.add_argument("--hedge-quantile", type=float, default=0.95, help="hedge after this quantile of call time")
+    parser.add_argument("--cooldown", type=float, default=5.0, help="circuit breaker cool-down")
+    parser.add_argument("--setups", nargs="+", choices=["plain", "retries", "hedged", "outage"],
+                        default=["plain", "retries", "hedged", "outage"])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,132 @@
+"""Stop model work that nobody is waiting for any more.
+
+Starlette only notices a client going away while a response is streaming, so
+a plain ``/analyze`` request keeps waiting for the model, and paying for it,
+after its tab was closed. ``run_cancellable`` runs a request's work as a task
+next to a watcher on the ASGI ``receive`` channel and cancels the work as soon
+as the client disconnects.
+
+With a session id, ``Sessions`` makes the latest request win: a new request
+from the same session supersedes the one still running, which is cancelled
+the same way (``run_cancellable``, or ``until_superseded`` once a stream has
+started). Model calls shared with other requests through ``SingleFlight`` are
+only cancelled when their last waiter leaves.
+
+``SavingsMeter`` counts the cancelled model calls and estimates the tokens
+their cancellation saved: the whole prompt and answer for a call still
+queued for a model slot, the rest of the answer for one already running.
+"""
+import asyncio
+
+from compaction import estimate_tokens
+from metrics import MODEL_CALLS_CANCELLED, MODEL_TOKENS_SAVED, REQUESTS_CANCELLED
+
+
+class RequestCancelled(Exception):
+    """The request's work was cancelled; ``reason`` is ``"disconnect"`` or ``"superseded"``."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Request cancelled ({reason})")
+        self.reason = reason
+
+
+class Sessions:
+    """Latest request wins: at most one request per session is in progress."""
+
+    def __init__(self):
+        self._current = {}
+        self.superseded = 0
+
+    def __len__(self):
+        return len(self._current)
+
+    def start(self, session: str) -> asyncio.Event:
+        """Supersede the session's running request, if any; returns the event that will supersede this one."""
+        previous = self._current.get(session)
+        if previous is not None and not previous.is_set():
+            previous.set()
+            self.superseded += 1
+        event = self._current[session] = asyncio.Event()
+        return event
+
+    def finish(self, session: str, event: asyncio.Event):
+        if self._current.get(session) is event:
+            del self._current[session]
+
+
+async def disconnected(receive):
+    """Returns once the client has gone away; only call it after the request body has been read."""
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def run_cancellable(work, receive, superseded: asyncio.Event = None):
+    """Result of the ``work`` coroutine, unless the client disconnects or the request is superseded first.
+
+    Then the work is cancelled and ``RequestCancelled`` raised.
+    """
+    task = asyncio.ensure_future(work)
+    watchers = {asyncio.ensure_future(disconnected(receive)): "disconnect"}
+    if superseded is not None:
+        watchers[asyncio.ensure_future(superseded.wait())] = "superseded"
+    try:
+        done, _ = await asyncio.wait([task, *watchers], return_when=asyncio.FIRST_COMPLETED)
+        if task in done:
+            return task.result()
+        reason = min(watchers[watcher] for watcher in done)
+        REQUESTS_CANCELLED.inc(reason=reason)
+        raise RequestCancelled(reason)
+    finally:
+        for pending in (task, *watchers):
+            pending.cancel()
+
+
+async def until_superseded(stream, superseded: asyncio.Event):
+    """Yield ``stream``'s chunks until it ends or ``superseded`` is set, then close it and raise ``RequestCancelled``."""
+    chunks = stream.__aiter__()
+    stop = asyncio.ensure_future(superseded.wait())
+    step = None
+    try:
+        while True:
+            step = asyncio.ensure_future(chunks.__anext__())
+            await asyncio.wait([step, stop], return_when=asyncio.FIRST_COMPLETED)
+            if not step.done():
+                REQUESTS_CANCELLED.inc(reason="superseded")
+                raise RequestCancelled("superseded")
+            try:
+                chunk = step.result()
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        stop.cancel()
+        if step is not None and not step.done():
+            # The generator cannot be closed while a step is still running in it
+            step.cancel()
+            await asyncio.wait([step])
+        await chunks.aclose()
+
+
+class SavingsMeter:
+    """Counts cancelled model calls and estimates the tokens saved, from the size of recent answers."""
+
+    def __init__(self, answer_tokens: int = 1000):
+        self.answer_tokens = answer_tokens
+        self.cancelled = 0
+        self.tokens_saved = 0
+
+    def answered(self, text: str):
+        self.answer_tokens += (estimate_tokens(text) - self.answer_tokens) / 16
+
+    def cancelled_call(self, prompt: str, started: bool, answered: str = ""):
+        """Record a call cancelled while queued (``started`` false) or after ``answered`` had streamed back."""
+        stage = "running" if started else "queued"
+        saved_prompt = 0 if started else estimate_tokens(prompt)
+        saved_answer = max(0, round(self.answer_tokens) - estimate_tokens(answered))
+        self.cancelled += 1
+        self.tokens_saved += saved_prompt + saved_answer
+        MODEL_CALLS_CANCELLED.inc(stage=stage)
+        if saved_prompt:
+            MODEL_TOKENS_SAVED.inc(saved_prompt, direction="prompt")
+        if saved_answer:
+            MODEL_TOKENS_SAVED.inc(saved_answer, direction="answer")
@@ -0,0 +1,264 @@
+"""Prompt compaction: shrink submitted code before it is pasted into a model prompt.
+
+The pipeline strips comments, blank lines and excess indentation (language
+aware), collapses repeated blocks, and, when a token budget is given, omits the
+least relevant functions first. A ``LineMap`` keeps track of where every kept
+line came from so that line references in the model's answer can be rewritten
+to the user's original line numbers.
+"""
+import ast
+import bisect
+import io
+import re
+import tokenize
+from dataclasses import dataclass
+
+from static_analysis import C_TOKEN
+
+# Runs of this many identical (whitespace-insensitive) lines are treated as a duplicate block
+DUPLICATE_WINDOW = 4
+
+TOKEN_PIECE = re.compile(r"[A-Za-z_]+|\d+|\n|[^\sA-Za-z_\d]")
+LINE_REF = re.compile(r"\b(?P<word>[Ll]ines?\s+|L)(?P<a>\d+)(?:(?P<sep>\s*(?:-|–|to|and)\s*)(?P<b>\d+))?\b")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate for code and prose.
+
+    BPE tokenizers keep short identifiers whole and split long ones every few
+    characters, while most punctuation is a token of its own.
+    """
+    count = 0
+    for piece in TOKEN_PIECE.findall(text):
+        count += (len(piece) + 5) // 6 if piece[0].isalpha() or piece[0] == "_" else 1
+    return count + 1
+
+
+class LineMap:
+    """Maps 1-based line numbers of compacted code back to the original submission."""
+
+    def __init__(self, original_lines: list):
+        self.original_lines = original_lines
+
+    def to_original(self, line: int) -> int:
+        if not self.original_lines:
+            return line
+        return self.original_lines[min(max(line, 1), len(self.original_lines)) - 1]
+
+    def to_compact(self, line: int) -> int:
+        return min(bisect.bisect_left(self.original_lines, line) + 1, max(len(self.original_lines), 1))
+
+    def remap_references(self, text: str) -> str:
+        """Rewrite "line 12", "lines 3-7", "L40" in model output to original line numbers."""
+        def replace(match):
+            out = match["word"] + str(self.to_original(int(match["a"])))
+            if match["b"]:
+                out += match["sep"] + str(self.to_original(int(match["b"])))
+            return out
+        return LINE_REF.sub(replace, text)
+
+
+class StreamRemapper:
+    """Applies ``LineMap.remap_references`` to streamed text one complete line at a time."""
+
+    def __init__(self, line_map: LineMap):
+        self.line_map = line_map
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        self._pending += text
+        cut = self._pending.rfind("\n") + 1
+        ready, self._pending = self._pending[:cut], self._pending[cut:]
+        return self.line_map.remap_references(ready)
+
+    def flush(self) -> str:
+        ready, self._pending = self._pending, ""
+        return self.line_map.remap_references(ready)
+
+
+@dataclass
+class CompactedCode:
+    text: str
+    line_map: LineMap
+    stats: dict
+
+
+def _strip_python(code: str) -> list:
+    lines = code.splitlines()
+    try:
+        for tok in tokenize.generate_tokens(io.StringIO(code).readline):
+            if tok.type == tokenize.COMMENT:
+                row, col = tok.start
+                lines[row - 1] = lines[row - 1][:col]
+        tree = ast.parse(code)
+    except (tokenize.TokenError, SyntaxError, IndentationError, RecursionError, MemoryError):
+        return lines
+
+    # Shorten multi-line docstrings to their summary line
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)) or not node.body:
+            continue
+        first = node.body[0]
+        if not (isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant)
+                and isinstance(first.value.value, str) and first.end_lineno > first.lineno):
+            continue
+        start, end = first.lineno - 1, first.end_lineno - 1
+        if lines[start][:first.col_offset].strip() or lines[end][first.end_col_offset:].strip():
+            continue
+        summary = first.value.value.strip().split("\n", 1)[0].replace('"""', "'''")
+        lines[start] = lines[start][:first.col_offset] + f'"""{summary}"""'
+        for i in range(start + 1, end + 1):
+            lines[i] = ""
+    return lines
+
+
+def _strip_c_like(code: str) -> list:
+    parts = []
+    for match in C_TOKEN.finditer(code):
+        text = match.group()
+        parts.append("\n" * text.count("\n") if match.lastgroup == "comment" else text)
+    return "".join(parts).splitlines()
+
+
+def _normalize_indent(lines: list) -> list:
+    """Re-indent with one space per level; nesting survives, token-hungry runs of spaces do not."""
+    widths = [len(line) - len(line.lstrip()) for line in lines if line.strip()]
+    unit = min((w for w in widths if w), default=0)
+    if unit <= 1:
+        return lines
+    out = []
+    for line in lines:
+        body = line.lstrip()
+        width = len(line) - len(body)
+        out.append(" " * max(width // unit, 1 if width else 0) + body)
+    return out
+
+
+def _collapse_duplicates(entries: list, comment: str):
+    """Replace repeats of earlier ``DUPLICATE_WINDOW``-line blocks with a one-line reference."""
+    keys = [" ".join(text.split()) for _, text in entries]
+    seen, out, removed = {}, [], 0
+    i = 0
+    while i < len(entries):
+        window = tuple(keys[i:i + DUPLICATE_WINDOW])
+        meaningful = sum(1 for k in window if len(k) > 3)
+        first = seen.get(window) if len(window) == DUPLICATE_WINDOW and meaningful >= 2 else None
+        if first is not None and first + DUPLICATE_WINDOW <= i:
+            length = DUPLICATE_WINDOW
+            while (i + length < len(entries) and first + length < i
+                   and keys[first + length] == keys[i + length]):
+                length += 1
+            line, text = entries[i]
+            indent = text[:len(text) - len(text.lstrip())]
+            # No line numbers here: the prompt speaks in compacted lines, which budgeting may still shift
+            out.append((line, f"{indent}{comment} [{length} lines omitted: identical to the earlier block "
+                              f"starting `{keys[first][:60]}`]"))
+            removed += length
+            i += length
+            continue
+        if len(window) == DUPLICATE_WINDOW and window not in seen:
+            seen[window] = i
+        out.append(entries[i])
+        i += 1
+    return out, removed
+
+
+def _fit_budget(entries: list, report: dict, budget: int, comment: str):
+    """Omit the least relevant functions (keeping their signature line) until the code fits ``budget`` tokens."""
+    costs = [estimate_tokens(text) for _, text in entries]
+    total = sum(costs)
+    omitted = 0
+    if total <= budget:
+        return entries, omitted
+
+    hotspots = [q["line"] for q in report.get("quadratic", [])]
+
+    def relevance(f):
+        hot = sum(1 for line in hotspots if f["line"] <= line <= f["end_line"])
+        return f["complexity"] + 3 * f["loop_depth"] + 10 * hot + 5 * f["recursive"]
+
+    dropped = [False] * len(entries)
+    markers = {}
+    taken = []
+    for f in sorted(report.get("functions", []), key=lambda f: (relevance(f), f["line"] - f["end_line"])):
+        if total <= budget:
+            break
+        if any(not (f["end_line"] < a or f["line"] > b) for a, b in taken):
+            continue
+        body = [i for i, (line, _) in enumerate(entries) if f["line"] < line <= f["end_line"] and not dropped[i]]
+        if len(body) < 2:
+            continue
+        head = body[0] - 1 if body[0] > 0 else body[0]
+        indent = entries[body[0]][1][:len(entries[body[0]][1]) - len(entries[body[0]][1].lstrip())]
+        marker = (f"{indent}{comment} [body of {f['name']} omitted: {f['end_line'] - f['line']} lines, "
+                  f"cyclomatic {f['complexity']}, loop depth {f['loop_depth']}]")
+        for i in body:
+            dropped[i] = True
+            total -= costs[i]
+        markers[head] = (entries[body[0]][0], marker)
+        total += estimate_tokens(marker)
+        omitted += len(body)
+        taken.append((f["line"], f["end_line"]))
+
+    out = []
+    for i, entry in enumerate(entries):
+        if not dropped[i]:
+            out.append(entry)
+        if i in markers:
+            out.append(markers[i])
+
+    if total > budget:
+        # Still too large: keep the head of the file and cut the tail
+        kept, running = [], 0
+        for entry in out:
+            cost = estimate_tokens(entry[1])
+            if running + cost > budget:
+                break
+            kept.append(entry)
+            running += cost
+        cut = len(out) - len(kept)
+        if cut:
+            kept.append((out[len(kept)][0], f"{comment} [remaining {cut} lines omitted to fit the token budget]"))
+            omitted += cut
+        out = kept
+    return out, omitted
+
+
+def compact(code: str, language: str, report: dict, budget: int = None) -> CompactedCode:
+    """Run the whole pipeline; ``report`` is the static-analysis report of the original code."""
+    original = code.splitlines()
+    stripped = _strip_python(code) if language == "Python" else (
+        _strip_c_like(code) if language in ("C++", "Java") else list(original))
+    stripped = _normalize_indent([line.rstrip() for line in stripped])
+    comment = "#" if language == "Python" else "//"
+
+    entries, blank_removed, comment_removed = [], 0, 0
+    for number, (before, after) in enumerate(zip(original, stripped), start=1):
+        if after.strip():
+            entries.append((number, after))
+        elif before.strip():
+            comment_removed += 1
+        else:
+            blank_removed += 1
+
+    entries, duplicate_removed = _collapse_duplicates(entries, comment)
+    truncated = 0
+    if budget:
+        entries, truncated = _fit_budget(entries, report, budget, comment)
+
+    text = "\n".join(line for _, line in entries)
+    original_tokens = estimate_tokens(code)
+    prompt_tokens = estimate_tokens(text)
+    return CompactedCode(
+        text=text,
+        line_map=LineMap([line for line, _ in entries]),
+        stats={
+            "original_tokens": original_tokens,
+            "prompt_tokens": prompt_tokens,
+            "tokens_saved": max(0, original_tokens - prompt_tokens),
+            "blank_lines_removed": blank_removed,
+            "comment_lines_removed": comment_removed,
+            "duplicate_lines_removed": duplicate_removed,
+            "lines_omitted_for_budget": truncated,
+        },
+    )
@@ -0,0 +1,75 @@
+// Builds the UI into ../static: one minified JS and one CSS bundle named by content hash,
+// gzip and brotli variants of every file, index.html pointing at the hashed names, and
+// manifest.json, which main.py reads to serve them.
+//
+//     cd frontend && npm install && npm run build
+import * as esbuild from 'esbuild';
+import { createHash } from 'node:crypto';
+import { mkdir, readFile, rm, writeFile } from 'node:fs/promises';
+import path from 'node:path';
+import { fileURLToPath } from 'node:url';
+import { brotliCompressSync, constants, gzipSync } from 'node:zlib';
+
+const here = path.dirname(fileURLToPath(import.meta.url));
+const outDir = path.resolve(here, '..', 'static');
+
+const result = await esbuild.build({
+  entryPoints: [path.join(here, 'src', 'main.js')],
+  bundle: true,
+  minify: true,
+  write: false,
+  outdir: outDir,
+  entryNames: 'app',
+  target: ['es2019', 'chrome80', 'firefox78', 'safari13'],
+  jsx: 'transform',
+  jsxFactory: 'React.createElement',
+  jsxFragment: 'React.Fragment',
+  define: { 'process.env.NODE_ENV': '"production"' },
+  legalComments: 'eof',
+  logLevel: 'info',
+});
+
+const contentHash = (data) => createHash('sha256').update(data).digest('hex').slice(0, 12);
+
+async function emit(name, data) {
+  await writeFile(path.join(outDir, name), data);
+  const variants = { identity: data.length };
+  const gz = gzipSync(data, { level: 9 });
+  const br = brotliCompressSync(data, {
+    params: { [constants.BROTLI_PARAM_QUALITY]: 11, [constants.BROTLI_PARAM_SIZE_HINT]: data.length },
+  });
+  // A variant that does not shrink the file is not worth a lookup
+  if (gz.length < data.length) {
+    await writeFile(path.join(outDir, `${name}.gz`), gz);
+    variants.gzip = gz.length;
+  }
+  if (br.length < data.length) {
+    await writeFile(path.join(outDir, `${name}.br`), br);
+    variants.br = br.length;
+  }
+  return variants;
+}
+
+await rm(outDir, { recursive: true, force: true });
+await mkdir(outDir, { recursive: true });
+
+const assets = {};
+const files = {};
+for (const file of result.outputFiles) {
+  const ext = path.extname(file.path);
+  const name = `app.${contentHash(file.contents)}${ext}`;
+  assets[`app${ext}`] = name;
+  files[name] = await emit(name, Buffer.from(file.contents));
+}
+
+const template = await readFile(path.join(here, 'index.html'), 'utf8');
+const html = template
+  .replace('<!-- head -->', `<link rel="stylesheet" href="/assets/${assets['app.css']}">`)
+  .replace('<!-- scripts -->', `<script src="/assets/${assets['app.js']}" defer></script>`);
+files['index.html'] = await emit('index.html', Buffer.from(html));
+
+await writeFile(path.join(outDir, 'manifest.json'), JSON.stringify({ assets, files }, null, 2) + '\n');
+for (const [name, sizes] of Object.entries(files)) {
+  const parts = Object.entries(sizes).map(([encoding, size]) => `${encoding} ${(size / 1024).toFixed(1)} KB`);
+  console.log(`${name.padEnd(24)} ${parts.join(', ')}`);
+}
@@ -0,0 +1,186 @@
+// The UI works against the globals React, ReactDOM, marked and Prism. The production bundle
+// sets them in globals.js (see main.js); without a build, the page served by main.py loads them
+// from CDNs and transpiles this file in the browser.
+function App() {
+    const [code, setCode] = React.useState('');
+    const [language, setLanguage] = React.useState('C++');
+    const [persona, setPersona] = React.useState('senior');
+    const [mode, setMode] = React.useState('full');
+    const [loading, setLoading] = React.useState(false);
+    const [result, setResult] = React.useState('');
+    const [rawMarkdown, setRawMarkdown] = React.useState('');
+    // Last exported PDF, reused when the server answers 304 Not Modified
+    const lastPdf = React.useRef({ etag: null, blob: null });
+    // Running again aborts the analysis in progress; the session id lets the server cancel it too
+    const pending = React.useRef(null);
+    const sessionId = React.useRef(Math.random().toString(36).slice(2) + Date.now().toString(36));
+
+    const analyzeCode = async () => {
+        if (!code.trim()) return alert("Please enter some code.");
+        if (pending.current) pending.current.abort();
+        const controller = new AbortController();
+        pending.current = controller;
+        setLoading(true);
+        setResult('');
+        setRawMarkdown('');
+
+        // Re-render at most once per animation frame while chunks stream in
+        let markdown = '';
+        let frame = null;
+        const render = () => {
+            frame = null;
+            setRawMarkdown(markdown);
+            setResult(marked.parse(markdown));
+        };
+
+        try {
+            const res = await fetch('/analyze/stream', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json', 'X-Session-Id': sessionId.current },
+                body: JSON.stringify({ code, language, persona, mode }),
+                signal: controller.signal
+            });
+
+            if (!res.ok || !res.body) throw new Error("Server connection failed.");
+
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const frameText = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+
+                    let event = 'message';
+                    let data = '';
+                    for (const line of frameText.split('\n')) {
+                        if (line.startsWith('event: ')) event = line.slice(7);
+                        else if (line.startsWith('data: ')) data += line.slice(6);
+                    }
+                    const payload = data ? JSON.parse(data) : {};
+                    if (event === 'cancelled') return;
+                    if (event === 'error') throw new Error(payload.error || "Analysis failed.");
+                    if (payload.text) {
+                        markdown += payload.text;
+                        if (!frame) frame = requestAnimationFrame(render);
+                    }
+                }
+            }
+
+            if (frame) cancelAnimationFrame(frame);
+            render();
+            setTimeout(() => Prism.highlightAll(), 0);
+        } catch (error) {
+            if (error.name !== 'AbortError') alert(error.message);
+        } finally {
+            if (frame) cancelAnimationFrame(frame);
+            // A newer run owns the spinner now
+            if (pending.current === controller) {
+                pending.current = null;
+                setLoading(false);
+            }
+        }
+    };
+
+    const downloadPDF = async () => {
+        try {
+            const headers = { 'Content-Type': 'application/json' };
+            if (lastPdf.current.etag) headers['If-None-Match'] = lastPdf.current.etag;
+            const res = await fetch('/api/download', {
+                method: 'POST',
+                headers,
+                body: JSON.stringify({ feedback: rawMarkdown, language })
+            });
+
+            if (res.ok || res.status === 304) {
+                let blob = lastPdf.current.blob;
+                if (res.status !== 304) {
+                    blob = await res.blob();
+                    lastPdf.current = { etag: res.headers.get('ETag'), blob };
+                }
+                const url = window.URL.createObjectURL(blob);
+                const a = document.createElement('a');
+                a.href = url;
+                a.download = `Code_Review_${language}.pdf`;
+                a.click();
+            } else {
+                alert("PDF generation failed.");
+            }
+        } catch (e) {
+            alert("Network error.");
+        }
+    };
+
+    return (
+        <React.Fragment>
+            <div className="navbar">
+                <h1>AI Code Lab Pro</h1>
+                <p>v2.0</p>
+            </div>
+
+            <div className="workspace">
+                <div className="panel">
+                    <div className="panel-header">
+                        <div className="controls">
+                            <select value={language} onChange={(e) => setLanguage(e.target.value)}>
+                                <option value="C++">C++</option>
+                                <option value="Python">Python</option>
+                                <option value="Java">Java</option>
+                            </select>
+                            <select value={persona} onChange={(e) => setPersona(e.target.value)}>
+                                <option value="senior">Senior Engineer</option>
+                                <option value="tutor">Coding Tutor</option>
+                            </select>
+                            <select value={mode} onChange={(e) => setMode(e.target.value)}>
+                                <option value="full">AI Review</option>
+                                <option value="fast">Fast (local only)</option>
+                                <option value="incremental">Incremental (changed parts only)</option>
+                            </select>
+                        </div>
+                    </div>
+
+                    <textarea 
+                        placeholder="// Write or paste your code here..."
+                        value={code}
+                        onChange={(e) => setCode(e.target.value)}
+                        spellCheck="false"
+                    />
+
+                    <button className="btn btn-primary" onClick={analyzeCode}>
+                        {loading ? ( <React.Fragment><div className="spinner"></div>Analyzing...</React.Fragment> ) : ( "🚀 Run AI Analysis" )}
+                    </button>
+                </div>
+
+                <div className="panel">
+                    <div className="panel-header" style={{ justifyContent: 'space-between' }}>
+                        <h3 style={{ fontSize: '0.9rem', color: '#cbd5e1', fontWeight: '600', display: 'flex', alignItems: 'center', gap: '0.5rem' }}>
+                            ✨ Analysis Report
+                        </h3>
+                        {result && (
+                            <button className="btn btn-success" onClick={downloadPDF}>📥 Export PDF</button>
+                        )}
+                    </div>
+
+                    <div className="output-area markdown-body">
+                        {!result && !loading && (
+                            <div className="empty-state">
+                                <svg fill="none" stroke="currentColor" viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg"><path strokeLinecap="round" strokeLinejoin="round" strokeWidth="2" d="M10 20l4-16m4 4l4 4-4 4M6 16l-4-4 4-4"></path></svg>
+                                <p>Awaiting code submission...</p>
+                            </div>
+                        )}
+                        {result && <div dangerouslySetInnerHTML={{ __html: result }} />}
+                    </div>
+                </div>
+            </div>
+        </React.Fragment>
+    );
+}
+
+const root = ReactDOM.createRoot(document.getElementById('root'));
+root.render(<App />);
@@ -0,0 +1,7 @@
+// Bundled vendor libraries, exposed under the same globals the CDN scripts used to define.
+import React from 'react';
+import * as ReactDOM from 'react-dom/client';
+import { marked } from 'marked';
+import Prism from 'prismjs';
+
+Object.assign(globalThis, { React, ReactDOM, marked, Prism });
@@ -0,0 +1,6 @@
+// Bundle entry point. Imports run in order, so the globals exist before the grammars and the app load.
+import './globals.js';
+import './prism-languages.js';
+import 'prismjs/themes/prism-tomorrow.css';
+import './styles.css';
+import './App.jsx';
@@ -0,0 +1,6 @@
+// Prism grammars for the languages the reviewer accepts; they register themselves on the global Prism.
+import 'prismjs/components/prism-clike';
+import 'prismjs/components/prism-c';
+import 'prismjs/components/prism-cpp';
+import 'prismjs/components/prism-java';
+import 'prismjs/components/prism-python';
@@ -0,0 +1,248 @@
+"""Incremental re-analysis: review a submission one unit at a time and reuse the units that did not change.
+
+Edit-and-resubmit loops usually touch one function, so ``split_units`` cuts a
+submission into its units (functions, classes and their methods; the
+statements between definitions form units of their own) and fingerprints each
+one by its compacted code, without comments, blank lines or whitespace
+differences. Unit reviews are cached by fingerprint: a resubmission sends only
+the changed units to the model, and re-indenting or re-commenting a unit does
+not count as a change.
+
+A unit's review refers to lines of the unit's compacted code, which stay the
+same for as long as its fingerprint does; ``Unit.line_map`` shifts them to
+wherever the unit sits in the current submission. The overview that ties the
+units together is rendered from the static-analysis report of the whole file
+and costs no model call.
+"""
+import ast
+import functools
+import hashlib
+import re
+import textwrap
+from dataclasses import dataclass
+
+from compaction import CompactedCode, LineMap, compact
+from ingest import unit_starts
+from static_analysis import C_KEYWORDS, MAX_LISTED_PATTERNS, analyze
+
+# Units smaller than this are reviewed together with their neighbours, so a run of one-line getters is one call
+MIN_UNIT_TOKENS = 48
+# Complexity leaders named in the overview
+MAX_LISTED_UNITS = 5
+
+PY_DEF = re.compile(r"(?:async\s+)?(def|class)\s+(\w+)")
+C_TYPE = re.compile(r"\b(class|struct|interface|enum|record|namespace)\s+(\w+)")
+C_CALL = re.compile(r"([A-Za-z_~][\w:~]*)\s*\(")
+FENCE = re.compile(r"^\s*(```|~~~)")
+HEADING = re.compile(r"^(#{1,4})(?=\s)")
+
+
+@dataclass
+class Unit:
+    name: str
+    kind: str  # "function", "method", "class", "module" (top-level statements) or "group" (merged small units)
+    first_line: int  # 1-based and inclusive, in the whole submission
+    last_line: int
+    compacted: CompactedCode
+    report: dict
+    fingerprint: str
+
+    @property
+    def tokens(self) -> int:
+        return self.compacted.stats["prompt_tokens"]
+
+    def line_map(self) -> LineMap:
+        """Maps lines of the unit's compacted code to lines of the whole submission."""
+        offset = self.first_line - 1
+        return LineMap([line + offset for line in self.compacted.line_map.original_lines])
+
+
+def fingerprint(compacted_text: str) -> str:
+    """Hash of compacted code that ignores whitespace inside lines but keeps the indentation depth."""
+    h = hashlib.sha256()
+    for line in compacted_text.splitlines():
+        body = line.lstrip()
+        h.update(f"{len(line) - len(body)} {' '.join(body.split())}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _python_starts(code: str) -> list:
+    """``(line_index, name, kind)`` where each unit starts; raises SyntaxError."""
+    try:
+        tree = ast.parse(code)
+    except (RecursionError, MemoryError) as e:
+        raise SyntaxError("too deeply nested to parse") from e
+    starts = []
+
+    def start_of(node):
+        return min([node.lineno] + [d.lineno for d in node.decorator_list]) - 1
+
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            starts.append((start_of(node), node.name, "function"))
+        elif isinstance(node, ast.ClassDef):
+            starts.append((start_of(node), node.name, "class"))
+            # Class attributes after a method stay with that method
+            starts.extend((start_of(child), f"{node.name}.{child.name}", "method") for child in node.body
+                          if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)))
+        elif not starts or starts[-1][2] != "module":
+            starts.append((node.lineno - 1, "module level", "module"))
+    return starts
+
+
+def _name_of(text: str, language: str):
+    """Best-effort ``(name, kind)`` of a unit found by ``ingest.unit_starts``."""
+    if language == "Python":
+        match = PY_DEF.search(text)
+        if match:
+            return match[2], "class" if match[1] == "class" else "function"
+        return "module level", "module"
+    head = text.split("{", 1)[0]
+    if "{" not in text:
+        return "declarations", "module"
+    match = C_TYPE.search(head)
+    if match and "(" not in head[:match.start()]:
+        return match[2], "class"
+    for match in C_CALL.finditer(head):
+        if match[1] not in C_KEYWORDS:
+            return match[1].split("::")[-1], "function"
+    return head.strip().splitlines()[0][:40] if head.strip() else "block", "module"
+
+
+def _line_starts(lines: list, language: str) -> list:
+    """Unit starts from the line-based splitter that archives use; also the fallback for Python that does not parse."""
+    raw = unit_starts(lines, language) + [len(lines)]
+    # A brace on its own line, or the closing brace of a class, belongs to the range before it
+    ranges = []
+    for begin, end in zip(raw, raw[1:]):
+        text = "".join(lines[begin:end]).strip()
+        if ranges and (not text or text.startswith(("{", "}", ")", ";"))):
+            ranges[-1] = (ranges[-1][0], end)
+        elif text:
+            ranges.append((begin, end))
+
+    starts, pending = [], None
+    for begin, end in ranges:
+        text = "".join(lines[begin:end]).strip()
+        if text.startswith(("@", "template")):
+            # Annotations, decorators and template headers introduce the next unit
+            pending = begin if pending is None else pending
+            continue
+        name, kind = _name_of(text, language)
+        if kind == "module" and pending is None and starts and starts[-1][2] == "module":
+            # Consecutive declarations (includes, fields, globals) form one unit
+            continue
+        starts.append((begin if pending is None else pending, name, kind))
+        pending = None
+    if pending is not None:
+        starts.append((pending, "declarations", "module"))
+    return starts
+
+
+@functools.lru_cache(maxsize=4096)
+def _digest(text: str, language: str, budget: int):
+    """Analysis, compaction and fingerprint of one unit's text; most units of a resubmission were seen before."""
+    report = analyze(text, language)
+    full = compact(text, language, report)
+    compacted = full if not budget or full.stats["prompt_tokens"] <= budget else compact(text, language, report, budget)
+    return report, compacted, fingerprint(full.text)
+
+
+def _make_unit(lines: list, begin: int, end: int, name: str, kind: str, language: str, budget: int) -> Unit:
+    # Methods are reviewed dedented, so the fingerprint does not depend on how deep the class nests them
+    report, compacted, digest = _digest(textwrap.dedent("".join(lines[begin:end])), language, budget)
+    return Unit(name, kind, begin + 1, end, compacted, report, digest)
+
+
+def split_units(code: str, language: str, budget: int = None) -> list:
+    """Cut a submission into ``Unit``s that cover every line, each compacted to at most ``budget`` tokens."""
+    lines = code.splitlines(keepends=True)
+    if not lines:
+        return []
+    try:
+        starts = _python_starts(code) if language == "Python" else _line_starts(lines, language)
+    except SyntaxError:
+        starts = _line_starts(lines, language)
+    if not starts:
+        starts = [(0, "module level", "module")]
+    # Leading comments and blank lines belong to the first unit
+    starts[0] = (0,) + starts[0][1:]
+    bounds = [begin for begin, _, _ in starts[1:]] + [len(lines)]
+    units = [_make_unit(lines, begin, end, name, kind, language, budget)
+             for (begin, name, kind), end in zip(starts, bounds) if end > begin]
+
+    # Runs of small units are reviewed together so each model call has something to say; large units always
+    # stand alone so a small neighbour's edit does not re-send them, and comment-only units join the one before
+    merged = []
+    for unit in units:
+        empty = not unit.compacted.text.strip()
+        if merged and (empty or not any(u.compacted.text.strip() for u in merged[-1])
+                       or (unit.tokens < MIN_UNIT_TOKENS and sum(u.tokens for u in merged[-1]) < MIN_UNIT_TOKENS)):
+            merged[-1].append(unit)
+        else:
+            merged.append([unit])
+    out = []
+    for group in merged:
+        if len(group) == 1:
+            out.append(group[0])
+            continue
+        named = [u.name for u in group if u.compacted.text.strip()] or [group[0].name]
+        kind = group[0].kind if len(named) == 1 else "group"
+        out.append(_make_unit(lines, group[0].first_line - 1, group[-1].last_line, ", ".join(dict.fromkeys(named)),
+                              kind, language, budget))
+    return out
+
+
+def demote_headings(text: str, levels: int = 2) -> str:
+    """Push markdown headings down ``levels`` so a unit's review nests under its own heading."""
+    out, fenced = [], False
+    for line in text.splitlines():
+        if FENCE.match(line):
+            fenced = not fenced
+        elif not fenced:
+            line = HEADING.sub(lambda m: "#" * min(6, len(m[1]) + levels), line)
+        out.append(line)
+    return "\n".join(out)
+
+
+def render_overview(report: dict, units: list, reused: list) -> str:
+    """Cross-unit summary from the whole file's static analysis, plus what was re-reviewed this time."""
+    changed = [unit.name for unit, hit in zip(units, reused) if not hit]
+    out = [f"## Overview ({report['language']}, {report['lines']} lines, {len(units)} units)", ""]
+    if not changed:
+        out.append(f"No unit changed since an earlier submission; all {len(units)} reviews below were reused.")
+    elif len(changed) == len(units):
+        out.append(f"All {len(units)} units were reviewed.")
+    else:
+        out.append(f"Re-reviewed {len(changed)} of {len(units)} units ("
+                   + ", ".join(f"`{name}`" for name in changed)
+                   + "); the other reviews were reused from earlier submissions.")
+    out.append("")
+    if report["parse_error"]:
+        out.append(f"- **Does not parse:** {report['parse_error']}")
+    functions = report["functions"]
+    if functions:
+        deepest = max(functions, key=lambda f: f["loop_depth"])
+        out.append(f"- **Deepest loop nesting:** {report['max_loop_depth']}"
+                   + (f" (`{deepest['name']}`)" if deepest["loop_depth"] else ""))
+        complex_functions = sorted(functions, key=lambda f: -f["complexity"])[:MAX_LISTED_UNITS]
+        out.append("- **Most complex:** " + ", ".join(f"`{f['name']}` (cyclomatic {f['complexity']})"
+                                                      for f in complex_functions))
+        recursive = [f["name"] for f in functions if f["recursive"]]
+        if recursive:
+            out.append("- **Recursive:** " + ", ".join(f"`{name}`" for name in recursive))
+    for q in report["quadratic"][:MAX_LISTED_PATTERNS]:
+        out.append(f"- **Possible hotspot,** line {q['line']} in `{q['function']}`: {q['pattern']}")
+    return "\n".join(out)
+
+
+def assemble(report: dict, units: list, reviews: list, reused: list) -> str:
+    """The overview followed by one section per unit, with line references in the submission's numbering."""
+    sections = [render_overview(report, units, reused)]
+    for unit, review, hit in zip(units, reviews, reused):
+        span = f"line {unit.first_line}" if unit.first_line == unit.last_line else \
+            f"lines {unit.first_line}-{unit.last_line}"
+        note = "\n_Unchanged since an earlier submission; review reused._\n" if hit else ""
+        sections.append(f"## `{unit.name}` ({span})\n{note}\n"
+                        + demote_headings(unit.line_map().remap_references(review)).strip())
+    return "\n\n".join(sections) + "\n"
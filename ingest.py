@@ -0,0 +1,211 @@
+"""Archive ingestion: stream source files out of a zip/tar and pack them into token-budgeted chunks.
+
+Everything here is synchronous and generator based so callers can run it in a
+worker thread and pull one chunk at a time; at no point is the whole archive
+or the whole project held in memory.
+"""
+import re
+import tarfile
+import zipfile
+import zlib
+from dataclasses import dataclass
+
+from compaction import estimate_tokens
+
+LANGUAGE_BY_EXTENSION = {
+    ".py": "Python",
+    ".c": "C++", ".cc": "C++", ".cpp": "C++", ".cxx": "C++", ".h": "C++", ".hh": "C++", ".hpp": "C++",
+    ".java": "Java",
+}
+
+PYTHON_UNIT = re.compile(r"(async\s+def|def|class)\s|@")
+
+# What reading a corrupt, truncated or encrypted member raises (RuntimeError: encrypted zip member,
+# NotImplementedError: unsupported compression, OSError: bad gzip stream)
+ZIP_READ_ERRORS = (zipfile.BadZipFile, RuntimeError, NotImplementedError, EOFError, zlib.error)
+TAR_READ_ERRORS = (tarfile.TarError, EOFError, OSError, zlib.error)
+
+
+class ArchiveError(ValueError):
+    """The upload is not a readable zip or tar archive."""
+
+
+@dataclass
+class SourceFile:
+    path: str
+    language: str
+    text: str
+
+
+@dataclass
+class Chunk:
+    index: int
+    text: str
+    files: list
+    tokens: int
+
+
+class SkippedMembers:
+    """Counts skipped archive members but keeps only the first ``sample_size`` names."""
+
+    def __init__(self, sample_size: int = 100):
+        self.sample_size = sample_size
+        self.count = 0
+        self.sample = []
+
+    def append(self, name: str):
+        self.count += 1
+        if len(self.sample) < self.sample_size:
+            self.sample.append(name)
+
+
+def language_for(path: str):
+    dot = path.rfind(".")
+    return LANGUAGE_BY_EXTENSION.get(path[dot:].lower()) if dot != -1 else None
+
+
+def _decode(data: bytes):
+    if b"\0" in data[:8192]:
+        return None
+    return data.decode("utf-8", errors="replace")
+
+
+def iter_source_files(fileobj, max_file_bytes: int, skipped):
+    """Yield ``SourceFile`` for every supported source file in a zip or tar archive.
+
+    ``fileobj`` must be seekable (a spooled upload is). Members are read one at a
+    time and capped at ``max_file_bytes``, so a decompression bomb can't blow up
+    memory. Unsupported, binary and oversized members are appended to ``skipped``
+    (a list, or a ``SkippedMembers`` for archives of any size).
+    """
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        try:
+            archive = zipfile.ZipFile(fileobj)
+        except ZIP_READ_ERRORS as e:
+            raise ArchiveError("The zip archive is corrupt.") from e
+        with archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                language = language_for(info.filename)
+                if language is None:
+                    skipped.append(info.filename)
+                    continue
+                try:
+                    with archive.open(info) as member:
+                        data = member.read(max_file_bytes + 1)
+                except ZIP_READ_ERRORS as e:
+                    raise ArchiveError(
+                        f"Cannot read {info.filename} from the archive: it is encrypted or corrupt.") from e
+                text = _decode(data) if len(data) <= max_file_bytes else None
+                if text is None:
+                    skipped.append(info.filename)
+                    continue
+                yield SourceFile(info.filename, language, text)
+        return
+
+    fileobj.seek(0)
+    try:
+        archive = tarfile.open(fileobj=fileobj, mode="r:*")
+    except tarfile.TarError as e:
+        raise ArchiveError("Upload must be a zip or tar archive.") from e
+    with archive:
+        while (info := _next_member(archive)) is not None:
+            if not info.isfile():
+                continue
+            language = language_for(info.name)
+            if language is None or info.size > max_file_bytes:
+                skipped.append(info.name)
+                continue
+            try:
+                member = archive.extractfile(info)
+                data = member.read() if member else None
+            except TAR_READ_ERRORS as e:
+                raise ArchiveError(f"Cannot read {info.name} from the archive: it is corrupt or truncated.") from e
+            text = _decode(data) if data is not None else None
+            if text is None:
+                skipped.append(info.name)
+                continue
+            yield SourceFile(info.name, language, text)
+
+
+def _next_member(archive):
+    try:
+        return archive.next()
+    except TAR_READ_ERRORS as e:
+        raise ArchiveError("The tar archive is corrupt or truncated.") from e
+
+
+def unit_starts(lines: list, language: str) -> list:
+    """Line indices where a new top-level unit (function, class, method) may begin."""
+    starts = [0]
+    if language == "Python":
+        for i, line in enumerate(lines):
+            if i and PYTHON_UNIT.match(line) and not PYTHON_UNIT.match(lines[i - 1]):
+                starts.append(i)
+        return starts
+
+    # Brace languages: split where nesting drops back to the top level. Java keeps
+    # methods one level down inside their class, so that level counts as top too.
+    split_depth = 1 if language == "Java" else 0
+    depth = 0
+    for i, line in enumerate(lines):
+        if i and depth <= split_depth and line.strip():
+            starts.append(i)
+        depth = max(0, depth + line.count("{") - line.count("}"))
+    return starts
+
+
+def split_units(source: SourceFile, budget_tokens: int):
+    """Yield ``(first_line, text)`` pieces of one file, each within ``budget_tokens``.
+
+    Adjacent units are merged while they fit; a single unit larger than the
+    budget is cut on line boundaries.
+    """
+    lines = source.text.splitlines(keepends=True)
+    starts = unit_starts(lines, source.language) + [len(lines)]
+    piece_start, piece, piece_tokens = 0, [], 0
+    for begin, end in zip(starts, starts[1:]):
+        if begin == end:
+            continue
+        unit = "".join(lines[begin:end])
+        tokens = estimate_tokens(unit)
+        if piece and piece_tokens + tokens > budget_tokens:
+            yield piece_start, "".join(piece)
+            piece, piece_tokens = [], 0
+        if not piece:
+            piece_start = begin
+        if tokens <= budget_tokens:
+            piece.append(unit)
+            piece_tokens += tokens
+            continue
+        for i in range(begin, end):
+            line_tokens = estimate_tokens(lines[i])
+            if piece and piece_tokens + line_tokens > budget_tokens:
+                yield piece_start, "".join(piece)
+                piece, piece_tokens, piece_start = [], 0, i
+            piece.append(lines[i])
+            piece_tokens += line_tokens
+    if piece:
+        yield piece_start, "".join(piece)
+
+
+def iter_chunks(files, budget_tokens: int):
+    """Pack pieces from consecutive files into chunks of at most ``budget_tokens``."""
+    index, parts, names, tokens = 0, [], [], 0
+    for source in files:
+        # Leave room for the per-file header each piece gets
+        for first_line, text in split_units(source, max(64, budget_tokens - 32)):
+            last_line = first_line + len(text.splitlines())
+            part = f"### File: {source.path} (lines {first_line + 1}-{last_line}, {source.language})\n{text}\n"
+            part_tokens = estimate_tokens(part)
+            if parts and tokens + part_tokens > budget_tokens:
+                yield Chunk(index, "".join(parts), names, tokens)
+                index, parts, names, tokens = index + 1, [], [], 0
+            parts.append(part)
+            if source.path not in names:
+                names.append(source.path)
+            tokens += part_tokens
+    if parts:
+        yield Chunk(index, "".join(parts), names, tokens)
@@ -0,0 +1,283 @@
+"""Durable job queue for analyses that should not hold an HTTP connection open.
+
+Jobs live in a SQLite file, so they survive restarts and every uvicorn worker
+on the host can submit, claim and report on the same queue. A worker claims
+a job by taking a lease on it: the job stays invisible to other workers until
+``visibility_timeout`` seconds pass, and the worker extends the lease while
+it is still busy. If the worker dies, the lease runs out and another worker
+picks the job up again. Failed jobs are retried with exponential backoff up
+to ``max_attempts``; finished jobs and their results are deleted after
+``result_ttl`` seconds.
+
+``JobQueue`` runs the in-process worker pool. Throughput depends on the
+number of workers, not on how many clients are connected: a client only
+holds a connection for the ``POST`` and then polls or subscribes.
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+FINISHED = (DONE, FAILED)
+
+
+class RetryLater(Exception):
+    """Raised by a job handler to put the job back without using up an attempt (e.g. the model is busy)."""
+
+    def __init__(self, message: str, delay: float):
+        super().__init__(message)
+        self.delay = delay
+
+
+class JobStore:
+    """SQLite table of jobs with lease-based claiming; safe to share between processes."""
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, path: str, visibility_timeout: float = 120, max_attempts: int = 3,
+                 result_ttl: float = 86400, retry_backoff: float = 2.0):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max(1, max_attempts)
+        self.result_ttl = result_ttl
+        self.retry_backoff = retry_backoff
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL,"
+            " available_at REAL NOT NULL, lease_owner TEXT, result TEXT, error TEXT,"
+            " created REAL NOT NULL, updated REAL NOT NULL, expires_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_expiry ON jobs (expires_at)")
+
+    def _write(self, sql: str, params=()) -> int:
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._conn.execute("DELETE FROM jobs WHERE expires_at < ?", (time.time(),))
+            return cursor.rowcount
+
+    def submit(self, payload: dict, kind: str = "analyze") -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._write("INSERT INTO jobs (id, kind, payload, status, max_attempts, available_at, created, updated)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, json.dumps(payload), QUEUED, self.max_attempts, now, now, now))
+        return job_id
+
+    def claim(self, owner: str):
+        """Lease the oldest job that is queued or whose lease ran out; returns it as a dict, or None."""
+        with self._lock:
+            while True:
+                now = time.time()
+                # BEGIN IMMEDIATE takes the write lock up front, so two processes never claim the same job
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self._conn.execute(
+                        "SELECT * FROM jobs WHERE status IN (?, ?) AND available_at <= ?"
+                        " ORDER BY available_at LIMIT 1", (QUEUED, RUNNING, now)).fetchone()
+                    if row is None:
+                        self._conn.execute("COMMIT")
+                        return None
+                    if row["attempts"] >= row["max_attempts"]:
+                        # The last lease ran out without a result: the worker holding it died every time
+                        self._conn.execute(
+                            "UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, updated = ?, expires_at = ?"
+                            " WHERE id = ?", (FAILED, "worker lease expired", now, now + self.result_ttl, row["id"]))
+                        self._conn.execute("COMMIT")
+                        continue
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?, available_at = ?,"
+                        " updated = ? WHERE id = ?", (RUNNING, owner, now + self.visibility_timeout, now, row["id"]))
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                job = dict(row)
+                job.update(status=RUNNING, attempts=row["attempts"] + 1, lease_owner=owner)
+                job["payload"] = json.loads(job["payload"])
+                return job
+
+    def extend(self, job_id: str, owner: str) -> bool:
+        """Push the lease out by another visibility timeout; False once the job is no longer ours."""
+        now = time.time()
+        return self._write("UPDATE jobs SET available_at = ?, updated = ? WHERE id = ? AND lease_owner = ?"
+                           " AND status = ?", (now + self.visibility_timeout, now, job_id, owner, RUNNING)) == 1
+
+    def complete(self, job_id: str, owner: str, result) -> bool:
+        now = time.time()
+        return self._write("UPDATE jobs SET status = ?, result = ?, error = NULL, lease_owner = NULL, updated = ?,"
+                           " expires_at = ? WHERE id = ? AND lease_owner = ? AND status = ?",
+                           (DONE, json.dumps(result), now, now + self.result_ttl, job_id, owner, RUNNING)) == 1
+
+    def fail(self, job_id: str, owner: str, error: str, attempts: int) -> str:
+        """Record a failed attempt: the job is retried after a backoff, or fails for good. Returns its new status."""
+        now = time.time()
+        if attempts < self.max_attempts:
+            delay = self.retry_backoff * 2 ** (attempts - 1)
+            self._write("UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, available_at = ?, updated = ?"
+                        " WHERE id = ? AND lease_owner = ?", (QUEUED, error, now + delay, now, job_id, owner))
+            return QUEUED
+        self._write("UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, updated = ?, expires_at = ?"
+                    " WHERE id = ? AND lease_owner = ?", (FAILED, error, now, now + self.result_ttl, job_id, owner))
+        return FAILED
+
+    def release(self, job_id: str, owner: str, delay: float = 0.0):
+        """Give a job back without counting the attempt (shutdown, or the model asked us to come back later)."""
+        now = time.time()
+        self._write("UPDATE jobs SET status = ?, attempts = attempts - 1, lease_owner = NULL, available_at = ?,"
+                    " updated = ? WHERE id = ? AND lease_owner = ? AND status = ?",
+                    (QUEUED, now + delay, now, job_id, owner, RUNNING))
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (row["expires_at"] is not None and row["expires_at"] < time.time()):
+            return None
+        job = {
+            "id": row["id"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "created": row["created"],
+            "updated": row["updated"],
+        }
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = row["error"]
+        if row["expires_at"] is not None:
+            job["expires_at"] = row["expires_at"]
+        return job
+
+    def prune(self) -> int:
+        return self._write("DELETE FROM jobs WHERE expires_at < ?", (time.time(),))
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobQueue:
+    """Runs ``workers`` coroutines that claim jobs from a ``JobStore`` and pass their payload to ``handler``.
+
+    ``handler(payload)`` returns a JSON-serialisable result; any exception
+    fails the attempt, and ``RetryLater`` puts the job back without using one
+    up. Submissions from this process wake an idle worker immediately; jobs
+    submitted by other processes, and retries, are picked up within
+    ``poll_interval`` seconds.
+    """
+
+    def __init__(self, store: JobStore, handler, workers: int = 4, poll_interval: float = 1.0):
+        self.store = store
+        self.handler = handler
+        self.workers = max(0, workers)
+        self.poll_interval = poll_interval
+        self.owner = uuid.uuid4().hex[:12]
+        self.processed = 0
+        self.failed = 0
+        self._tasks = []
+        self._wakeup = None
+        self._finished = None
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._finished = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, payload: dict, kind: str = "analyze") -> str:
+        job_id = await asyncio.to_thread(self.store.submit, payload, kind)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id: str):
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def wait(self, job_id: str, timeout: float = None):
+        """Return the job once it is finished (or whatever state it is in when ``timeout`` runs out)."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            job = await self.get(job_id)
+            if job is None or job["status"] in FINISHED:
+                return job
+            wait = self.poll_interval if deadline is None else min(self.poll_interval, deadline - loop.time())
+            if wait <= 0:
+                return job
+            # Jobs finished in this process wake waiters at once; others are seen on the next poll
+            try:
+                async with self._finished:
+                    await asyncio.wait_for(self._finished.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _notify_finished(self):
+        async with self._finished:
+            self._finished.notify_all()
+
+    async def _worker(self, index: int):
+        owner = f"{self.owner}-{index}"
+        while True:
+            job = await asyncio.to_thread(self.store.claim, owner)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job, owner)
+
+    async def _run(self, job: dict, owner: str):
+        work = asyncio.create_task(self.handler(job["payload"]))
+        try:
+            # Keep the lease alive while the handler runs; a third of the timeout leaves room for a slow write
+            while True:
+                done, _ = await asyncio.wait({work}, timeout=self.store.visibility_timeout / 3)
+                if done:
+                    break
+                if not await asyncio.to_thread(self.store.extend, job["id"], owner):
+                    work.cancel()
+                    return
+            try:
+                result = work.result()
+            except RetryLater as e:
+                await asyncio.to_thread(self.store.release, job["id"], owner, e.delay)
+                return
+            except Exception as e:
+                status = await asyncio.to_thread(self.store.fail, job["id"], owner, str(e) or type(e).__name__,
+                                                 job["attempts"])
+                if status == FAILED:
+                    self.failed += 1
+                    await self._notify_finished()
+                return
+            await asyncio.to_thread(self.store.complete, job["id"], owner, result)
+            self.processed += 1
+            await self._notify_finished()
+        except asyncio.CancelledError:
+            # Shutting down: hand the job straight back instead of waiting for the lease to run out
+            work.cancel()
+            self.store.release(job["id"], owner)
+            raise
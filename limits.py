@@ -0,0 +1,44 @@
+import asyncio
+
+
+class QueueFullError(Exception):
+    """Raised when the wait queue in front of the model is already full."""
+
+
+class ConcurrencyLimiter:
+    """Caps concurrent model calls and bounds how many callers may wait for a slot.
+
+    Used as ``async with limiter:`` around a model call, or via ``acquire()`` /
+    ``release()`` when the slot must outlive a single block (streaming). When
+    every slot is taken and ``queue_limit`` callers are already waiting,
+    acquiring raises ``QueueFullError`` immediately instead of queueing forever.
+    """
+
+    def __init__(self, limit: int, queue_limit: int):
+        self.limit = max(1, limit)
+        self.queue_limit = max(0, queue_limit)
+        self.active = 0
+        self.waiting = 0
+        self._sem = asyncio.Semaphore(self.limit)
+
+    async def acquire(self):
+        if self._sem.locked() and self.waiting >= self.queue_limit:
+            raise QueueFullError(f"{self.waiting} requests already waiting for a model slot")
+        self.waiting += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._sem.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+        return False
@@ -1,12 +1,87 @@
+import asyncio
+import hashlib
+import json
+import math
 import os
-from fastapi import FastAPI, Response
-from fastapi.responses import HTMLResponse
+import tempfile
+import threading
+from contextlib import asynccontextmanager
+from typing import Literal
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import google.generativeai as genai
-from fpdf import FPDF
-
-app = FastAPI()
+from starlette.background import BackgroundTask
+from admission import FairScheduler, RateLimitedError, Ticket, parse_weights
+from analysis_cache import AnalysisCache, cache_key
+from cancellation import RequestCancelled, SavingsMeter, Sessions, run_cancellable, until_superseded
+from compaction import StreamRemapper, compact, estimate_tokens
+from incremental import assemble, split_units
+from ingest import ArchiveError, SkippedMembers, iter_chunks, iter_source_files
+from jobs import FINISHED, JobQueue, JobStore, RetryLater
+from limits import QueueFullError
+from near_duplicate import NearDuplicateIndex, adapt, signature
+import metrics
+from metrics import STAGE_SECONDS, InstrumentedBackend, MetricsMiddleware, SlowRequestProfiler
+from model_backends import ModelBackendError, QuotaExceededError
+from pdf_export import PDFRenderer, report_etag
+from resilience import CircuitOpenError, FallbackAnswer, resilient_from_env
+from routing import router_from_env
+from singleflight import SingleFlight
+from static_assets import StaticAssets
+from static_analysis import analyze as analyze_locally, format_facts, render_markdown
+
+# PDF exports render in a process pool so long reports never block the event loop
+pdf_renderer = PDFRenderer(
+    workers=int(os.environ.get("PDF_WORKERS", 2)),
+    timeout=float(os.environ.get("PDF_TIMEOUT", 30)),
+    queue_limit=int(os.environ.get("PDF_QUEUE_LIMIT", 16)),
+    cache_entries=int(os.environ.get("PDF_CACHE_SIZE", 64)),
+    cache_dir=os.environ.get("PDF_CACHE_DIR") or None,
+)
+PDF_STREAM_CHUNK = 64 * 1024
+
+# The UI is served from the prebuilt frontend bundle (see frontend/build.mjs), or from CDNs when it is not built
+static_assets = StaticAssets(os.environ.get("STATIC_DIR") or None)
+
+# Slow-request flame profiles are opt-in: PROFILE_SLOW_MS=2000 dumps folded stacks of requests over 2 s
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", 0))
+profiler = SlowRequestProfiler(PROFILE_SLOW_MS / 1000, os.environ.get("PROFILE_DIR", "profiles")) \
+    if PROFILE_SLOW_MS > 0 else None
+METRICS_LAG_INTERVAL = float(os.environ.get("METRICS_LAG_INTERVAL", 0.5))
+
+# The model SDK and the PDF render processes are set up after the port is bound rather than before it;
+# PREWARM=0 leaves them to the first request that needs them
+PREWARM = os.environ.get("PREWARM", "1") not in ("", "0")
+
+async def prewarm():
+    for name, warm in (("model backend", backend.prewarm), ("PDF renderer", pdf_renderer.prewarm)):
+        try:
+            await asyncio.to_thread(warm)
+        except Exception as e:
+            # The first real call retries the set-up and reports the error properly
+            print(f"Prewarming the {name} failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    lag_sampler = asyncio.create_task(metrics.sample_loop_lag(METRICS_LAG_INTERVAL))
+    job_queue.start()
+    warmer = asyncio.create_task(prewarm()) if PREWARM else None
+    yield
+    if warmer:
+        # Warming runs in threads, which cannot be cancelled; a render process started after the renderer is shut
+        # down would outlive the server, so let it finish first
+        await warmer
+    await job_queue.stop()
+    lag_sampler.cancel()
+    if profiler:
+        profiler.close()
+    # uvicorn re-raises SIGTERM once the app has shut down, before the atexit hook that would stop the render
+    # processes runs, so wait for them here
+    pdf_renderer.shutdown(wait=True)
+    backend.close()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,394 +90,776 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware, profiler=profiler)
+
+@app.exception_handler(RateLimitedError)
+async def rate_limited(request: Request, exc: RateLimitedError):
+    return JSONResponse(status_code=429, content={"detail": "Too many requests, please slow down."},
+                        headers={"Retry-After": str(math.ceil(exc.retry_after))})
+
+@app.exception_handler(RequestCancelled)
+async def request_cancelled(request: Request, exc: RequestCancelled):
+    if exc.reason == "superseded":
+        return JSONResponse(status_code=409, content={"detail": "Superseded by a newer request from this session."})
+    # Nobody is left to read it; 499 is the status proxies log for a client that closed the connection
+    return Response(status_code=499)
+
+@app.exception_handler(ModelBackendError)
+async def model_unavailable(request: Request, exc: ModelBackendError):
+    # Raised once retries, hedges and the fallback are exhausted, straight away while the circuit is open, or when
+    # every API key is out of quota
+    if isinstance(exc, (CircuitOpenError, QuotaExceededError)):
+        return JSONResponse(status_code=503, content={"detail": "The model is unavailable, please retry shortly."},
+                            headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))})
+    return JSONResponse(status_code=502, content={"detail": "The model failed to answer, please retry."})
+
+# MODEL_BACKEND picks gemini (default), genai or the local stub used for load tests. Calls are spread over the
+# GEMINI_API_KEYS pool and MODEL_TIERS by quota headroom (routing.py), and get timeouts, budgeted retries,
+# optional hedging and a circuit breaker (resilience.py); MODEL_FALLBACK names a cheaper model that answers while
+# the primary one is failing
+MODEL_FALLBACK = os.environ.get("MODEL_FALLBACK")
+model_router = router_from_env(default_backend="gemini", default_model="gemini-2.5-flash")
+fallback_router = router_from_env(default_backend="gemini", model_name=MODEL_FALLBACK) if MODEL_FALLBACK else None
+backend = resilient_from_env(
+    InstrumentedBackend(model_router),
+    InstrumentedBackend(fallback_router) if fallback_router else None,
+)
+MODEL_NAME = backend.model_name
+
+# Bump whenever build_prompt changes so stale cached analyses are not served
+PROMPT_VERSION = 3
+
+# Model calls are awaited natively so a pending review never blocks the event loop.
+# At most MODEL_CONCURRENCY calls run at once; MODEL_QUEUE_LIMIT more may wait, the rest get a 503.
+MODEL_CONCURRENCY = int(os.environ.get("MODEL_CONCURRENCY", 8))
+MODEL_QUEUE_LIMIT = int(os.environ.get("MODEL_QUEUE_LIMIT", 32))
+
+# Admission control in front of the model: each client (API key, else IP) gets CLIENT_RATE model calls per
+# second with bursts of CLIENT_BURST (0 disables), queued clients share slots by PRIORITY_WEIGHTS, and requests
+# that cannot be answered within REQUEST_DEADLINE seconds (or a shorter X-Request-Timeout) are shed up front
+CLIENT_RATE = float(os.environ.get("CLIENT_RATE", 2))
+CLIENT_BURST = float(os.environ.get("CLIENT_BURST", 60))
+PRIORITY_WEIGHTS = parse_weights(os.environ.get("PRIORITY_WEIGHTS", "paid=4,senior=2,tutor=1"))
+PAID_API_KEYS = {k.strip() for k in os.environ.get("PAID_API_KEYS", "").split(",") if k.strip()}
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", 60))
+model_limiter = FairScheduler(MODEL_CONCURRENCY, MODEL_QUEUE_LIMIT, PRIORITY_WEIGHTS, CLIENT_RATE, CLIENT_BURST)
+
+# Identical submissions are served from cache: in-process LRU first, then a SQLite file shared by all workers
+analysis_cache = AnalysisCache(
+    max_entries=int(os.environ.get("ANALYSIS_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("ANALYSIS_CACHE_TTL", 86400)),
+    path=os.environ.get("ANALYSIS_CACHE_PATH", "analysis_cache.sqlite3") or None,
+)
 
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
-# Using the updated model to prevent the grpc_status:5 error
-model = genai.GenerativeModel('gemini-2.5-flash')
+# Opt-in: with NEAR_DUPLICATE_THRESHOLD set, submissions nearly identical to another caller's earlier one (renamed
+# variables, reformatting, small edits) reuse its analysis, adapted to the new names and line numbers, when their
+# estimated similarity reaches the threshold. A caller's own earlier submissions never count: resubmitting after an
+# edit, which may be the fix the review asked for, always gets a fresh review
+NEAR_DUPLICATE_THRESHOLD = os.environ.get("NEAR_DUPLICATE_THRESHOLD")
+near_duplicates = NearDuplicateIndex(
+    threshold=float(NEAR_DUPLICATE_THRESHOLD or 1),
+    max_entries=int(os.environ.get("NEAR_DUPLICATE_MAX_ENTRIES", 1_000_000)) if NEAR_DUPLICATE_THRESHOLD else 0,
+)
+# The source and submitter of each indexed submission, kept apart so they never evict analyses from analysis_cache
+submissions = AnalysisCache(
+    max_entries=analysis_cache.memory.max_entries if near_duplicates.max_entries else 0,
+    ttl=analysis_cache.memory.ttl,
+    path=analysis_cache.disk.path if analysis_cache.disk and near_duplicates.max_entries else None,
+)
+
+# Submitted code is compacted before prompting; requests may ask for a smaller budget, never a larger one
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", 24000))
+
+# Concurrent identical submissions share one pending model call, cancelled once none of them waits for it
+inflight = SingleFlight()
+
+# /analyze and /analyze/stream stop the model work of clients that disconnect; requests sharing an X-Session-Id
+# header are "latest wins", so a new submission cancels the one still running for that session
+sessions = Sessions()
+savings = SavingsMeter()
+
+MODEL_SLOTS_ACTIVE = metrics.Gauge("model_slots_active", "Model slots currently held.")
+MODEL_QUEUE_WAITING = metrics.Gauge("model_queue_waiting", "Requests waiting for a model slot.")
+INFLIGHT_KEYS = metrics.Gauge("singleflight_pending_keys", "Distinct analyses currently being generated.")
+ANALYSIS_CACHE_LOOKUPS = metrics.Counter("analysis_cache_lookups_total", "Analysis cache lookups since start.",
+                                         ["tier", "result"])
+PDF_RENDERS_WAITING = metrics.Gauge("pdf_renders_waiting", "PDF exports waiting for a render process.")
+JOBS = metrics.Gauge("jobs", "Jobs in the shared queue by status.", ["status"])
+ADMISSION_QUEUE_DEPTH = metrics.Gauge("admission_queue_depth", "Requests queued for a model slot by priority class.",
+                                      ["priority"])
+
+def collect_live_gauges():
+    MODEL_SLOTS_ACTIVE.set(model_limiter.active)
+    MODEL_QUEUE_WAITING.set(model_limiter.waiting)
+    depths = model_limiter.queue_depths()
+    for priority in {"default", *PRIORITY_WEIGHTS, *depths}:
+        ADMISSION_QUEUE_DEPTH.set(depths.get(priority, 0), priority=priority)
+    INFLIGHT_KEYS.set(len(inflight))
+    PDF_RENDERS_WAITING.set(pdf_renderer.limiter.waiting)
+    counts = job_store.counts()
+    for status in ("queued", "running", "done", "failed"):
+        JOBS.set(counts.get(status, 0), status=status)
+    stats = analysis_cache.stats()
+    for tier in ("memory", "disk"):
+        if tier in stats:
+            ANALYSIS_CACHE_LOOKUPS.set_total(stats[tier]["hits"], tier=tier, result="hit")
+            ANALYSIS_CACHE_LOOKUPS.set_total(stats[tier]["misses"], tier=tier, result="miss")
+    ANALYSIS_CACHE_LOOKUPS.set_total(near_duplicates.hits, tier="near_duplicate", result="hit")
+    ANALYSIS_CACHE_LOOKUPS.set_total(near_duplicates.misses, tier="near_duplicate", result="miss")
+    for router in (model_router, fallback_router):
+        for route in router.stats() if router else ():
+            metrics.MODEL_KEY_HEADROOM.set(route["headroom"], key=route["key"], model=route["model"])
+            metrics.MODEL_KEY_COOLDOWN.set(route["cooldown"], key=route["key"], model=route["model"])
+
+metrics.REGISTRY.add_collector(collect_live_gauges)
+
+# /analyze/batch fans items out at most BATCH_CONCURRENCY at a time (clients may ask for less)
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 4))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 500))
+
+# /analyze/archive: uploads are spooled to disk past 1 MB and chunks are analyzed as they are extracted
+ARCHIVE_MAX_BYTES = int(os.environ.get("ARCHIVE_MAX_BYTES", 50 * 1024 * 1024))
+ARCHIVE_MAX_FILE_BYTES = int(os.environ.get("ARCHIVE_MAX_FILE_BYTES", 1024 * 1024))
+ARCHIVE_MAX_CHUNKS = int(os.environ.get("ARCHIVE_MAX_CHUNKS", 200))
+ARCHIVE_CHUNK_TOKENS = int(os.environ.get("ARCHIVE_CHUNK_TOKENS", 6000))
+
+# POST /jobs: analyses are run by JOB_WORKERS background workers from a SQLite queue (JOB_PATH) that survives
+# restarts and is shared by every uvicorn worker; clients poll GET /jobs/{id} or subscribe to /jobs/{id}/ws
+job_store = JobStore(
+    os.environ.get("JOB_PATH", "jobs.sqlite3"),
+    visibility_timeout=float(os.environ.get("JOB_VISIBILITY_TIMEOUT", 120)),
+    max_attempts=int(os.environ.get("JOB_MAX_ATTEMPTS", 3)),
+    result_ttl=float(os.environ.get("JOB_RESULT_TTL", 86400)),
+)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1.0))
+JOB_MAX_WAIT = 30
 
 class CodeRequest(BaseModel):
     code: str
     language: str
     persona: str
+    # "fast" skips the model and returns only the local static analysis; "incremental" reviews each function,
+    # class and method separately and reuses the reviews of units unchanged since an earlier submission
+    mode: Literal["full", "fast", "incremental"] = "full"
+    token_budget: int | None = None
+
+class BatchRequest(BaseModel):
+    items: list[CodeRequest]
+    concurrency: int | None = None
 
 class PDFRequest(BaseModel):
     feedback: str
     language: str
 
-html_content = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>AI Code Lab Pro</title>
-
-    <script src="https://unpkg.com/react@18/umd/react.production.min.js"></script>
-    <script src="https://unpkg.com/react-dom@18/umd/react-dom.production.min.js"></script>
-    <script src="https://unpkg.com/babel-standalone@6/babel.min.js"></script>
-
-    <script src="https://cdn.jsdelivr.net/npm/marked/marked.min.js"></script>
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/themes/prism-tomorrow.min.css">
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/prism.min.js"></script>
-
-    <style>
-        @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;600;800&family=Fira+Code:wght@400;500&display=swap');
-
-        :root {
-            --bg: #0b0f19;
-            --surface: #111827;
-            --border: #1f2937;
-            --primary: #3b82f6;
-            --primary-hover: #2563eb;
-            --text: #f3f4f6;
-            --text-muted: #9ca3af;
-        }
-
-        * { box-sizing: border-box; margin: 0; padding: 0; }
-
-        /* 1. We let the body scroll normally if needed */
-        body { 
-            font-family: 'Inter', sans-serif; 
-            background-color: var(--bg); 
-            color: var(--text); 
-            min-height: 100vh; 
-            display: flex; 
-            flex-direction: column; 
-        }
-
-        .navbar {
-            padding: 1rem 1.5rem;
-            background: var(--surface);
-            border-bottom: 1px solid var(--border);
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.1);
-        }
-
-        .navbar h1 {
-            font-size: 1.5rem;
-            font-weight: 800;
-            background: linear-gradient(to right, #60a5fa, #a855f7);
-            -webkit-background-clip: text;
-            color: transparent;
-            letter-spacing: -0.5px;
-        }
-
-        .navbar p { font-size: 0.875rem; color: var(--text-muted); font-weight: 600; }
-
-        .workspace {
-            display: flex;
-            gap: 1rem;
-            padding: 1rem;
-            flex-wrap: wrap; /* Allows stacking on small screens */
-            width: 100%;
-            max-width: 1600px;
-            margin: 0 auto;
-        }
-
-        /* 2. THE FIX: Explicit height forces the scrollbars to appear! */
-        .panel {
-            flex: 1 1 45%; /* Take up half the screen, but wrap if too small */
-            min-width: 300px;
-            height: 75vh; /* STRICT HEIGHT */
-            min-height: 500px;
-            background: var(--surface);
-            border: 1px solid var(--border);
-            border-radius: 12px;
-            display: flex;
-            flex-direction: column;
-            box-shadow: 0 10px 15px -3px rgba(0, 0, 0, 0.1);
-        }
-
-        .panel-header {
-            padding: 0.75rem 1rem;
-            background: rgba(17, 24, 39, 0.8);
-            border-bottom: 1px solid var(--border);
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            flex-shrink: 0; /* Prevents header from shrinking */
-        }
-
-        .controls { display: flex; gap: 0.5rem; width: 100%; flex-wrap: wrap; }
-
-        select {
-            flex: 1; 
-            min-width: 100px;
-            background: #1f2937;
-            color: white;
-            border: 1px solid #374151;
-            padding: 0.5rem 0.75rem;
-            border-radius: 8px;
-            font-size: 0.85rem;
-            font-weight: 600;
-            outline: none;
-            cursor: pointer;
-            transition: all 0.2s;
-        }
-
-        select:hover, select:focus { border-color: var(--primary); }
-
-        textarea {
-            flex: 1;
-            width: 100%;
-            background: transparent;
-            border: none;
-            color: #a5b4fc;
-            padding: 1rem;
-            font-family: 'Fira Code', monospace;
-            font-size: 0.9rem;
-            line-height: 1.5;
-            resize: none;
-            outline: none;
-            overflow-y: auto; /* Scrollbar for code input */
-        }
-
-        .btn {
-            padding: 0.85rem;
-            border: none;
-            border-radius: 8px;
-            font-weight: 600;
-            font-size: 1rem;
-            cursor: pointer;
-            transition: all 0.2s cubic-bezier(0.4, 0, 0.2, 1);
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            gap: 0.5rem;
-            flex-shrink: 0;
-        }
-
-        .btn-primary {
-            background: var(--primary);
-            color: white;
-            margin: 1rem;
-        }
-
-        .btn-primary:hover:not(:disabled) { background: var(--primary-hover); }
-        .btn-primary:disabled { opacity: 0.7; cursor: not-allowed; }
-
-        .btn-success {
-            background: rgba(16, 185, 129, 0.1);
-            color: #10b981;
-            border: 1px solid rgba(16, 185, 129, 0.2);
-            padding: 0.4rem 0.8rem;
-            font-size: 0.75rem;
-            border-radius: 6px;
-        }
-        .btn-success:hover { background: rgba(16, 185, 129, 0.2); }
-
-        /* 3. Output area is now guaranteed to scroll within the strict 75vh panel */
-        .output-area {
-            flex: 1;
-            overflow-y: auto; 
-            padding: 1.5rem;
-        }
-
-        .spinner { border: 3px solid rgba(255,255,255,0.1); border-top: 3px solid #fff; border-radius: 50%; width: 20px; height: 20px; animation: spin 1s linear infinite; }
-        @keyframes spin { 0% { transform: rotate(0deg); } 100% { transform: rotate(360deg); } }
-
-        .empty-state { display: flex; flex-direction: column; align-items: center; justify-content: center; height: 100%; color: var(--text-muted); text-align: center; opacity: 0.6; }
-        .empty-state svg { width: 48px; height: 48px; margin-bottom: 1rem; }
-
-        .markdown-body h2 { color: #fff; font-size: 1.5rem; margin-top: 1rem; margin-bottom: 0.75rem; border-bottom: 1px solid var(--border); padding-bottom: 0.25rem; }
-        .markdown-body h3 { color: #e2e8f0; font-size: 1.25rem; margin-top: 1rem; margin-bottom: 0.5rem; }
-        .markdown-body p, .markdown-body li { color: #cbd5e1; line-height: 1.7; margin-bottom: 1rem; }
-        .markdown-body ul { padding-left: 1.5rem; margin-bottom: 1rem; }
-        .markdown-body pre { background: #0b0f19 !important; padding: 1rem; border-radius: 8px; border: 1px solid var(--border); overflow-x: auto; margin: 1rem 0; }
-        .markdown-body code { font-family: 'Fira Code', monospace; font-size: 0.85rem; }
-        .markdown-body p > code, .markdown-body li > code { background: rgba(59, 130, 246, 0.1); color: #93c5fd; padding: 0.2rem 0.4rem; border-radius: 4px; }
-
-        ::-webkit-scrollbar { width: 8px; height: 8px; }
-        ::-webkit-scrollbar-track { background: transparent; }
-        ::-webkit-scrollbar-thumb { background: #374151; border-radius: 4px; }
-        ::-webkit-scrollbar-thumb:hover { background: #4b5563; }
-
-        /* Mobile specific heights */
-        @media (max-width: 768px) {
-            .workspace { padding: 0.5rem; flex-direction: column; }
-            .panel { 
-                width: 100%; 
-                flex: none; 
-                height: 60vh; /* Shorter panels on mobile so you can see both */
-            }
-        }
-    </style>
-</head>
-<body>
-    <div id="root"></div>
-
-    <script type="text/babel">
-        function App() {
-            const [code, setCode] = React.useState('');
-            const [language, setLanguage] = React.useState('C++');
-            const [persona, setPersona] = React.useState('senior');
-            const [loading, setLoading] = React.useState(false);
-            const [result, setResult] = React.useState('');
-            const [rawMarkdown, setRawMarkdown] = React.useState('');
-
-            const analyzeCode = async () => {
-                if (!code.trim()) return alert("Please enter some code.");
-                setLoading(true);
-                setResult('');
-
-                try {
-                    const res = await fetch('/analyze', {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ code, language, persona })
-                    });
-
-                    if (!res.ok) throw new Error("Server connection failed.");
-
-                    const data = await res.json();
-                    setRawMarkdown(data.analysis);
-                    setResult(marked.parse(data.analysis));
-
-                    setTimeout(() => Prism.highlightAll(), 0);
-                } catch (error) {
-                    alert(error.message);
-                } finally {
-                    setLoading(false);
-                }
-            };
-
-            const downloadPDF = async () => {
-                try {
-                    const res = await fetch('/api/download', {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ feedback: rawMarkdown, language })
-                    });
-
-                    if (res.ok) {
-                        const blob = await res.blob();
-                        const url = window.URL.createObjectURL(blob);
-                        const a = document.createElement('a');
-                        a.href = url;
-                        a.download = `Code_Review_${language}.pdf`;
-                        a.click();
-                    } else {
-                        alert("PDF generation failed.");
-                    }
-                } catch (e) {
-                    alert("Network error.");
-                }
-            };
-
-            return (
-                <React.Fragment>
-                    <div className="navbar">
-                        <h1>AI Code Lab Pro</h1>
-                        <p>v2.0</p>
-                    </div>
-
-                    <div className="workspace">
-                        <div className="panel">
-                            <div className="panel-header">
-                                <div className="controls">
-                                    <select value={language} onChange={(e) => setLanguage(e.target.value)}>
-                                        <option value="C++">C++</option>
-                                        <option value="Python">Python</option>
-                                        <option value="Java">Java</option>
-                                    </select>
-                                    <select value={persona} onChange={(e) => setPersona(e.target.value)}>
-                                        <option value="senior">Senior Engineer</option>
-                                        <option value="tutor">Coding Tutor</option>
-                                    </select>
-                                </div>
-                            </div>
-
-                            <textarea 
-                                placeholder="// Write or paste your code here..."
-                                value={code}
-                                onChange={(e) => setCode(e.target.value)}
-                                spellCheck="false"
-                            />
-
-                            <button className="btn btn-primary" onClick={analyzeCode} disabled={loading}>
-                                {loading ? ( <React.Fragment><div className="spinner"></div>Analyzing...</React.Fragment> ) : ( "🚀 Run AI Analysis" )}
-                            </button>
-                        </div>
-
-                        <div className="panel">
-                            <div className="panel-header" style={{ justifyContent: 'space-between' }}>
-                                <h3 style={{ fontSize: '0.9rem', color: '#cbd5e1', fontWeight: '600', display: 'flex', alignItems: 'center', gap: '0.5rem' }}>
-                                    ✨ Analysis Report
-                                </h3>
-                                {result && (
-                                    <button className="btn btn-success" onClick={downloadPDF}>📥 Export PDF</button>
-                                )}
-                            </div>
-
-                            <div className="output-area markdown-body">
-                                {!result && !loading && (
-                                    <div className="empty-state">
-                                        <svg fill="none" stroke="currentColor" viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg"><path strokeLinecap="round" strokeLinejoin="round" strokeWidth="2" d="M10 20l4-16m4 4l4 4-4 4M6 16l-4-4 4-4"></path></svg>
-                                        <p>Awaiting code submission...</p>
-                                    </div>
-                                )}
-                                {result && <div dangerouslySetInnerHTML={{ __html: result }} />}
-                            </div>
-                        </div>
-                    </div>
-                </React.Fragment>
-            );
-        }
-
-        const root = ReactDOM.createRoot(document.getElementById('root'));
-        root.render(<App />);
-    </script>
-</body>
-</html>
-"""
-
 @app.get("/")
-async def get_index():
-    return HTMLResponse(content=html_content)
+async def get_index(request: Request):
+    return static_assets.index(request)
 
-@app.post("/analyze")
-async def analyze_code(req: CodeRequest):
+@app.get("/assets/{name}")
+async def get_asset(name: str, request: Request):
+    return static_assets.asset(name, request)
+
+@app.get("/dev/{name}")
+async def get_dev_file(name: str, request: Request):
+    return static_assets.dev_file(name, request)
+
+def request_token_budget(req: CodeRequest) -> int:
+    return max(1, min(req.token_budget or PROMPT_TOKEN_BUDGET, PROMPT_TOKEN_BUDGET))
+
+def build_prompt(req: CodeRequest):
+    """Returns the prompt and the compacted code it embeds (for its line map and stats)."""
+    report = analyze_locally(req.code, req.language)
+    compacted = compact(req.code, req.language, report, request_token_budget(req))
     role = "Senior Software Engineer" if req.persona == "senior" else "Patient Coding Tutor"
-    prompt = f"Act as a {role}. Analyze this {req.language} code for logic, efficiency, and time complexity. Use markdown for formatting:\n\n{req.code}"
+    prompt = (f"Act as a {role}. Analyze this {req.language} code for logic, efficiency, and time complexity. "
+              f"Use markdown for formatting. Comments, blank lines and repeated blocks were stripped from the code "
+              f"to save space.\n\n{format_facts(report, compacted.line_map.to_compact)}\n\nCODE:\n{compacted.text}")
+    return prompt, compacted
 
-    response = model.generate_content(prompt)
-    return {"analysis": response.text}
+def build_unit_prompt(unit, req: CodeRequest) -> str:
+    role = "Senior Software Engineer" if req.persona == "senior" else "Patient Coding Tutor"
+    what = "a group of small definitions" if unit.kind == "group" else f"one {unit.kind}"
+    return (f"Act as a {role}. The code below is {what} (`{unit.name}`) from a larger {req.language} file; review only "
+            f"this part for logic, efficiency, and time complexity. Be concise, use markdown with no headings above "
+            f"level 3, and number lines from the start of this code. Comments and blank lines were stripped.\n\n"
+            f"{format_facts(unit.report, unit.compacted.line_map.to_compact)}\n\nCODE:\n{unit.compacted.text}")
+
+def build_chunk_prompt(chunk_text: str, persona: str) -> str:
+    role = "Senior Software Engineer" if persona == "senior" else "Patient Coding Tutor"
+    return (f"Act as a {role}. The following is one part of a larger project. Review it for logic, efficiency, "
+            f"and time complexity. Refer to files and line numbers. Be concise and use markdown:\n\n{chunk_text}")
+
+def build_reduce_prompt(reports: list, persona: str, file_count: int) -> str:
+    role = "Senior Software Engineer" if persona == "senior" else "Patient Coding Tutor"
+    joined = "\n\n---\n\n".join(reports)
+    return (f"Act as a {role}. Below are reviews of separate parts of a {file_count}-file project. Merge them into "
+            f"one cohesive markdown report: an overall summary, the most important issues ordered by severity with "
+            f"file references, complexity hotspots, and recommendations. Drop duplicates:\n\n{joined}")
+
+def request_ticket(request: Request, persona: str, timeout: float | None = REQUEST_DEADLINE) -> Ticket:
+    """Identify the caller for admission control: API key (hashed) or client address, priority class, deadline."""
+    api_key = request.headers.get("x-api-key")
+    if api_key:
+        client = "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    else:
+        client = "ip:" + (request.client.host if request.client else "unknown")
+    if api_key in PAID_API_KEYS:
+        priority = "paid"
+    else:
+        priority = persona if persona in PRIORITY_WEIGHTS else "default"
+    requested = request.headers.get("x-request-timeout")
+    if requested is not None:
+        try:
+            requested = float(requested)
+        except ValueError:
+            requested = math.nan
+        # A nan deadline never expires and a negative one sheds the request at once
+        if not math.isfinite(requested) or requested <= 0:
+            raise HTTPException(status_code=400, detail="X-Request-Timeout must be a positive number of seconds.")
+        timeout = requested if timeout is None else min(timeout, requested)
+    deadline = asyncio.get_running_loop().time() + timeout if timeout is not None else None
+    return Ticket(client, priority, deadline)
+
+def start_session(request: Request, ticket: Ticket):
+    """Supersede the running request of the caller's ``X-Session-Id``; ``(None, None)`` without one."""
+    session_id = request.headers.get("x-session-id")
+    if not session_id:
+        return None, None
+    # Scoped to the caller, so a guessed session id cannot cancel someone else's requests
+    session = f"{ticket.client}\0{session_id}"
+    return session, sessions.start(session)
+
+def finish_session(session, superseded):
+    if session is not None:
+        sessions.finish(session, superseded)
+
+def request_cache_key(req: CodeRequest) -> str:
+    return cache_key(req.code, req.language, req.persona, MODEL_NAME, PROMPT_VERSION, request_token_budget(req))
+
+def near_duplicate_scope(req: CodeRequest) -> str:
+    # Only analyses written for the same language, persona, model, prompt and budget are interchangeable
+    return "\0".join((req.language, req.persona, MODEL_NAME, str(PROMPT_VERSION), str(request_token_budget(req))))
+
+def submitter(ticket: Ticket) -> str:
+    # Stored next to the analysis, so hashed rather than the caller's IP address or API key
+    return hashlib.sha256(ticket.client.encode()).hexdigest()[:16]
+
+async def find_near_duplicate(req: CodeRequest, ticket: Ticket):
+    """Signature of the submission, and the adapted analysis of another caller's near-identical one (or None)."""
+    if not near_duplicates.max_entries:
+        return None, None
+
+    def lookup():
+        sig = signature(req.code, req.language)
+        return sig, near_duplicates.lookup(near_duplicate_scope(req), sig) if sig else None
+
+    sig, found = await asyncio.to_thread(lookup)
+    if found is None:
+        return sig, None
+    ref, similarity = found
+    entry = await submissions.get("submission:" + ref)
+    source, owner = json.loads(entry) if entry is not None else (None, None)
+    if owner == submitter(ticket):
+        return sig, None
+    analysis = await analysis_cache.get(ref)
+    if analysis is None:
+        return sig, None
+    if source is not None:
+        analysis = await asyncio.to_thread(adapt, analysis, source, req.code, req.language)
+    note = (f"_Reused the review of a near-identical earlier submission ({similarity:.0%} similar)"
+            + (", adapted to this code's names and line numbers._" if source is not None else "._"))
+    return sig, {"analysis": f"{note}\n\n{analysis}", "cached": True,
+                 "near_duplicate": {"similarity": round(similarity, 3), "adapted": source is not None}}
+
+async def remember_submission(req: CodeRequest, key: str, sig, ticket: Ticket):
+    """Index a freshly analyzed submission, with its source so later near-duplicates can be adapted."""
+    if sig is None or not near_duplicates.max_entries or await analysis_cache.get(key) is None:
+        # Too short to compare, or the analysis was not cached (a fallback answer)
+        return
+    await submissions.set("submission:" + key, json.dumps([req.code, submitter(ticket)]))
+    await asyncio.to_thread(near_duplicates.add, near_duplicate_scope(req), sig, key)
+
+def unit_cache_key(unit, req: CodeRequest) -> str:
+    # Keyed by fingerprint, not text, so comment and whitespace edits still hit
+    return cache_key(unit.fingerprint, req.language, req.persona, MODEL_NAME, PROMPT_VERSION,
+                     request_token_budget(req), "unit")
+
+def iter_file(handle, chunk_size: int = PDF_STREAM_CHUNK):
+    """Yield a file in chunks and close it; Starlette runs sync iterators in its thread pool."""
+    with handle:
+        while chunk := handle.read(chunk_size):
+            yield chunk
+
+def sse_event(data: dict, event: str = None) -> str:
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+async def generate_analysis(key: str, prompt: str, ticket: Ticket, transform=None) -> str:
+    # Coalesced callers share the slot, and so the ticket, of whoever asked first
+    started = False
+    try:
+        async with model_limiter.slot(ticket):
+            started = True
+            text = await backend.generate_async(prompt)
+    except asyncio.CancelledError:
+        savings.cancelled_call(prompt, started)
+        raise
+    savings.answered(text)
+    # Fallback answers are served but not cached, so the primary model's review replaces them later
+    degraded = isinstance(text, FallbackAnswer)
+    text = transform(text) if transform and text else text
+    if text and not degraded:
+        await analysis_cache.set(key, text)
+    return text
+
+async def run_incremental(req: CodeRequest, ticket: Ticket) -> dict:
+    """Review only the units whose fingerprint has no cached review; the rest are reused."""
+    def split():
+        return analyze_locally(req.code, req.language), split_units(req.code, req.language, request_token_budget(req))
+
+    with STAGE_SECONDS.time(stage="split_units"):
+        report, units = await asyncio.to_thread(split)
+    keys = [unit_cache_key(unit, req) for unit in units]
+    with STAGE_SECONDS.time(stage="cache_lookup"):
+        reviews = list(await asyncio.gather(*(analysis_cache.get(key) for key in keys)))
+    reused = [review is not None for review in reviews]
+    gate = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+
+    async def review_unit(index: int):
+        unit, key = units[index], keys[index]
+        async with gate:
+            prompt = build_unit_prompt(unit, req)
+            reviews[index] = await inflight.do(key, lambda: generate_analysis(key, prompt, ticket))
+
+    # A failed unit fails the request, but the units that did finish are cached, so a retry only redoes the rest
+    await asyncio.gather(*(review_unit(i) for i, hit in enumerate(reused) if not hit))
+    with STAGE_SECONDS.time(stage="assemble"):
+        analysis = assemble(report, units, reviews, reused)
+    return {
+        "analysis": analysis,
+        "cached": all(reused),
+        "mode": "incremental",
+        "units": [{"name": unit.name, "kind": unit.kind, "lines": [unit.first_line, unit.last_line],
+                   "reused": hit} for unit, hit in zip(units, reused)],
+        "stats": {
+            "units": len(units),
+            "units_reused": sum(reused),
+            "original_tokens": estimate_tokens(req.code),
+            "prompt_tokens": sum(unit.tokens for unit, hit in zip(units, reused) if not hit),
+        },
+    }
+
+async def run_analysis(req: CodeRequest, ticket: Ticket) -> dict:
+    if req.mode == "fast":
+        with STAGE_SECONDS.time(stage="static_analysis"):
+            report = await asyncio.to_thread(analyze_locally, req.code, req.language)
+        return {"analysis": render_markdown(report), "cached": False, "mode": "fast"}
+    if req.mode == "incremental":
+        return await run_incremental(req, ticket)
+
+    key = request_cache_key(req)
+    with STAGE_SECONDS.time(stage="cache_lookup"):
+        cached = await analysis_cache.get(key)
+    if cached is not None:
+        return {"analysis": cached, "cached": True}
+    with STAGE_SECONDS.time(stage="near_duplicate"):
+        sig, reused = await find_near_duplicate(req, ticket)
+    if reused is not None:
+        await analysis_cache.set(key, reused["analysis"])
+        return reused
+
+    async def generate():
+        with STAGE_SECONDS.time(stage="build_prompt"):
+            prompt, compacted = await asyncio.to_thread(build_prompt, req)
+        analysis = await generate_analysis(key, prompt, ticket, compacted.line_map.remap_references)
+        await remember_submission(req, key, sig, ticket)
+        return {"analysis": analysis, "stats": compacted.stats}
+
+    return {**await inflight.do(key, generate), "cached": False}
+
+@app.post("/analyze")
+async def analyze_code(req: CodeRequest, request: Request):
+    ticket = request_ticket(request, req.persona)
+    session, superseded = start_session(request, ticket)
+    try:
+        result = await run_cancellable(run_analysis(req, ticket), request.receive, superseded)
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Server busy, please retry shortly.",
+                            headers={"Retry-After": "5"})
+    finally:
+        finish_session(session, superseded)
+    with STAGE_SECONDS.time(stage="serialize"):
+        body = json.dumps(result)
+    return Response(content=body, media_type="application/json")
+
+@app.post("/analyze/batch")
+async def analyze_batch(batch: BatchRequest, request: Request):
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"A batch may contain at most {BATCH_MAX_ITEMS} items.")
+    limit = max(1, min(batch.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY))
+    gate = asyncio.Semaphore(limit)
+
+    async def analyze_item(index: int, item: CodeRequest) -> dict:
+        async with gate:
+            try:
+                return {"index": index, **await run_analysis(item, request_ticket(request, item.persona))}
+            except RateLimitedError as e:
+                return {"index": index, "error": "Too many requests, please slow down.", "status": 429,
+                        "retry_after": math.ceil(e.retry_after)}
+            except (QueueFullError, CircuitOpenError, QuotaExceededError):
+                return {"index": index, "error": "Server busy, please retry shortly.", "status": 503}
+            except ModelBackendError:
+                return {"index": index, "error": "The model failed to answer, please retry.", "status": 502}
+            except Exception as e:
+                return {"index": index, "error": str(e), "status": 500}
+
+    async def results():
+        tasks = [asyncio.create_task(analyze_item(i, item)) for i, item in enumerate(batch.items)]
+        try:
+            # One NDJSON line per item, in completion order
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@app.post("/analyze/stream")
+async def analyze_code_stream(req: CodeRequest, request: Request):
+    ticket = request_ticket(request, req.persona)
+    session, superseded = start_session(request, ticket)
+    try:
+        # Until the response starts, a disconnect is only noticed by watching for it
+        return await run_cancellable(open_stream(req, ticket, session, superseded), request.receive, superseded)
+    except BaseException:
+        finish_session(session, superseded)
+        raise
+
+async def open_stream(req: CodeRequest, ticket: Ticket, session, superseded) -> StreamingResponse:
+    done = None
+    if req.mode == "fast":
+        cached = None
+        report = await asyncio.to_thread(analyze_locally, req.code, req.language)
+        text = render_markdown(report)
+    elif req.mode == "incremental":
+        # Unit reviews run concurrently, so the assembled report is sent as one event
+        try:
+            result = await run_incremental(req, ticket)
+        except QueueFullError:
+            raise HTTPException(status_code=503, detail="Server busy, please retry shortly.",
+                                headers={"Retry-After": "5"})
+        text = result["analysis"]
+        done = {"cached": result["cached"], "units": result["units"], "stats": result["stats"]}
+    else:
+        key = request_cache_key(req)
+        text = cached = await analysis_cache.get(key)
+        if text is None:
+            sig, reused = await find_near_duplicate(req, ticket)
+            if reused is not None:
+                await analysis_cache.set(key, reused["analysis"])
+                text = reused["analysis"]
+                done = {"cached": True, "near_duplicate": reused["near_duplicate"]}
+    if text is not None:
+        async def single_event():
+            yield sse_event({"text": text})
+            yield sse_event(done or {"cached": cached is not None}, event="done")
+        return StreamingResponse(single_event(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache"},
+                                 background=BackgroundTask(finish_session, session, superseded))
+
+    with STAGE_SECONDS.time(stage="build_prompt"):
+        prompt, compacted = await asyncio.to_thread(build_prompt, req)
+
+    # Take the model slot before the response starts so an overloaded server can still answer 503
+    try:
+        started = await model_limiter.acquire(ticket)
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Server busy, please retry shortly.",
+                            headers={"Retry-After": "5"})
+    except asyncio.CancelledError:
+        savings.cancelled_call(prompt, False)
+        raise
+    released = False
+
+    def release():
+        # From the stream's end, or from the response's background task if the stream never started
+        nonlocal released
+        if not released:
+            released = True
+            model_limiter.release(started)
+            finish_session(session, superseded)
+
+    async def events():
+        parts, degraded = [], False
+        # Line references are rewritten to the original numbering one complete line at a time
+        remapper = StreamRemapper(compacted.line_map)
+        chunks = backend.stream(prompt)
+        if superseded is not None:
+            chunks = until_superseded(chunks, superseded)
+        try:
+            async for chunk in chunks:
+                degraded = degraded or isinstance(chunk, FallbackAnswer)
+                text = remapper.feed(chunk)
+                if text:
+                    parts.append(text)
+                    yield sse_event({"text": text})
+            text = remapper.flush()
+            if text:
+                parts.append(text)
+                yield sse_event({"text": text})
+            savings.answered("".join(parts))
+            if parts and not degraded:
+                await analysis_cache.set(key, "".join(parts))
+                await remember_submission(req, key, sig, ticket)
+            yield sse_event({"cached": False, "stats": compacted.stats}, event="done")
+        except RequestCancelled:
+            savings.cancelled_call(prompt, True, "".join(parts))
+            yield sse_event({"error": "Superseded by a newer request from this session."}, event="cancelled")
+        except asyncio.CancelledError:
+            # Starlette cancels the response when the client disconnects
+            metrics.REQUESTS_CANCELLED.inc(reason="disconnect")
+            savings.cancelled_call(prompt, True, "".join(parts))
+            raise
+        except Exception as e:
+            yield sse_event({"error": str(e)}, event="error")
+        finally:
+            release()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release),
+    )
+
+async def run_job(payload: dict) -> dict:
+    # Jobs have no deadline; when the model is busy or rate limited they go back on the queue instead of failing
+    try:
+        return await run_analysis(CodeRequest(**payload["request"]), Ticket(payload["client"], payload["priority"]))
+    except RateLimitedError as e:
+        raise RetryLater(str(e), e.retry_after)
+    except (QueueFullError, CircuitOpenError, QuotaExceededError) as e:
+        raise RetryLater(str(e), max(1.0, getattr(e, "retry_after", None) or 5))
+
+job_queue = JobQueue(job_store, run_job, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(req: CodeRequest, request: Request):
+    ticket = request_ticket(request, req.persona, timeout=None)
+    job_id = await job_queue.submit({"request": req.model_dump(), "client": ticket.client, "priority": ticket.priority})
+    return JSONResponse(status_code=202, content={"id": job_id, "status": "queued"},
+                        headers={"Location": f"/jobs/{job_id}"})
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    # ?wait=N long-polls for up to N seconds (at most JOB_MAX_WAIT) until the job finishes
+    if wait > 0:
+        job = await job_queue.wait(job_id, min(wait, JOB_MAX_WAIT))
+    else:
+        job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No such job, or its result has expired.")
+    return job
+
+@app.websocket("/jobs/{job_id}/ws")
+async def watch_job(websocket: WebSocket, job_id: str):
+    """Sends the job's current state, then its final state once it finishes, and closes."""
+    await websocket.accept()
+    job = await job_queue.get(job_id)
+    if job is None:
+        await websocket.close(code=4404, reason="No such job")
+        return
+    await websocket.send_json(job)
+    if job["status"] in FINISHED:
+        await websocket.close()
+        return
+    finished = asyncio.create_task(job_queue.wait(job_id))
+    # Watch for the client going away too, so an abandoned socket does not keep polling
+    received = asyncio.create_task(websocket.receive())
+    try:
+        while True:
+            done, _ = await asyncio.wait({finished, received}, return_when=asyncio.FIRST_COMPLETED)
+            if finished in done:
+                if finished.result() is not None:
+                    await websocket.send_json(finished.result())
+                await websocket.close()
+                return
+            if received.result()["type"] == "websocket.disconnect":
+                return
+            received = asyncio.create_task(websocket.receive())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        finished.cancel()
+        received.cancel()
+
+async def analyze_prompt(prompt: str, ticket: Ticket) -> str:
+    # Archive chunks and reduce steps are keyed by the full prompt, which already names persona and role
+    key = cache_key(prompt, "", "", MODEL_NAME, PROMPT_VERSION)
+    cached = await analysis_cache.get(key)
+    if cached is not None:
+        return cached
+    return await inflight.do(key, lambda: generate_analysis(key, prompt, ticket))
+
+@app.post("/analyze/archive")
+async def analyze_archive(request: Request, persona: str = "senior"):
+    # Spool the raw zip/tar body; anything past 1 MB goes to a temp file, not memory
+    upload = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    size = 0
+    async for part in request.stream():
+        size += len(part)
+        if size > ARCHIVE_MAX_BYTES:
+            upload.close()
+            raise HTTPException(status_code=413, detail=f"Archives are limited to {ARCHIVE_MAX_BYTES} bytes.")
+        upload.write(part)
+
+    # Archives run far longer than one review, so they only get a deadline when the client sets one
+    ticket = request_ticket(request, persona, timeout=None)
+    loop = asyncio.get_running_loop()
+    limit = max(1, BATCH_CONCURRENCY)
+    chunks = asyncio.Queue(maxsize=limit * 2)
+    stop = threading.Event()
+    skipped, reports = SkippedMembers(), {}
+    files, last_file, truncated = 0, None, False
+
+    def extract():
+        # Runs in a worker thread: extraction blocks on the bounded queue, so only a few chunks exist at once
+        nonlocal files, last_file, truncated
+        for chunk in iter_chunks(iter_source_files(upload, ARCHIVE_MAX_FILE_BYTES, skipped), ARCHIVE_CHUNK_TOKENS):
+            if stop.is_set():
+                return
+            if chunk.index >= ARCHIVE_MAX_CHUNKS:
+                truncated = True
+                break
+            # Files come in archive order, so one split across chunks only repeats at a chunk boundary
+            for name in chunk.files:
+                files, last_file = files + (name != last_file), name
+            asyncio.run_coroutine_threadsafe(chunks.put(chunk), loop).result()
+        # Only after a clean run: on an ArchiveError the queued chunks are dropped, not analyzed
+        for _ in range(limit):
+            asyncio.run_coroutine_threadsafe(chunks.put(None), loop).result()
+
+    async def analyze_chunks():
+        while (chunk := await chunks.get()) is not None:
+            try:
+                reports[chunk.index] = await analyze_prompt(build_chunk_prompt(chunk.text, persona), ticket)
+            except QueueFullError:
+                reports[chunk.index] = f"_Part {chunk.index + 1} ({', '.join(chunk.files)}) was skipped: server busy._"
+            except Exception as e:
+                reports[chunk.index] = f"_Part {chunk.index + 1} ({', '.join(chunk.files)}) failed: {e}_"
+
+    analyzers = [asyncio.create_task(analyze_chunks()) for _ in range(limit)]
+    try:
+        await asyncio.gather(asyncio.to_thread(extract), *analyzers)
+    except ArchiveError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        # If we are bailing out early, stop the model calls still running and unblock the extractor so its thread
+        # can finish
+        stop.set()
+        for task in analyzers:
+            task.cancel()
+        while not chunks.empty():
+            chunks.get_nowait()
+        await asyncio.gather(*analyzers, return_exceptions=True)
+        upload.close()
+
+    if not reports:
+        raise HTTPException(status_code=422, detail="No supported source files (Python, C++, Java) found in the archive.")
+
+    # Reduce: merge part reports in groups that fit the token budget until one report remains
+    level = [reports[i] for i in sorted(reports)]
+    while len(level) > 1:
+        groups, group, tokens = [], [], 0
+        for report in level:
+            report_tokens = estimate_tokens(report)
+            if group and tokens + report_tokens > ARCHIVE_CHUNK_TOKENS:
+                groups.append(group)
+                group, tokens = [], 0
+            group.append(report)
+            tokens += report_tokens
+        groups.append(group)
+        if len(groups) == len(level):
+            # Every report already fills the budget on its own; merge pairwise so the tree still shrinks
+            groups = [level[i:i + 2] for i in range(0, len(level), 2)]
+        try:
+            level = await asyncio.gather(*(analyze_prompt(build_reduce_prompt(g, persona, files), ticket) for g in groups))
+        except QueueFullError:
+            raise HTTPException(status_code=503, detail="Server busy, please retry shortly.",
+                                headers={"Retry-After": "5"})
+
+    return {
+        "analysis": level[0],
+        "files": files,
+        "chunks": len(reports),
+        "skipped": skipped.sample,
+        "skipped_count": skipped.count,
+        "truncated": truncated,
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/api/admission/stats")
+async def admission_stats():
+    return {
+        "active": model_limiter.active,
+        "waiting": model_limiter.waiting,
+        "queue_depth": model_limiter.queue_depths(),
+        "admitted": model_limiter.admitted,
+        "shed": dict(model_limiter.shed),
+        "service_time": model_limiter.service_time,
+    }
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    stats = analysis_cache.stats()
+    stats["inflight"] = {"pending": len(inflight), "calls": inflight.calls, "coalesced": inflight.coalesced,
+                         "cancelled": inflight.cancelled}
+    stats["cancellation"] = {"sessions": len(sessions), "superseded": sessions.superseded,
+                             "model_calls_cancelled": savings.cancelled, "tokens_saved": savings.tokens_saved}
+    stats["near_duplicates"] = near_duplicates.stats()
+    return stats
+
+@app.get("/api/routing/stats")
+async def routing_stats():
+    # Per API key (hashed) and model: quota headroom, cool-down and call outcomes
+    return {"primary": model_router.stats(), "fallback": fallback_router.stats() if fallback_router else []}
 
 @app.post("/api/download")
-async def download_pdf(req: PDFRequest):
+async def download_pdf(req: PDFRequest, request: Request):
+    etag = report_etag(req.feedback, req.language)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    handle = None
     try:
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_auto_page_break(auto=True, margin=15)
-
-        # Title
-        pdf.set_font("Helvetica", 'B', 16)
-        pdf.cell(0, 10, f"Code Review Report - {req.language}", ln=True, align='C')
-        pdf.ln(5)
-
-        # Body
-        pdf.set_font("Helvetica", size=11)
-
-        # 1. Clean up markdown formatting
-        clean_text = req.feedback.replace('**', '').replace('```', '')
-
-        # 2. THE FIX: Force the text into safe characters so FPDF doesn't crash
-        safe_text = clean_text.encode('latin-1', 'ignore').decode('latin-1')
-
-        pdf.multi_cell(0, 7, safe_text)
-
-        pdf_bytes = bytes(pdf.output())
-        return Response(
-            content=pdf_bytes,
-            media_type="application/pdf",
-            headers={"Content-Disposition": f"attachment; filename=Code_Review_{req.language}.pdf"}
-        )
-    except Exception as e:
-        print(f"PDF Generation Error: {str(e)}")
+        # A cached file can be pruned between render() and open(); one re-render covers that race
+        for _ in range(2):
+            path = await pdf_renderer.render(req.feedback, req.language, etag)
+            try:
+                handle = open(path, "rb")
+                break
+            except FileNotFoundError:
+                continue
+        if handle is None:
+            raise FileNotFoundError(path)
+    except QueueFullError:
+        return Response(status_code=503, content="PDF export busy, please retry shortly.", headers={"Retry-After": "5"})
+    # Timeouts and failures are counted by the outcome label of pdf_render_duration_seconds
+    except asyncio.TimeoutError:
+        return Response(status_code=504, content="PDF generation timed out")
+    except Exception:
         return Response(status_code=500, content="Failed to generate PDF")
 
+    headers["Content-Length"] = str(os.fstat(handle.fileno()).st_size)
+    headers["Content-Disposition"] = f"attachment; filename=Code_Review_{req.language}.pdf"
+    return StreamingResponse(iter_file(handle), media_type="application/pdf", headers=headers)
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 10000))
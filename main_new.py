@@ -1,14 +1,25 @@
+import asyncio
+import math
 import os
-from fastapi import FastAPI, Response
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-from google import genai
-from fpdf import FPDF
 from fastapi.middleware.cors import CORSMiddleware
-
-# 1. Setup AI Client
-api_key = os.environ.get("GEMINI_API_KEY")
-client = genai.Client(api_key=api_key)
+import metrics
+from metrics import InstrumentedBackend, MetricsMiddleware
+from model_backends import ModelBackendError, QuotaExceededError
+from resilience import CircuitOpenError, resilient_from_env
+from routing import router_from_env
+
+# 1. Setup AI backend (MODEL_BACKEND=stub runs without network access or quota), spread over the GEMINI_API_KEYS
+# pool, with timeouts, retries and a circuit breaker around every call; MODEL_FALLBACK names a cheaper model to
+# use while the primary one fails
+MODEL_FALLBACK = os.environ.get("MODEL_FALLBACK")
+backend = resilient_from_env(
+    InstrumentedBackend(router_from_env(default_backend="genai", default_model="gemini-2.0-flash")),
+    InstrumentedBackend(router_from_env(default_backend="genai", model_name=MODEL_FALLBACK))
+    if MODEL_FALLBACK else None,
+)
 
 app = FastAPI()
 
@@ -20,6 +31,17 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(ModelBackendError)
+async def model_unavailable(request: Request, exc: ModelBackendError):
+    # Same mapping as main.py: the circuit is open or every API key is out of quota (503), or retries and the
+    # fallback are exhausted (502). A fallback model's answer is not an error and comes back as normal feedback
+    if isinstance(exc, (CircuitOpenError, QuotaExceededError)):
+        return JSONResponse(status_code=503, content={"detail": "The model is unavailable, please retry shortly."},
+                            headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))})
+    return JSONResponse(status_code=502, content={"detail": "The model failed to answer, please retry."})
 
 
 class CodeSubmission(BaseModel):
@@ -30,22 +52,21 @@ class CodeSubmission(BaseModel):
 
 @app.post("/api/assess")
 async def assess_code(submission: CodeSubmission):
-    try:
-        role = "Senior Engineer" if submission.persona == "senior" else "Coding Tutor"
-        prompt = f"Act as a {role}. Analyze this {submission.language} code for bugs, logic, and complexity. Use Markdown formatting.\n\nCODE:\n{submission.code}"
+    role = "Senior Engineer" if submission.persona == "senior" else "Coding Tutor"
+    prompt = f"Act as a {role}. Analyze this {submission.language} code for bugs, logic, and complexity. Use Markdown formatting.\n\nCODE:\n{submission.code}"
 
-        # Ensure model name is correct for your SDK version
-        response = client.models.generate_content(model='gemini-2.0-flash',
-                                                  contents=prompt)
-        return {"feedback": response.text}
-    except Exception as e:
-        return {"feedback": f"**AI Error:** {str(e)}"}
+    # Awaited natively so a slow model call never blocks the event loop
+    return {"feedback": await backend.generate_async(prompt)}
 
 
-@app.post("/api/download")
-async def download_pdf(data: dict):
-    feedback = data.get("feedback", "No feedback available.")
-    language = data.get("language", "Code")
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def build_report_pdf(feedback: str, language: str) -> bytes:
+    # fpdf costs ~300 ms to import, so it loads with the first download instead of at start-up
+    from fpdf import FPDF
 
     pdf = FPDF()
     pdf.add_page()
@@ -54,8 +75,16 @@ async def download_pdf(data: dict):
     pdf.ln(10)
     pdf.set_font("Helvetica", size=12)
     pdf.multi_cell(0, 10, feedback)
+    return bytes(pdf.output())
+
+
+@app.post("/api/download")
+async def download_pdf(data: dict):
+    feedback = data.get("feedback", "No feedback available.")
+    language = data.get("language", "Code")
 
-    pdf_bytes = pdf.output(dest='S')
+    # Laying out a long report takes seconds of CPU, so it runs in a thread instead of on the event loop
+    pdf_bytes = await asyncio.to_thread(build_report_pdf, feedback, language)
     return Response(content=pdf_bytes,
                     media_type="application/pdf",
                     headers={
@@ -117,6 +146,7 @@ html_content = """
                     body: JSON.stringify({ code, language: lang, persona: "senior" })
                 });
                 const data = await response.json();
+                if (!response.ok) return alert(data.detail || "The review failed, please retry.");
                 document.getElementById('result-card').classList.remove('hidden');
                 document.getElementById('result-content').innerText = data.feedback;
             } catch (e) {
@@ -0,0 +1,381 @@
+"""Prometheus-style metrics, request instrumentation and an opt-in sampling profiler.
+
+The registry is deliberately tiny (counters, gauges, histograms with labels)
+and renders the Prometheus text exposition format, so ``/metrics`` works
+without extra dependencies. ``MetricsMiddleware`` is a plain ASGI middleware:
+it times each request until its last body chunk is sent, so streaming
+responses are measured end to end without buffering them.
+"""
+import asyncio
+import bisect
+import collections
+import math
+import os
+import sys
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels):
+        """Mirror a cumulative count kept elsewhere (e.g. cache statistics), read at scrape time."""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', _format_value(bound))])} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric: Metric):
+        self._metrics.append(metric)
+
+    def add_collector(self, fn):
+        """``fn()`` runs before every render, typically to copy live state into gauges."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        for collect in self._collectors:
+            collect()
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time from request start to the last response byte.",
+                                 ["method", "route", "status"])
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled.")
+MODEL_TTFT_SECONDS = Histogram("model_time_to_first_token_seconds", "Time until a streamed model call yields text.",
+                               ["backend"])
+MODEL_CALL_SECONDS = Histogram("model_call_duration_seconds", "Total duration of model calls.",
+                               ["backend", "mode", "outcome"])
+MODEL_PROMPT_BYTES = Histogram("model_prompt_bytes", "Size of prompts sent to the model.", ["backend"],
+                               buckets=SIZE_BUCKETS)
+MODEL_RESPONSE_BYTES = Histogram("model_response_bytes", "Size of model answers.", ["backend"], buckets=SIZE_BUCKETS)
+MODEL_IN_FLIGHT = Gauge("model_calls_in_flight", "Model calls currently running.", ["backend"])
+STAGE_SECONDS = Histogram("request_stage_duration_seconds", "Time spent in individual request stages.", ["stage"])
+EVENT_LOOP_LAG_SECONDS = Histogram("event_loop_lag_seconds", "How late the event loop ran a timer.",
+                                   buckets=LAG_BUCKETS)
+PDF_RENDER_SECONDS = Histogram("pdf_render_duration_seconds", "PDF render time, excluding cache hits.", ["outcome"])
+PDF_CACHE_HITS = Counter("pdf_cache_hits_total", "PDF exports served from the render cache.")
+SLOW_REQUEST_PROFILES = Counter("slow_request_profiles_total", "Flame profiles written for slow requests.")
+MODEL_RESILIENCE_EVENTS = Counter("model_resilience_events_total",
+                                  "Retries, hedges, timeouts, short circuits and fallbacks around model calls.",
+                                  ["event"])
+MODEL_CIRCUIT_OPEN = Gauge("model_circuit_open", "1 while the model circuit breaker is open.")
+ADMISSION_SHED = Counter("admission_shed_total", "Model calls refused before they started.",
+                         ["reason", "priority"])
+REQUESTS_CANCELLED = Counter("requests_cancelled_total",
+                             "Requests whose work was cancelled because the client left or sent a newer request.",
+                             ["reason"])
+MODEL_CALLS_CANCELLED = Counter("model_calls_cancelled_total",
+                                "Model calls cancelled while queued for a slot or while running.", ["stage"])
+MODEL_TOKENS_SAVED = Counter("model_tokens_saved_total", "Estimated tokens not spent thanks to cancelled model calls.",
+                             ["direction"])
+MODEL_KEY_REQUESTS = Counter("model_key_requests_total", "Model calls per API key and model, by outcome.",
+                             ["key", "model", "outcome"])
+MODEL_KEY_TOKENS = Counter("model_key_tokens_total", "Estimated tokens sent and received per API key and model.",
+                           ["key", "model", "direction"])
+MODEL_KEY_HEADROOM = Gauge("model_key_headroom_ratio",
+                           "Share of the key's request and token quota that is currently unused.", ["key", "model"])
+MODEL_KEY_COOLDOWN = Gauge("model_key_cooldown_seconds", "Seconds until a key that hit its quota is used again.",
+                           ["key", "model"])
+
+
+class MetricsMiddleware:
+    """Records per-route latency and in-flight requests; hands slow requests to ``profiler``."""
+
+    def __init__(self, app, profiler=None):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+        HTTP_IN_FLIGHT.inc()
+        if self.profiler:
+            self.profiler.request_started()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec()
+            # The router stores the matched route in the scope; unmatched paths share one label
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route, status=status)
+            if self.profiler:
+                self.profiler.request_finished(f"{scope['method']} {route}", start, elapsed)
+
+
+class InstrumentedBackend:
+    """Wraps a ``ModelBackend`` to record call latency, time to first token and prompt/answer sizes."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def _record(self, mode, outcome, start, prompt, text):
+        name = self.backend.name
+        MODEL_CALL_SECONDS.observe(time.perf_counter() - start, backend=name, mode=mode, outcome=outcome)
+        MODEL_PROMPT_BYTES.observe(len(prompt.encode("utf-8")), backend=name)
+        if text is not None:
+            MODEL_RESPONSE_BYTES.observe(len(text.encode("utf-8")), backend=name)
+
+    def generate(self, prompt: str) -> str:
+        start, text, outcome = time.perf_counter(), None, "error"
+        MODEL_IN_FLIGHT.inc(backend=self.backend.name)
+        try:
+            text = self.backend.generate(prompt)
+            outcome = "ok"
+            return text
+        finally:
+            MODEL_IN_FLIGHT.dec(backend=self.backend.name)
+            self._record("unary", outcome, start, prompt, text)
+
+    async def generate_async(self, prompt: str) -> str:
+        start, text, outcome = time.perf_counter(), None, "error"
+        MODEL_IN_FLIGHT.inc(backend=self.backend.name)
+        try:
+            text = await self.backend.generate_async(prompt)
+            outcome = "ok"
+            return text
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            MODEL_IN_FLIGHT.dec(backend=self.backend.name)
+            self._record("unary", outcome, start, prompt, text)
+
+    async def stream(self, prompt: str):
+        start, size, outcome, first = time.perf_counter(), 0, "error", True
+        parts = []
+        MODEL_IN_FLIGHT.inc(backend=self.backend.name)
+        try:
+            async for chunk in self.backend.stream(prompt):
+                if first:
+                    MODEL_TTFT_SECONDS.observe(time.perf_counter() - start, backend=self.backend.name)
+                    first = False
+                parts.append(chunk)
+                yield chunk
+            outcome = "ok"
+        except (asyncio.CancelledError, GeneratorExit):
+            outcome = "cancelled"
+            raise
+        finally:
+            MODEL_IN_FLIGHT.dec(backend=self.backend.name)
+            self._record("stream", outcome, start, prompt, "".join(parts))
+
+
+async def sample_loop_lag(interval: float = 0.5):
+    """Run forever, observing how late each ``interval`` timer fires; start it as a task in the lifespan."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - start - interval))
+
+
+class SlowRequestProfiler:
+    """Samples every thread's stack while requests are in flight and dumps flame data for slow ones.
+
+    Enabled with ``PROFILE_SLOW_MS``: a background thread reads
+    ``sys._current_frames()`` every ``interval`` seconds into a ring buffer.
+    When a request takes longer than ``threshold`` seconds, the samples taken
+    during it are written to ``directory`` as folded stacks
+    (``thread;outer;...;inner count``), the input of flamegraph.pl and
+    speedscope. Requests share the event loop, so a dump shows everything the
+    process did while the slow request ran, not only that request's frames.
+    Dumps are written from a worker thread, so profiling a slow request does
+    not slow down the others.
+    """
+
+    def __init__(self, threshold: float, directory: str, interval: float = 0.005, max_samples: int = 20000):
+        self.threshold = threshold
+        self.directory = directory
+        self.interval = interval
+        self.samples = collections.deque(maxlen=max_samples)
+        self._active = 0
+        self._wake = threading.Event()
+        self._stop = False
+        self._dumps = set()
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+        self._thread.start()
+
+    def request_started(self):
+        self._active += 1
+        self._wake.set()
+
+    def request_finished(self, label: str, start: float, elapsed: float):
+        self._active -= 1
+        if not self._active:
+            self._wake.clear()
+        if elapsed >= self.threshold:
+            dump = asyncio.get_running_loop().run_in_executor(None, self.dump, label, start, start + elapsed)
+            # Keep a reference until it is written, or the future could be collected
+            self._dumps.add(dump)
+            dump.add_done_callback(self._dumps.discard)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop:
+            self._wake.wait()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            now = time.perf_counter()
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples.append((now, ";".join(reversed(stack))))
+            time.sleep(self.interval)
+
+    def dump(self, label: str, start: float, end: float) -> str:
+        counts = collections.Counter(stack for at, stack in list(self.samples) if start <= at <= end)
+        safe = "".join(c if c.isalnum() else "_" for c in label).strip("_")
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{safe}-{(end - start) * 1000:.0f}ms.folded")
+        with open(path, "w") as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+        SLOW_REQUEST_PROFILES.inc()
+        return path
+
+    def close(self):
+        self._stop = True
+        self._wake.set()
@@ -0,0 +1,375 @@
+"""Model backends behind one small interface.
+
+Both apps talk to a ``ModelBackend`` instead of an SDK object, so the serving
+path can be measured without network access or API quota:
+
+* ``gemini`` – ``google.generativeai`` (what main.py has always used)
+* ``genai``  – the newer ``google.genai`` client (what main_new.py uses)
+* ``stub``   – a local, seeded backend with configurable latency, chunking and
+  error rate; ``fake`` is accepted as an alias
+
+The SDKs are imported on the first call (or by ``prewarm()``), not when the
+backend is created, so they stay out of the app's start-up; each process keeps
+one client per API key that every backend instance shares.
+"""
+import asyncio
+import collections
+import contextlib
+import hashlib
+import math
+import os
+import random
+import re
+import threading
+import time
+
+from compaction import estimate_tokens
+
+BACKEND_ENV = "MODEL_BACKEND"
+DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class ModelBackendError(RuntimeError):
+    """A generation call failed; raised by backends for injected or upstream errors."""
+
+
+class QuotaExceededError(ModelBackendError):
+    """The API key is over its rate limit or quota; ``retry_after`` is the upstream's hint in seconds, if any."""
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+RETRY_DELAY = re.compile(r"retry[_ ]?delay\W+(?:seconds:\s*)?(\d+(?:\.\d+)?)", re.I)
+
+
+def quota_error(error: BaseException):
+    """The ``QuotaExceededError`` an SDK exception stands for (HTTP 429 / RESOURCE_EXHAUSTED), else None."""
+    if isinstance(error, QuotaExceededError):
+        return error
+    code = getattr(error, "code", None)
+    if code not in (429, "RESOURCE_EXHAUSTED") and type(error).__name__ not in ("ResourceExhausted", "TooManyRequests"):
+        return None
+    match = RETRY_DELAY.search(str(error))
+    return QuotaExceededError(str(error), float(match[1]) if match else None)
+
+
+@contextlib.contextmanager
+def _quota_errors():
+    """Re-raise the SDKs' rate-limit errors as ``QuotaExceededError`` so the key router can tell them apart."""
+    try:
+        yield
+    except ModelBackendError:
+        raise
+    except Exception as e:
+        quota = quota_error(e)
+        if quota is None:
+            raise
+        raise quota from e
+
+
+class ModelBackend:
+    """Interface shared by all backends: one prompt in, markdown out."""
+
+    name = "base"
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    def generate(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    async def generate_async(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    async def stream(self, prompt: str):
+        """Async iterator of text chunks; the default yields the whole answer at once."""
+        yield await self.generate_async(prompt)
+
+    def prewarm(self):
+        """Do the one-off set-up (SDK import, client creation) now rather than on the first call."""
+
+    def close(self):
+        pass
+
+
+def _shared_client(kind: str, api_key: str, factory):
+    with _clients_lock:
+        client = _clients.get((kind, api_key))
+        if client is None:
+            client = _clients[(kind, api_key)] = factory()
+        return client
+
+
+class GeminiBackend(ModelBackend):
+    """``google.generativeai``; the SDK keeps one gRPC channel per process, configured once here."""
+
+    name = "gemini"
+
+    def __init__(self, model_name: str = "gemini-2.5-flash", api_key: str = None):
+        super().__init__(model_name)
+        self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
+        self._model = None
+        self._lock = threading.Lock()
+
+    def prewarm(self):
+        with self._lock:
+            if self._model is None:
+                import google.generativeai as genai
+
+                def configure():
+                    genai.configure(api_key=self.api_key)
+                    return genai
+
+                _shared_client("gemini", self.api_key, configure)
+                self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    async def _async_model(self):
+        # The SDK import takes long enough to stall the event loop, so a cold first call does it in a thread
+        return self._model or await asyncio.to_thread(self.prewarm)
+
+    def generate(self, prompt: str) -> str:
+        with _quota_errors():
+            return self.prewarm().generate_content(prompt).text
+
+    async def generate_async(self, prompt: str) -> str:
+        with _quota_errors():
+            response = await (await self._async_model()).generate_content_async(prompt)
+        return response.text
+
+    async def stream(self, prompt: str):
+        with _quota_errors():
+            response = await (await self._async_model()).generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+
+
+class GenAIBackend(ModelBackend):
+    """``google.genai``; one ``Client`` (and so one HTTP connection pool) per API key and process."""
+
+    name = "genai"
+
+    def __init__(self, model_name: str = "gemini-2.0-flash", api_key: str = None):
+        super().__init__(model_name)
+        self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
+        self._client = None
+        self._lock = threading.Lock()
+
+    def prewarm(self):
+        with self._lock:
+            if self._client is None:
+                from google import genai
+
+                self._client = _shared_client("genai", self.api_key, lambda: genai.Client(api_key=self.api_key))
+        return self._client
+
+    async def _async_client(self):
+        return self._client or await asyncio.to_thread(self.prewarm)
+
+    def generate(self, prompt: str) -> str:
+        with _quota_errors():
+            return self.prewarm().models.generate_content(model=self.model_name, contents=prompt).text
+
+    async def generate_async(self, prompt: str) -> str:
+        client = await self._async_client()
+        with _quota_errors():
+            response = await client.aio.models.generate_content(model=self.model_name, contents=prompt)
+        return response.text
+
+    async def stream(self, prompt: str):
+        client = await self._async_client()
+        with _quota_errors():
+            response = await client.aio.models.generate_content_stream(model=self.model_name, contents=prompt)
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+
+
+class LatencyDistribution:
+    """Seconds of delay drawn from ``kind`` with two parameters.
+
+    ``fixed:a``, ``uniform:low,high``, ``normal:mean,stddev``,
+    ``lognormal:median,sigma`` and ``exponential:mean``; a bare number is fixed.
+    Samples are never negative.
+    """
+
+    def __init__(self, kind: str = "fixed", a: float = 0.0, b: float = 0.0):
+        if kind not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {kind!r}; expected one of {', '.join(DISTRIBUTIONS)}")
+        self.kind, self.a, self.b = kind, a, b
+
+    @classmethod
+    def parse(cls, spec) -> "LatencyDistribution":
+        if isinstance(spec, LatencyDistribution):
+            return spec
+        if isinstance(spec, (int, float)):
+            return cls("fixed", float(spec))
+        kind, _, params = str(spec).partition(":")
+        if not params:
+            return cls("fixed", float(kind))
+        values = [float(v) for v in params.split(",")]
+        return cls(kind, values[0], values[1] if len(values) > 1 else 0.0)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            value = self.a
+        elif self.kind == "uniform":
+            value = rng.uniform(self.a, self.b)
+        elif self.kind == "normal":
+            value = rng.gauss(self.a, self.b)
+        elif self.kind == "lognormal":
+            value = rng.lognormvariate(math.log(self.a), self.b) if self.a > 0 else 0.0
+        else:
+            value = rng.expovariate(1 / self.a) if self.a > 0 else 0.0
+        return max(0.0, value)
+
+    def __repr__(self):
+        return f"{self.kind}:{self.a:g},{self.b:g}"
+
+
+class StubBackend(ModelBackend):
+    """Local backend that returns a canned review on a timer.
+
+    ``latency`` is the delay before the first chunk and ``chunk_delay`` the
+    delay between chunks, either as seconds or a ``LatencyDistribution`` spec.
+    ``error_rate`` is the fraction of calls that fail with
+    ``ModelBackendError``. Draws come from an RNG seeded by ``seed`` and the
+    prompt, so a given prompt always gets the same latency and outcome. With
+    ``per_call`` the call count is mixed into the seed as well, so a retry or
+    hedge of the same prompt draws a fresh latency and outcome, as it would
+    against a real upstream.
+
+    ``rpm`` and ``tpm`` simulate an API key's quota: more than ``rpm`` calls, or
+    more than ``tpm`` estimated prompt and answer tokens, within any
+    ``quota_window`` seconds fail at once with ``QuotaExceededError``, the way
+    the real API answers 429. Every instance is its own key; 0 means unlimited.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency=0.5, chunk_delay=0.05, chunk_words: int = 8, error_rate: float = 0.0,
+                 seed: int = 0, model_name: str = "stub", per_call: bool = False, api_key: str = None,
+                 rpm: int = 0, tpm: int = 0, quota_window: float = 60.0):
+        super().__init__(model_name)
+        self.api_key = api_key
+        self.rpm = rpm
+        self.tpm = tpm
+        self.quota_window = quota_window
+        self.quota_errors = 0
+        self._usage = collections.deque()  # (time, tokens) of the calls inside the window
+        self.latency = LatencyDistribution.parse(latency)
+        self.chunk_delay = LatencyDistribution.parse(chunk_delay)
+        self.chunk_words = max(1, chunk_words)
+        self.error_rate = error_rate
+        self.seed = seed
+        self.per_call = per_call
+        self.calls = 0
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls, model_name: str = "stub", api_key: str = None) -> "StubBackend":
+        env = os.environ.get
+        return cls(
+            latency=env("STUB_LATENCY", "0.5"),
+            chunk_delay=env("STUB_CHUNK_DELAY", "0.05"),
+            chunk_words=int(env("STUB_CHUNK_WORDS", 8)),
+            error_rate=float(env("STUB_ERROR_RATE", 0)),
+            seed=int(env("STUB_SEED", 0)),
+            model_name=model_name,
+            per_call=env("STUB_PER_CALL", "0").lower() in ("1", "true", "yes"),
+            api_key=api_key,
+            rpm=int(env("STUB_RPM", 0)),
+            tpm=int(env("STUB_TPM", 0)),
+            quota_window=float(env("STUB_QUOTA_WINDOW", 60)),
+        )
+
+    def review_for(self, prompt: str) -> str:
+        code = prompt.rsplit("CODE:\n", 1)[-1]
+        lines = len(code.splitlines())
+        return (
+            "## Summary\n"
+            f"The submission has **{lines}** lines. This is an offline review produced by the stub backend.\n\n"
+            "## Logic\n"
+            "- Control flow is straightforward.\n"
+            "- Edge cases such as empty input should be checked explicitly.\n\n"
+            "## Efficiency\n"
+            "Avoid recomputing values inside loops; hoist invariants where possible.\n\n"
+            "## Time Complexity\n"
+            "`O(n)` in the common case.\n\n"
+            "```\n" + code[:200] + "\n```\n"
+        )
+
+    def _chunks(self, text: str) -> list:
+        words, n = text.split(" "), self.chunk_words
+        return [" ".join(words[i:i + n]) + (" " if i + n < len(words) else "") for i in range(0, len(words), n)]
+
+    def _spend_quota(self, tokens: int):
+        if not (self.rpm or self.tpm):
+            return
+        now = time.monotonic()
+        while self._usage and self._usage[0][0] <= now - self.quota_window:
+            self._usage.popleft()
+        used = sum(t for _, t in self._usage)
+        if (self.rpm and len(self._usage) >= self.rpm) or (self.tpm and used + tokens > self.tpm):
+            self.quota_errors += 1
+            retry_after = self._usage[0][0] + self.quota_window - now if self._usage else self.quota_window
+            raise QuotaExceededError(f"stub backend: quota exceeded for key {self.api_key or 'default'}",
+                                     retry_after=max(0.0, retry_after))
+        self._usage.append((now, tokens))
+
+    def _plan(self, prompt: str):
+        """Chunks, delay before each chunk, and whether this call fails."""
+        chunks = self._chunks(self.review_for(prompt))
+        self._spend_quota(estimate_tokens(prompt) + estimate_tokens("".join(chunks)))
+        self.calls += 1
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        seed = self.seed ^ int.from_bytes(digest[:8], "big")
+        rng = random.Random(seed ^ (self.calls << 64) if self.per_call else seed)
+        delays = [self.latency.sample(rng)] + [self.chunk_delay.sample(rng) for _ in chunks[1:]]
+        fail = rng.random() < self.error_rate
+        if fail:
+            self.errors += 1
+        return chunks, delays, fail
+
+    def generate(self, prompt: str) -> str:
+        chunks, delays, fail = self._plan(prompt)
+        time.sleep(sum(delays) if not fail else delays[0])
+        if fail:
+            raise ModelBackendError("stub backend: injected error")
+        return "".join(chunks)
+
+    async def generate_async(self, prompt: str) -> str:
+        chunks, delays, fail = self._plan(prompt)
+        await asyncio.sleep(sum(delays) if not fail else delays[0])
+        if fail:
+            raise ModelBackendError("stub backend: injected error")
+        return "".join(chunks)
+
+    async def stream(self, prompt: str):
+        chunks, delays, fail = self._plan(prompt)
+        for i, (chunk, delay) in enumerate(zip(chunks, delays)):
+            await asyncio.sleep(delay)
+            # Injected failures happen mid-stream, after part of the answer was sent
+            if fail and i == len(chunks) // 2:
+                raise ModelBackendError("stub backend: injected error")
+            yield chunk
+
+
+def backend_from_env(default_backend: str = "gemini", default_model: str = "gemini-2.5-flash",
+                     model_name: str = None, api_key: str = None) -> ModelBackend:
+    """Build the backend named by ``MODEL_BACKEND`` (model from ``model_name``, else ``MODEL_NAME``)."""
+    kind = os.environ.get(BACKEND_ENV) or default_backend
+    model_name = model_name or os.environ.get("MODEL_NAME")
+    if kind in ("stub", "fake"):
+        return StubBackend.from_env(model_name or "stub", api_key)
+    if kind == "gemini":
+        return GeminiBackend(model_name or default_model, api_key)
+    if kind == "genai":
+        return GenAIBackend(model_name or default_model, api_key)
+    raise ValueError(f"Unknown {BACKEND_ENV} {kind!r}; expected gemini, genai or stub")
@@ -0,0 +1,303 @@
+"""Near-duplicate detection for submissions that exact-hash caching misses.
+
+Classroom submissions are often the same assignment with renamed variables,
+different formatting or a small edit. Each submission is reduced to a token
+stream in which comments and whitespace are gone and identifiers are numbered
+in order of first use (keywords, builtins, operators and literals stay), so a
+consistent renaming leaves the stream unchanged while a different constant or
+a different variable in the same place does not; the stream is cut into
+overlapping shingles of ``SHINGLE`` tokens.
+
+A MinHash signature of the shingle set, built with one-permutation hashing so
+it costs one hash per shingle, estimates the Jaccard similarity of two
+submissions. ``NearDuplicateIndex`` finds stored signatures above a threshold
+with LSH banding (``BANDS`` bands of ``ROWS`` slots: two submissions become
+candidates when any band matches exactly) and verifies candidates slot by
+slot.
+
+The index is kept compact so that a million submissions fit in about 160 MB
+(merges briefly need about as much again): per entry one byte per signature
+slot, the 32-byte analysis cache key it points to, and one 8-byte word per
+band in sorted ``array`` columns that are searched with bisect. New entries collect in small per-band dicts and are
+merged into the columns in batches, off the lock, so lookups never wait for
+a merge. Each scope (language, persona, model) has its own shard, and the
+oldest quarter of a shard is dropped once it outgrows ``max_entries``.
+
+``adapt`` rewrites a stored analysis for the new submission: identifiers
+renamed consistently are renamed in its code spans, and line references are
+moved to where the matching tokens now are.
+"""
+import bisect
+import builtins
+import difflib
+import hashlib
+import io
+import keyword
+import re
+import threading
+import tokenize
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+
+from compaction import LINE_REF
+from static_analysis import C_KEYWORDS, tokenize_c_like
+
+SHINGLE = 5
+SLOTS = 64
+BANDS = 8
+ROWS = SLOTS // BANDS
+# Fewer shingles than this and the similarity estimate means little
+MIN_SHINGLES = 16
+# Bounds the verification work for a lookup when many stored submissions share a band
+MAX_CANDIDATES = 256
+# Alignment for adapt() is quadratic in the worst case; larger submissions are reused without adapting
+MAX_ADAPT_TOKENS = 20000
+
+ID_MASK = 0xFFFFFFFF
+EMPTY_BIN = (1 << 64) - 1
+
+PY_KEEP = set(keyword.kwlist) | set(keyword.softkwlist) | set(dir(builtins)) | {"self", "cls"}
+C_KEEP = C_KEYWORDS | {
+    "int", "long", "short", "char", "bool", "boolean", "float", "double", "void", "unsigned", "signed", "auto",
+    "const", "static", "final", "public", "private", "protected", "class", "struct", "enum", "interface",
+    "extends", "implements", "template", "typename", "namespace", "using", "std", "string", "String", "vector",
+    "map", "set", "List", "ArrayList", "Map", "HashMap", "Set", "HashSet", "true", "false", "null", "nullptr",
+    "this", "break", "continue", "default", "import", "package", "include", "cout", "cin", "endl", "System",
+}
+CODE_SPAN = re.compile(r"```.*?(?:```|\Z)|`[^`\n]+`", re.S)
+# Placeholder of an identifier: its number in order of first use
+NAME_SLOT = re.compile(r"v\d+")
+
+
+@dataclass(frozen=True)
+class Signature:
+    slots: bytes  # low byte of each MinHash slot, enough to verify candidates
+    bands: tuple  # 32-bit key per band, from the full slot values
+    shingles: int
+
+
+def normalized_tokens(code: str, language: str) -> list:
+    """``(placeholder, text, line)`` per token; the placeholder is what shingles are built from."""
+    names = {}
+
+    def name(text):
+        return names.setdefault(text, f"v{len(names)}")
+
+    if language == "Python":
+        tokens = []
+        try:
+            for tok in tokenize.generate_tokens(io.StringIO(code).readline):
+                if tok.type == tokenize.NAME:
+                    tokens.append((tok.string if tok.string in PY_KEEP else name(tok.string), tok.string,
+                                   tok.start[0]))
+                elif tok.type in (tokenize.NUMBER, tokenize.STRING, tokenize.OP):
+                    tokens.append((tok.string, tok.string, tok.start[0]))
+                elif tok.type == tokenize.INDENT:
+                    tokens.append(("{", "", tok.start[0]))
+                elif tok.type == tokenize.DEDENT:
+                    tokens.append(("}", "", tok.start[0]))
+            return tokens
+        except (tokenize.TokenError, SyntaxError):
+            names.clear()
+    out = []
+    for kind, value, line in tokenize_c_like(code):
+        if kind == "ident":
+            out.append((value if value in C_KEEP else name(value), value, line))
+        else:
+            out.append((value, value, line))
+    return out
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def signature(code: str, language: str):
+    """MinHash signature of the submission's shingles, or None when it is too short to compare."""
+    placeholders = [t[0] for t in normalized_tokens(code, language)]
+    shingles = {"\x1f".join(placeholders[i:i + SHINGLE]) for i in range(len(placeholders) - SHINGLE + 1)}
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    # One-permutation hashing: the low bits pick a slot, each slot keeps its minimum
+    mins = [EMPTY_BIN] * SLOTS
+    for shingle in shingles:
+        h = _hash64(shingle.encode("utf-8"))
+        slot, value = h % SLOTS, h // SLOTS
+        if value < mins[slot]:
+            mins[slot] = value
+    # Empty slots borrow from the next filled one (rotation densification), so both sides fill them alike
+    filled = list(mins)
+    for i in range(SLOTS):
+        if filled[i] == EMPTY_BIN:
+            step = next(step for step in range(1, SLOTS) if filled[(i + step) % SLOTS] != EMPTY_BIN)
+            mins[i] = (filled[(i + step) % SLOTS] + step * 0x9E3779B97F4A7C15) % EMPTY_BIN
+    bands = tuple(_hash64(b"".join(v.to_bytes(8, "little") for v in mins[b * ROWS:(b + 1) * ROWS])) & ID_MASK
+                  for b in range(BANDS))
+    return Signature(bytes(v & 0xFF for v in mins), bands, len(shingles))
+
+
+def similarity(a: bytes, b: bytes) -> float:
+    """Jaccard estimate from two slot-byte strings, corrected for bytes that agree by chance."""
+    agree = sum(x == y for x, y in zip(a, b)) / SLOTS
+    return max(0.0, (agree - 1 / 256) / (1 - 1 / 256))
+
+
+class _Shard:
+    def __init__(self):
+        self.slots = bytearray()
+        self.refs = bytearray()
+        self.columns = [array("Q") for _ in range(BANDS)]
+        self.pending = [{} for _ in range(BANDS)]
+        self.merging = None
+        self.pending_entries = 0
+
+    def __len__(self):
+        return len(self.refs) // 32
+
+
+class NearDuplicateIndex:
+    """LSH index from submission signatures to analysis cache keys, one shard per scope."""
+
+    def __init__(self, threshold: float = 0.9, max_entries: int = 1_000_000, merge_every: int = 1024):
+        self.threshold = threshold
+        self.max_entries = max(0, max_entries)
+        self.merge_every = merge_every
+        self.hits = 0
+        self.misses = 0
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards.values())
+
+    def lookup(self, scope: str, sig: Signature):
+        """``(cache_key, similarity)`` of the most similar stored submission above the threshold, or None."""
+        best = None
+        with self._lock:
+            shard = self._shards.get(scope)
+            if shard is not None:
+                candidates = set()
+                for b, key in enumerate(sig.bands):
+                    column = shard.columns[b]
+                    i = bisect.bisect_left(column, key << 32)
+                    while i < len(column) and column[i] >> 32 == key and len(candidates) < MAX_CANDIDATES:
+                        candidates.add(column[i] & ID_MASK)
+                        i += 1
+                    for pending in (shard.merging, shard.pending):
+                        if pending is not None:
+                            candidates.update(pending[b].get(key, ()))
+                for entry in candidates:
+                    if entry >= len(shard):
+                        continue
+                    score = similarity(sig.slots, shard.slots[entry * SLOTS:(entry + 1) * SLOTS])
+                    # Ties go to the newest entry, whose analysis is least likely to have been evicted
+                    if score >= self.threshold and (best is None or (score, entry) > best[:2]):
+                        best = (score, entry, shard.refs[entry * 32:(entry + 1) * 32].hex())
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return best[2], best[0]
+
+    def add(self, scope: str, sig: Signature, cache_key: str):
+        """Store a submission's signature; may merge pending entries, so call it off the event loop."""
+        if not self.max_entries:
+            return
+        with self._lock:
+            shard = self._shards.get(scope)
+            if shard is None:
+                shard = self._shards[scope] = _Shard()
+            entry = len(shard)
+            shard.slots += sig.slots
+            shard.refs += bytes.fromhex(cache_key)
+            for b, key in enumerate(sig.bands):
+                shard.pending[b].setdefault(key, []).append(entry)
+            shard.pending_entries += 1
+            # Batches grow with the shard, so the total merge work stays close to linear in its size
+            if shard.pending_entries < max(self.merge_every, len(shard) // 16) or shard.merging is not None:
+                return
+            shard.merging, shard.pending, shard.pending_entries = shard.pending, [{} for _ in range(BANDS)], 0
+            columns, merging = shard.columns, shard.merging
+        # Timsort merges the sorted column with the sorted batch in about linear time; lookups meanwhile
+        # read the old column plus the batch being merged
+        merged = []
+        for column, pending in zip(columns, merging):
+            batch = sorted(key << 32 | entry for key, entries in pending.items() for entry in entries)
+            merged.append(array("Q", sorted(column.tolist() + batch)))
+        with self._lock:
+            shard.columns, shard.merging = merged, None
+            if len(shard) > self.max_entries:
+                self._drop_oldest(shard, len(shard) - self.max_entries * 3 // 4)
+
+    def _drop_oldest(self, shard: _Shard, count: int):
+        """Forget the ``count`` oldest entries and renumber the rest; called with the lock held."""
+        del shard.slots[:count * SLOTS]
+        del shard.refs[:count * 32]
+        shard.columns = [array("Q", sorted((v >> 32) << 32 | ((v & ID_MASK) - count) for v in column
+                                           if (v & ID_MASK) >= count)) for column in shard.columns]
+        shard.pending = [{key: [e - count for e in entries if e >= count] for key, entries in pending.items()}
+                         for pending in shard.pending]
+
+    def memory_bytes(self) -> int:
+        """Bytes held by signatures, keys and band columns (pending batches not included)."""
+        return sum(len(s.slots) + len(s.refs) + sum(c.itemsize * len(c) for c in s.columns)
+                   for s in self._shards.values())
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self),
+            "scopes": len(self._shards),
+            "threshold": self.threshold,
+            "memory_bytes": self.memory_bytes(),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def _line_mapping(old: list, new: list) -> tuple:
+    """Renamed identifiers and ``{old line: new line}`` from aligning two normalized token streams."""
+    matcher = difflib.SequenceMatcher(None, [t[0] for t in old], [t[0] for t in new], autojunk=False)
+    names, lines = {}, {}
+    for a, b, size in matcher.get_matching_blocks():
+        for (kind, old_text, old_line), (_, new_text, new_line) in zip(old[a:a + size], new[b:b + size]):
+            lines.setdefault(old_line, new_line)
+            if NAME_SLOT.fullmatch(kind):
+                names.setdefault(old_text, Counter())[new_text] += 1
+    renames = {}
+    for name, targets in names.items():
+        target, count = targets.most_common(1)[0]
+        # Only rename when the new code uses one name where the old one used this one
+        if target != name and count == sum(targets.values()):
+            renames[name] = target
+    if len(set(renames.values())) != len(renames):
+        renames = {}
+    return renames, lines
+
+
+def adapt(analysis: str, old_code: str, new_code: str, language: str) -> str:
+    """Rename identifiers in code spans and move line references from ``old_code`` to ``new_code``."""
+    old, new = normalized_tokens(old_code, language), normalized_tokens(new_code, language)
+    if max(len(old), len(new)) > MAX_ADAPT_TOKENS:
+        return analysis
+    renames, lines = _line_mapping(old, new)
+    known = sorted(lines)
+
+    def new_line(line: int) -> int:
+        if line in lines:
+            return lines[line]
+        # A line with no matched token (changed, or blank) maps via the nearest matched line above it
+        i = bisect.bisect_right(known, line) - 1
+        return lines[known[i]] + line - known[i] if i >= 0 else line
+
+    def move(match):
+        out = match["word"] + str(new_line(int(match["a"])))
+        if match["b"]:
+            out += match["sep"] + str(new_line(int(match["b"])))
+        return out
+
+    analysis = LINE_REF.sub(move, analysis)
+    if renames:
+        pattern = re.compile(r"\b(" + "|".join(map(re.escape, sorted(renames, key=len, reverse=True))) + r")\b")
+        analysis = CODE_SPAN.sub(lambda span: pattern.sub(lambda m: renames[m[1]], span[0]), analysis)
+    return analysis
@@ -0,0 +1,484 @@
+"""PDF export of review reports, rendered off the event loop.
+
+The markdown report is tokenized once, line by line, into blocks (headings,
+paragraphs, list items, code, tables, quotes, rules) and laid out straight onto
+a ``StreamingPDF``, which writes each page to disk as soon as it is full. With
+DejaVu fonts available the text is embedded as Unicode; otherwise the standard
+Helvetica/Courier fonts are used and characters outside cp1252 print as '?'.
+
+``render_report_pdf_file`` is a plain top-level function so it can run in a
+``ProcessPoolExecutor``; ``PDFRenderer`` wraps the pool with a bounded wait
+queue, a per-render timeout and an on-disk cache of finished documents keyed by
+the same content hash that is used as the HTTP ``ETag``.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+
+from limits import ConcurrencyLimiter
+from metrics import PDF_CACHE_HITS, PDF_RENDER_SECONDS
+from pdf_writer import CoreFont, StreamingPDF, TrueTypeFont
+from singleflight import SingleFlight
+
+FONT_FILES = {"R": "DejaVuSans.ttf", "B": "DejaVuSans-Bold.ttf", "M": "DejaVuSansMono.ttf"}
+FONT_DIRS = [
+    "/usr/share/fonts/truetype/dejavu",
+    "/usr/share/fonts/dejavu",
+    "/usr/share/fonts/TTF",
+    "/usr/local/share/fonts",
+    "/Library/Fonts",
+    "C:/Windows/Fonts",
+]
+
+MARGIN = 50
+BODY_SIZE, BODY_LEADING = 10.5, 15
+CODE_SIZE, CODE_LEADING = 8.5, 11.5
+HEADING_SIZES = {1: 17, 2: 14.5, 3: 12.5}
+TEXT_COLOR, MUTED_COLOR, CODE_COLOR = "0.1 0.1 0.12", "0.4 0.4 0.45", "0.12 0.3 0.6"
+
+HEADING = re.compile(r"(#{1,6})\s+(.*?)\s*#*$")
+RULE = re.compile(r"(\*\s*){3,}$|(-\s*){3,}$|(_\s*){3,}$")
+LIST_ITEM = re.compile(r"(\s*)([-*+]|\d+[.)])\s+(.*)")
+TABLE_SEPARATOR = re.compile(r"\|?\s*:?-{2,}:?\s*(\|\s*:?-{2,}:?\s*)*\|?$")
+INLINE = re.compile(
+    r"\*\*(?P<b1>.+?)\*\*|(?<!\w)__(?P<b2>.+?)__(?!\w)|`(?P<code>[^`]+)`|\[(?P<link>[^\]]+)\]\([^)]*\)"
+    r"|(?<![\w*])\*(?P<i1>[^*\s][^*]*?)\*(?!\w)|(?<!\w)_(?P<i2>[^_\s][^_]*?)_(?!\w)"
+)
+WORD = re.compile(r"\S+\s*|\s+")
+
+_fonts = None
+
+
+def report_etag(feedback: str, language: str) -> str:
+    digest = hashlib.sha256(f"{language}\0{feedback}".encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def load_fonts() -> dict:
+    """DejaVu from PDF_FONT_DIR or the usual system locations, else the PDF core fonts. Cached per process."""
+    global _fonts
+    if _fonts is None:
+        dirs = [os.environ["PDF_FONT_DIR"]] if os.environ.get("PDF_FONT_DIR") else []
+        for directory in dirs + FONT_DIRS:
+            paths = {key: os.path.join(directory, name) for key, name in FONT_FILES.items()}
+            if all(os.path.isfile(path) for path in paths.values()):
+                _fonts = {key: TrueTypeFont(path) for key, path in paths.items()}
+                break
+        else:
+            from fpdf.fonts import CORE_FONTS_CHARWIDTHS
+
+            _fonts = {
+                "R": CoreFont("Helvetica", CORE_FONTS_CHARWIDTHS["helvetica"]),
+                "B": CoreFont("Helvetica-Bold", CORE_FONTS_CHARWIDTHS["helveticaB"]),
+                "M": CoreFont("Courier", CORE_FONTS_CHARWIDTHS["courier"]),
+            }
+    return _fonts
+
+
+def prepare_worker():
+    """Pool initializer: parse the fonts and build the common subsets before the first render."""
+    for font in load_fonts().values():
+        if isinstance(font, TrueTypeFont):
+            font.subset(())
+
+
+def _iter_lines(text: str):
+    # io.StringIO would copy the whole report into its own buffer first
+    start = 0
+    while start < len(text):
+        end = text.find("\n", start)
+        if end < 0:
+            end = len(text)
+        yield text[start:end]
+        start = end + 1
+
+
+def iter_blocks(text: str):
+    """Tokenize markdown in one pass, yielding ``(kind, ...)`` blocks without copying the document."""
+    fence = None
+    paragraph = []
+    for raw in _iter_lines(text):
+        line = raw.rstrip("\r")
+        stripped = line.strip()
+        if fence:
+            if stripped.startswith(fence):
+                fence = None
+                yield ("code_end",)
+            else:
+                yield ("code", line.expandtabs(4))
+            continue
+        if not stripped or stripped.startswith(("```", "~~~")) or HEADING.match(stripped) or RULE.match(stripped) \
+                or LIST_ITEM.match(line) or stripped.startswith(("|", ">")):
+            if paragraph:
+                yield ("paragraph", " ".join(paragraph))
+                paragraph = []
+        else:
+            paragraph.append(stripped)
+            continue
+
+        if not stripped:
+            yield ("blank",)
+        elif stripped.startswith(("```", "~~~")):
+            fence = stripped[:3]
+            yield ("code_start",)
+        elif match := HEADING.match(stripped):
+            yield ("heading", len(match[1]), match[2])
+        elif RULE.match(stripped):
+            yield ("rule",)
+        elif match := LIST_ITEM.match(line):
+            indent = len(match[1].expandtabs(4))
+            marker = "•" if match[2] in "-*+" else match[2]
+            yield ("item", min(indent // 2, 4), marker, match[3])
+        elif stripped.startswith("|"):
+            if not TABLE_SEPARATOR.match(stripped):
+                cells = [cell.strip() for cell in stripped.strip("|").split("|")]
+                yield ("table", "  |  ".join(cells))
+        else:
+            yield ("quote", stripped.lstrip("> "))
+    if paragraph:
+        yield ("paragraph", " ".join(paragraph))
+    if fence:
+        yield ("code_end",)
+
+
+def inline_runs(text: str, font: str = "R", color: str = TEXT_COLOR) -> list:
+    """Split inline markdown into ``(font, color, text)`` runs: **bold**, `code`, links and emphasis markers."""
+    runs, position = [], 0
+    for match in INLINE.finditer(text):
+        if match.start() > position:
+            runs.append((font, color, text[position:match.start()]))
+        if match["code"] is not None:
+            runs.append(("M", CODE_COLOR, match["code"]))
+        elif match["b1"] is not None or match["b2"] is not None:
+            runs.append(("B", color, match["b1"] or match["b2"]))
+        else:
+            runs.append((font, color, match["link"] or match["i1"] or match["i2"]))
+        position = match.end()
+    if position < len(text):
+        runs.append((font, color, text[position:]))
+    return runs
+
+
+class ReportLayout:
+    """Lays blocks out top to bottom and hands each full page to the PDF writer."""
+
+    def __init__(self, pdf: StreamingPDF):
+        self.pdf = pdf
+        self.fonts = pdf.fonts
+        self.width, self.height = pdf.page_size
+        self.left, self.right = MARGIN, self.width - MARGIN
+        self.top, self.bottom = self.height - MARGIN, MARGIN + 15
+        self.page_number = 0
+        self.ops = []
+        self.y = self.top
+        self._start_page()
+
+    def _start_page(self):
+        self.page_number += 1
+        self.ops = []
+        self.y = self.top
+
+    def _finish_page(self):
+        label = f"Page {self.page_number}"
+        x = (self.width - self.fonts["R"].width(label, 8)) / 2
+        self.ops.append(b"BT %s rg /R 8 Tf %.2f %.2f Td %s Tj ET"
+                        % (MUTED_COLOR.encode(), x, MARGIN - 10, self.fonts["R"].encode(label)))
+        self.pdf.add_page(b"\n".join(self.ops))
+
+    def _ensure(self, height: float):
+        if self.y - height < self.bottom:
+            self._finish_page()
+            self._start_page()
+
+    def space(self, height: float):
+        if self.y < self.top:
+            self.y -= height
+
+    def close(self):
+        self._finish_page()
+
+    def _line(self, runs, x: float, size: float, leading: float, background: str = None):
+        self._ensure(leading)
+        if background:
+            self.ops.append(b"%s rg %.2f %.2f %.2f %.2f re f"
+                            % (background.encode(), self.left, self.y - leading, self.right - self.left, leading))
+        baseline = self.y - leading + (leading - size) / 2 + size * 0.22
+        parts = [b"BT %.2f %.2f Td" % (x, baseline)]
+        for font, color, text in runs:
+            run_size = size * 0.92 if font == "M" and size == BODY_SIZE else size
+            parts.append(b"%s rg /%s %.2f Tf %s Tj" % (color.encode(), font.encode(), run_size,
+                                                     self.fonts[font].encode(text)))
+        parts.append(b"ET")
+        self.ops.append(b" ".join(parts))
+        self.y -= leading
+
+    def _wrap(self, runs, size: float, width: float):
+        """Greedy word wrap over styled runs; words wider than a line are broken by character."""
+        lines, line, used = [], [], 0.0
+        for font, color, text in runs:
+            measure = self.fonts[font].width
+            run_size = size * 0.92 if font == "M" and size == BODY_SIZE else size
+            for word in WORD.findall(text):
+                w = measure(word, run_size)
+                if used + measure(word.rstrip(), run_size) > width and line:
+                    lines.append(line)
+                    line, used = [], 0.0
+                    word = word.lstrip()
+                    w = measure(word, run_size)
+                while w > width and len(word) > 1:
+                    cut = max(1, int(len(word) * width / w))
+                    while cut > 1 and measure(word[:cut], run_size) > width:
+                        cut -= 1
+                    lines.append([(font, color, word[:cut])])
+                    word = word[cut:]
+                    w = measure(word, run_size)
+                if line and line[-1][0] == font and line[-1][1] == color:
+                    line[-1] = (font, color, line[-1][2] + word)
+                else:
+                    line.append((font, color, word))
+                used += w
+        if line:
+            lines.append(line)
+        return lines
+
+    def rich_text(self, runs, indent: float = 0, size: float = BODY_SIZE, leading: float = BODY_LEADING,
+                  first_prefix=None):
+        x = self.left + indent
+        lines = self._wrap(runs, size, self.right - x)
+        for i, line in enumerate(lines or [[]]):
+            if i == 0 and first_prefix:
+                self._ensure(leading)
+                marker_font, marker = first_prefix
+                self.ops.append(b"BT %s rg /%s %.2f Tf %.2f %.2f Td %s Tj ET"
+                                % (TEXT_COLOR.encode(), marker_font.encode(), size, x - 14,
+                                   self.y - leading + (leading - size) / 2 + size * 0.22,
+                                   self.fonts[marker_font].encode(marker)))
+            self._line(line, x, size, leading)
+
+    def title(self, text: str):
+        size = 16
+        x = (self.width - self.fonts["B"].width(text, size)) / 2
+        self._line([("B", TEXT_COLOR, text)], max(self.left, x), size, 24)
+        self.space(8)
+
+    def heading(self, level: int, text: str):
+        size = HEADING_SIZES.get(level, BODY_SIZE + 1)
+        self.space(8 if level <= 2 else 5)
+        self._ensure(size * 1.5 + BODY_LEADING)  # keep a heading with the first line after it
+        self.rich_text(inline_runs(text, font="B"), size=size, leading=size * 1.45)
+        if level <= 2:
+            self.ops.append(b"0.85 G 0.6 w %.2f %.2f m %.2f %.2f l S" % (self.left, self.y, self.right, self.y))
+        self.space(3)
+
+    def code(self, line: str):
+        measure = self.fonts["M"].width
+        per_line = max(1, int((self.right - self.left - 12) / max(measure("M", CODE_SIZE), 0.1)))
+        for start in range(0, max(len(line), 1), per_line):
+            self._line([("M", TEXT_COLOR, line[start:start + per_line])], self.left + 6, CODE_SIZE, CODE_LEADING,
+                       background="0.95 0.95 0.97")
+
+    def rule(self):
+        self.space(4)
+        self._ensure(8)
+        self.ops.append(b"0.8 G 0.6 w %.2f %.2f m %.2f %.2f l S" % (self.left, self.y - 4, self.right, self.y - 4))
+        self.y -= 8
+
+
+def render_report_pdf(feedback: str, language: str, sink):
+    """Write the report for ``feedback`` to the binary file object ``sink``, page by page."""
+    title = f"Code Review Report - {language}"
+    pdf = StreamingPDF(sink, load_fonts(), title=title)
+    layout = ReportLayout(pdf)
+    layout.title(title)
+    in_code = False
+    for block in iter_blocks(feedback):
+        kind = block[0]
+        if kind == "paragraph":
+            layout.rich_text(inline_runs(block[1]))
+            layout.space(4)
+        elif kind == "heading":
+            layout.heading(block[1], block[2])
+        elif kind == "item":
+            _, depth, marker, text = block
+            layout.rich_text(inline_runs(text), indent=16 + depth * 14, first_prefix=("R", marker))
+        elif kind == "code":
+            layout.code(block[1])
+        elif kind in ("code_start", "code_end"):
+            layout.space(4)
+            in_code = kind == "code_start"
+        elif kind == "table":
+            layout.rich_text([("M", TEXT_COLOR, block[1])], size=CODE_SIZE, leading=CODE_LEADING)
+        elif kind == "quote":
+            layout.rich_text(inline_runs(block[1], color=MUTED_COLOR), indent=12)
+        elif kind == "rule":
+            layout.rule()
+        elif kind == "blank" and not in_code:
+            layout.space(2)
+    layout.close()
+    pdf.close()
+
+
+def render_report_pdf_file(feedback: str, language: str, path: str):
+    """Render to ``path`` atomically; this is what runs inside the process pool."""
+    partial = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(partial, "wb", buffering=256 * 1024) as sink:
+            render_report_pdf(feedback, language, sink)
+        os.replace(partial, path)
+    except BaseException:
+        # The cache directory is shared; a killed process leaves its partial file to PDFRenderer._prune instead
+        try:
+            os.remove(partial)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class PDFRenderer:
+    """Renders reports in a process pool of ``workers`` processes (in a thread when 0).
+
+    Finished PDFs live in ``cache_dir`` named by their ETag, so they are shared
+    by every uvicorn worker on the host; the directory is pruned to
+    ``cache_entries`` files and ``cache_ttl`` seconds.
+    """
+
+    def __init__(self, workers: int = 2, timeout: float = 30, queue_limit: int = 16,
+                 cache_entries: int = 64, cache_ttl: float = 3600, cache_dir: str = None):
+        self.workers = workers
+        self.timeout = timeout
+        self.cache_entries = cache_entries
+        self.cache_ttl = cache_ttl
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), "ai-code-lab-pdf")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.limiter = ConcurrencyLimiter(max(1, workers), queue_limit)
+        self.inflight = SingleFlight()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # Renders each pool is still running for someone, and the pools retired after a render in them timed out
+        self._waiting = {}
+        self._retired = set()
+
+    def _executor(self):
+        # prewarm() may create the pool from a thread while a render asks for it on the event loop
+        with self._pool_lock:
+            if self.workers and self._pool is None:
+                # Parse the fonts once per worker process, before the first render needs them
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=prepare_worker)
+            return self._pool
+
+    def prewarm(self):
+        """Start the render processes, which load the fonts, ahead of the first export. Blocks until they are up."""
+        if not self.workers:
+            prepare_worker()
+            return
+        pool = self._executor()
+        for future in [pool.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def path_for(self, etag: str) -> str:
+        return os.path.join(self.cache_dir, etag.strip('"') + ".pdf")
+
+    async def render(self, feedback: str, language: str, etag: str = None) -> str:
+        """Return the path of the rendered PDF, rendering it unless a fresh copy is cached."""
+        etag = etag or report_etag(feedback, language)
+        path = self.path_for(etag)
+        try:
+            if os.stat(path).st_mtime + self.cache_ttl > time.time():
+                os.utime(path)
+                self.hits += 1
+                PDF_CACHE_HITS.inc()
+                return path
+        except FileNotFoundError:
+            pass
+        self.misses += 1
+        return await self.inflight.do(etag, lambda: self._render(path, feedback, language))
+
+    async def _render(self, path, feedback, language):
+        async with self.limiter:
+            start, outcome = time.perf_counter(), "error"
+            try:
+                if not self.workers:
+                    await asyncio.to_thread(render_report_pdf_file, feedback, language, path)
+                else:
+                    try:
+                        await self._render_in_pool(path, feedback, language)
+                    except asyncio.TimeoutError:
+                        outcome = "timeout"
+                        raise
+                outcome = "ok"
+            finally:
+                PDF_RENDER_SECONDS.observe(time.perf_counter() - start, outcome=outcome)
+        await asyncio.to_thread(self._prune)
+        return path
+
+    async def _render_in_pool(self, path, feedback, language):
+        pool = self._executor()
+        waiting = self._waiting.setdefault(pool, set())
+        job = pool.submit(render_report_pdf_file, feedback, language, path)
+        waiting.add(job)
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(job), self.timeout)
+        except asyncio.TimeoutError:
+            # A stuck render holds its worker until the process is killed, and killing any worker breaks the whole
+            # pool, failing the other renders in it. Later renders get a new pool; this one is killed once no
+            # other render waits on it
+            self._retire(pool)
+            raise
+        except BrokenExecutor:
+            # A worker died (killed for memory, say); the next render starts a new pool
+            self._retire(pool)
+            raise
+        finally:
+            waiting.discard(job)
+            if pool in self._retired and not waiting:
+                self._kill(pool)
+
+    def _retire(self, pool):
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        self._retired.add(pool)
+
+    def _kill(self, pool):
+        self._retired.discard(pool)
+        self._waiting.pop(pool, None)
+        for process in list(pool._processes.values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _prune(self):
+        entries = []
+        now = time.time()
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                try:
+                    if entry.name.endswith(".pdf"):
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    elif entry.name.endswith(".tmp") and entry.stat().st_mtime + self.timeout < now:
+                        # Left by a render whose process was killed; a live render writes more often than that
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+        entries.sort(reverse=True)
+        for i, (mtime, path) in enumerate(entries):
+            if i >= self.cache_entries or mtime + self.cache_ttl < now:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def shutdown(self, wait: bool = False):
+        for pool in list(self._retired):
+            self._kill(pool)
+        if self._pool is None:
+            return
+        pool, self._pool = self._pool, None
+        self._waiting.pop(pool, None)
+        pool.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,247 @@
+"""Minimal streaming PDF writer.
+
+Pages are written to the output file as soon as they are finished, so memory
+holds one page of content at a time no matter how long the document is. Fonts
+are written last: TrueType fonts are subset down to the glyphs actually used
+(glyph ids are kept stable, so the already written pages stay valid) and
+embedded as Identity-H CID fonts, which makes any Unicode text printable.
+Without a TrueType file the standard Type1 fonts with WinAnsi encoding are used.
+"""
+import hashlib
+import io
+import zlib
+from collections import OrderedDict
+
+A4 = (595.28, 841.89)
+# Dashes, quotes, bullet, ellipsis, arrows, comparison signs and check marks
+COMMON_CODEPOINTS = frozenset([0x2013, 0x2014, 0x2018, 0x2019, 0x201C, 0x201D, 0x2022, 0x2026,
+                               *range(0x2190, 0x2195), 0x2260, 0x2264, 0x2265, 0x2713, 0x2714, 0x2717, 0x2718])
+
+
+def _pdf_string(data: bytes) -> bytes:
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+class CoreFont:
+    """One of the 14 standard PDF fonts; text outside cp1252 prints as '?'."""
+
+    def __init__(self, base_font: str, widths: dict):
+        self.base_font = base_font
+        self._widths = [widths.get(chr(i), 500) for i in range(256)]
+
+    def encode(self, text: str) -> bytes:
+        return _pdf_string(text.encode("cp1252", "replace"))
+
+    def width(self, text: str, size: float) -> float:
+        widths = self._widths
+        return sum(widths[b] for b in text.encode("cp1252", "replace")) * size / 1000
+
+    def write(self, pdf, font_id: int):
+        pdf.write_object(font_id, f"<< /Type /Font /Subtype /Type1 /BaseFont /{self.base_font} "
+                                  f"/Encoding /WinAnsiEncoding >>".encode())
+
+
+class TrueTypeFont:
+    """A TrueType font, embedded as a glyph subset when the document is closed."""
+
+    SUBSET_CACHE_SIZE = 16
+
+    def __init__(self, path: str):
+        # fontTools is only needed once a PDF is rendered, so it is not imported with the app
+        from fontTools.ttLib import TTFont
+
+        self.path = path
+        font = TTFont(path, lazy=True)
+        scale = 1000 / font["head"].unitsPerEm
+        hmtx = font["hmtx"]
+        self.name = font["name"].getDebugName(6) or "Font"
+        self.glyph_ids = {}
+        self.widths = {}
+        for codepoint, glyph in font.getBestCmap().items():
+            self.glyph_ids[codepoint] = font.getGlyphID(glyph)
+            self.widths[codepoint] = hmtx[glyph][0] * scale
+        # str.translate table: one C-level pass turns text into the hex glyph ids of a Tj string
+        self.hex_table = {cp: f"{gid:04X}" for cp, gid in self.glyph_ids.items() if gid < 0x10000}
+        self.missing_width = hmtx[".notdef"][0] * scale
+        head, hhea, os2 = font["head"], font["hhea"], font["OS/2"]
+        self.bbox = [round(v * scale) for v in (head.xMin, head.yMin, head.xMax, head.yMax)]
+        self.ascent = round(hhea.ascent * scale)
+        self.descent = round(hhea.descent * scale)
+        self.cap_height = round(getattr(os2, "sCapHeight", 0) * scale) or self.ascent
+        self.italic_angle = font["post"].italicAngle
+        self.fixed_pitch = bool(font["post"].isFixedPitch)
+        # Latin-1 and common typography are always kept, so most reports need the same subset
+        self.base_gids = frozenset(gid for cp, gid in self.glyph_ids.items() if 32 <= cp < 256 or cp in COMMON_CODEPOINTS)
+        self._subsets = OrderedDict()
+
+    def subset(self, gids) -> bytes:
+        """The font file cut down to ``gids`` (plus the Latin-1 base set), memoized per glyph set."""
+        key = self.base_gids.union(gids)
+        font_file = self._subsets.get(key)
+        if font_file is None:
+            from fontTools import subset
+            from fontTools.ttLib import TTFont
+
+            options = subset.Options()
+            options.retain_gids = True
+            options.notdef_outline = True
+            options.name_IDs = ["*"]
+            options.drop_tables += ["GSUB", "GPOS", "GDEF", "kern", "FFTM"]
+            ttf = TTFont(self.path)
+            subsetter = subset.Subsetter(options)
+            subsetter.populate(gids=[0, *sorted(key)])
+            subsetter.subset(ttf)
+            buffer = io.BytesIO()
+            ttf.save(buffer)
+            font_file = buffer.getvalue()
+            self._subsets[key] = font_file
+            while len(self._subsets) > self.SUBSET_CACHE_SIZE:
+                self._subsets.popitem(last=False)
+        else:
+            self._subsets.move_to_end(key)
+        return font_file
+
+    def new_document(self):
+        """Per-document state: which glyphs (and so which characters) were used."""
+        return _TrueTypeUsage(self)
+
+
+class _TrueTypeUsage:
+    WIDTH_CACHE_LIMIT = 50_000
+
+    def __init__(self, font: TrueTypeFont):
+        self.font = font
+        self.chars = set()
+        self._width_cache = {}
+
+    @property
+    def used(self) -> dict:
+        """Glyph id -> codepoint for every character encoded so far that the font can draw."""
+        glyph_ids = self.font.glyph_ids
+        used = {}
+        for ch in sorted(self.chars):
+            gid = glyph_ids.get(ord(ch), 0)
+            if gid:
+                used.setdefault(gid, ord(ch))
+        return used
+
+    def encode(self, text: str) -> bytes:
+        self.chars.update(text)
+        hex_text = text.translate(self.font.hex_table)
+        if len(hex_text) != 4 * len(text):
+            hex_text = "".join(self.font.hex_table.get(ord(ch), "0000") for ch in text)
+        return b"<" + hex_text.encode() + b">"
+
+    def width(self, text: str, size: float) -> float:
+        units = self._width_cache.get(text)
+        if units is None:
+            widths, missing = self.font.widths, self.font.missing_width
+            units = sum(widths.get(ord(ch), missing) for ch in text)
+            if len(self._width_cache) < self.WIDTH_CACHE_LIMIT:
+                self._width_cache[text] = units
+        return units * size / 1000
+
+    def write(self, pdf, font_id: int):
+        font = self.font
+        used = self.used
+        gids = sorted(used)
+        tag = "".join(chr(65 + b % 26) for b in hashlib.md5(repr(gids).encode()).digest()[:6])
+        base = f"{tag}+{font.name}"
+
+        font_file = font.subset(gids)
+
+        cid_id, descriptor_id, file_id, cmap_id = (pdf.new_id() for _ in range(4))
+        pdf.write_object(font_id, f"<< /Type /Font /Subtype /Type0 /BaseFont /{base} /Encoding /Identity-H "
+                                  f"/DescendantFonts [{cid_id} 0 R] /ToUnicode {cmap_id} 0 R >>".encode())
+        widths = " ".join(f"{gid} [{round(font.widths.get(cp, font.missing_width))}]"
+                          for gid, cp in sorted(used.items()))
+        pdf.write_object(cid_id, f"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /{base} "
+                                 f"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> "
+                                 f"/FontDescriptor {descriptor_id} 0 R /CIDToGIDMap /Identity "
+                                 f"/DW {round(font.missing_width)} /W [{widths}] >>".encode())
+        flags = 32 | (1 if font.fixed_pitch else 0)
+        pdf.write_object(descriptor_id, f"<< /Type /FontDescriptor /FontName /{base} /Flags {flags} "
+                                        f"/FontBBox [{' '.join(map(str, font.bbox))}] /ItalicAngle {font.italic_angle} "
+                                        f"/Ascent {font.ascent} /Descent {font.descent} /CapHeight {font.cap_height} "
+                                        f"/StemV 80 /FontFile2 {file_id} 0 R >>".encode())
+        pdf.write_stream(file_id, font_file, f"/Length1 {len(font_file)}")
+
+        lines = ["/CIDInit /ProcSet findresource begin", "12 dict begin", "begincmap",
+                 "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def",
+                 "/CMapName /Adobe-Identity-UCS def", "/CMapType 2 def",
+                 "1 begincodespacerange", "<0000> <FFFF>", "endcodespacerange"]
+        pairs = sorted(used.items())
+        for start in range(0, len(pairs), 100):
+            block = pairs[start:start + 100]
+            lines.append(f"{len(block)} beginbfchar")
+            for gid, codepoint in block:
+                utf16 = chr(codepoint).encode("utf-16-be").hex().upper()
+                lines.append(f"<{gid:04X}> <{utf16}>")
+            lines.append("endbfchar")
+        lines += ["endcmap", "CMapName currentdict /CMap defineresource pop", "end", "end"]
+        pdf.write_stream(cmap_id, "\n".join(lines).encode())
+
+
+class StreamingPDF:
+    """Writes objects straight to ``sink`` and keeps only their byte offsets for the xref table."""
+
+    CATALOG, PAGES, INFO = 1, 2, 3
+
+    def __init__(self, sink, fonts: dict, page_size=A4, title: str = ""):
+        self.sink = sink
+        self.page_size = page_size
+        self.title = title
+        self._offsets = {}
+        self._next_id = 4
+        self._position = 0
+        self._pages = []
+        # Fonts are written at close() but pages reference them, so their ids are fixed up front
+        self.fonts = {name: (font.new_document() if isinstance(font, TrueTypeFont) else font)
+                      for name, font in fonts.items()}
+        self._font_ids = {name: self.new_id() for name in fonts}
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def new_id(self) -> int:
+        self._next_id += 1
+        return self._next_id - 1
+
+    def _write(self, data: bytes):
+        self.sink.write(data)
+        self._position += len(data)
+
+    def write_object(self, obj_id: int, body: bytes):
+        self._offsets[obj_id] = self._position
+        self._write(b"%d 0 obj\n" % obj_id + body + b"\nendobj\n")
+
+    def write_stream(self, obj_id: int, data: bytes, extra: str = ""):
+        data = zlib.compress(data, 6)
+        self.write_object(obj_id, f"<< /Length {len(data)} /Filter /FlateDecode {extra}>>\nstream\n".encode()
+                          + data + b"\nendstream")
+
+    def add_page(self, content: bytes):
+        page_id, content_id = self.new_id(), self.new_id()
+        self.write_stream(content_id, content)
+        fonts = " ".join(f"/{name} {font_id} 0 R" for name, font_id in self._font_ids.items())
+        width, height = self.page_size
+        self.write_object(page_id, f"<< /Type /Page /Parent {self.PAGES} 0 R /MediaBox [0 0 {width} {height}] "
+                                   f"/Resources << /Font << {fonts} >> >> /Contents {content_id} 0 R >>".encode())
+        self._pages.append(page_id)
+
+    def close(self):
+        for name, font in self.fonts.items():
+            font.write(self, self._font_ids[name])
+        kids = " ".join(f"{page} 0 R" for page in self._pages)
+        self.write_object(self.PAGES, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._pages)} >>".encode())
+        self.write_object(self.CATALOG, f"<< /Type /Catalog /Pages {self.PAGES} 0 R >>".encode())
+        title = _pdf_string(self.title.encode("cp1252", "replace"))
+        self.write_object(self.INFO, b"<< /Title " + title + b" /Producer (AI Code Lab Pro) >>")
+
+        xref_at = self._position
+        count = self._next_id
+        rows = [b"xref\n0 %d\n" % count, b"0000000000 65535 f \n"]
+        for obj_id in range(1, count):
+            offset = self._offsets.get(obj_id)
+            rows.append(b"%010d 00000 n \n" % offset if offset is not None else b"0000000000 65535 f \n")
+        self._write(b"".join(rows))
+        self._write(f"trailer\n<< /Size {count} /Root {self.CATALOG} 0 R /Info {self.INFO} 0 R >>\n"
+                    f"startxref\n{xref_at}\n%%EOF\n".encode())
@@ -0,0 +1,392 @@
+"""Retries, hedging, timeouts and a circuit breaker around model calls.
+
+``ResilientBackend`` wraps a ``ModelBackend`` (usually an
+``InstrumentedBackend``, so every attempt shows up in the metrics) and keeps
+the same interface:
+
+* every attempt is bounded by the model's timeout (``MODEL_TIMEOUT``, or a
+  per-model entry in ``MODEL_TIMEOUTS``)
+* failed or timed-out attempts are retried after a jittered exponential
+  backoff, but only while the ``RetryBudget`` allows it, so an outage cannot
+  multiply upstream load
+* with hedging on, an attempt still running after the p95 of recent call
+  times gets a second, identical request; whichever answers first wins and
+  the other is cancelled. Hedges are paid for from the retry budget as well
+* after ``BREAKER_FAILURES`` consecutive failures the ``CircuitBreaker`` opens
+  and calls fail fast with ``CircuitOpenError`` (or go to the fallback model)
+  until a probe succeeds after ``BREAKER_COOLDOWN`` seconds
+
+Answers produced by the fallback model are returned as ``FallbackAnswer`` so
+callers can avoid caching them as if the primary model had written them.
+"""
+import asyncio
+import collections
+import os
+import random
+import time
+
+from metrics import MODEL_CIRCUIT_OPEN, MODEL_RESILIENCE_EVENTS
+from model_backends import ModelBackendError, QuotaExceededError
+
+
+class ModelTimeoutError(ModelBackendError):
+    """A model call took longer than the model's timeout."""
+
+
+class CircuitOpenError(ModelBackendError):
+    """The circuit breaker is open; ``retry_after`` is the rest of the cool-down in seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class FallbackAnswer(str):
+    """An answer written by the fallback model instead of the primary one."""
+
+    model_name = None
+
+
+def parse_timeouts(spec: str) -> dict:
+    """Parse ``"gemini-2.5-flash=60,gemini-2.0-flash-lite=20"`` into seconds per model."""
+    timeouts = {}
+    for part in spec.split(","):
+        name, _, value = part.rpartition("=")
+        if name.strip() and value.strip():
+            timeouts[name.strip()] = float(value)
+    return timeouts
+
+
+class RetryBudget:
+    """Allows retries worth ``ratio`` of recent calls, plus ``min_per_second`` so a quiet server can still retry.
+
+    Every call deposits ``ratio`` tokens and every retry or hedge withdraws
+    one; the balance never exceeds ``cap``.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, cap: float = 20.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.cap = cap
+        self.balance = cap
+        self._updated = time.monotonic()
+
+    def _refill(self, amount: float = 0.0):
+        now = time.monotonic()
+        self.balance = min(self.cap, self.balance + amount + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        self._refill(self.ratio)
+
+    def withdraw(self) -> bool:
+        self._refill()
+        if self.balance >= 1:
+            self.balance -= 1
+            return True
+        return False
+
+
+class CircuitBreaker:
+    """Opens after ``failures`` consecutive failed calls; lets one probe through every ``cooldown`` seconds."""
+
+    def __init__(self, failures: int = 5, cooldown: float = 30.0):
+        self.failures = max(1, failures)
+        self.cooldown = cooldown
+        self.consecutive = 0
+        self.opened_at = None
+        self._probe_at = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.cooldown:
+            return False
+        # Half open: one probe at a time; a probe that never reports back is replaced after another cool-down
+        if self._probe_at is None or now - self._probe_at >= self.cooldown:
+            self._probe_at = now
+            return True
+        return False
+
+    def record(self, success: bool):
+        if success:
+            self.consecutive = 0
+            self.opened_at = self._probe_at = None
+            return
+        self.consecutive += 1
+        if self.opened_at is not None or self.consecutive >= self.failures:
+            # A failed probe restarts the cool-down
+            self.opened_at = time.monotonic()
+            self._probe_at = None
+
+
+class LatencyTracker:
+    """Recent successful call times, for the hedging delay."""
+
+    def __init__(self, size: int = 256, min_samples: int = 20):
+        self.samples = collections.deque(maxlen=size)
+        self.min_samples = min_samples
+        self._quantiles = {}
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        # Quantiles are re-sorted every 16 samples rather than on every call
+        if len(self.samples) % 16 == 0:
+            self._quantiles.clear()
+
+    def quantile(self, q: float):
+        if len(self.samples) < self.min_samples:
+            return None
+        if q not in self._quantiles:
+            ordered = sorted(self.samples)
+            self._quantiles[q] = ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+        return self._quantiles[q]
+
+
+def _retryable(error: BaseException) -> bool:
+    # Bad arguments fail the same way every time; anything else may be transient. Quota errors come from the key
+    # router, which has already tried every key and waited as long as it should
+    return not isinstance(error, (ValueError, TypeError, CircuitOpenError, QuotaExceededError))
+
+
+class ResilientBackend:
+    """Wraps a backend with timeouts, budgeted retries, optional hedging, a circuit breaker and a fallback."""
+
+    def __init__(self, backend, fallback=None, timeout: float = 60.0, fallback_timeout: float = None,
+                 retries: int = 2, backoff: float = 0.2, max_backoff: float = 5.0, budget: RetryBudget = None,
+                 hedge: bool = False, hedge_quantile: float = 0.95, breaker: CircuitBreaker = None):
+        self.backend = backend
+        self.fallback = fallback
+        self.timeout = timeout
+        self.fallback_timeout = fallback_timeout or timeout
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget or RetryBudget()
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.events = collections.Counter()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def _event(self, event: str):
+        self.events[event] += 1
+        MODEL_RESILIENCE_EVENTS.inc(event=event)
+
+    def hedge_delay(self):
+        return self.latency.quantile(self.hedge_quantile) if self.hedge else None
+
+    def _retry_delay(self, attempt: int) -> float:
+        # Full jitter: a uniform draw up to the exponential backoff keeps retries from synchronising
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def _hedged(self, prompt: str) -> str:
+        """One attempt: the call, plus a hedge if it outlives the hedging delay, bounded by the timeout."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + self.timeout
+        primary = asyncio.ensure_future(self.backend.generate_async(prompt))
+        tasks = [primary]
+        hedge_at = self.hedge_delay()
+        error = None
+        try:
+            while tasks:
+                remaining = deadline - loop.time()
+                wait = remaining if hedge_at is None else min(remaining, start + hedge_at - loop.time())
+                done, _ = await asyncio.wait(tasks, timeout=max(0.0, wait), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is None:
+                        self.latency.observe(loop.time() - start)
+                        if task is not primary:
+                            self._event("hedge_won")
+                        return task.result()
+                    error = task.exception()
+                if done:
+                    # A failed call does not end the attempt while its hedge may still answer
+                    continue
+                if hedge_at is None or loop.time() >= deadline:
+                    self._event("timeout")
+                    raise ModelTimeoutError(f"{self.backend.model_name} did not answer within {self.timeout:g}s")
+                # The hedging delay passed with no answer: send one duplicate if the budget allows
+                hedge_at = None
+                if self.budget.withdraw():
+                    self._event("hedge")
+                    tasks.append(asyncio.ensure_future(self.backend.generate_async(prompt)))
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _call_fallback(self, prompt: str, error: Exception) -> str:
+        if self.fallback is None:
+            raise error
+        self._event("fallback")
+        try:
+            text = await asyncio.wait_for(self.fallback.generate_async(prompt), self.fallback_timeout)
+        except asyncio.TimeoutError:
+            raise ModelTimeoutError(f"fallback {self.fallback.model_name} did not answer "
+                                    f"within {self.fallback_timeout:g}s") from error
+        answer = FallbackAnswer(text)
+        answer.model_name = self.fallback.model_name
+        return answer
+
+    def _short_circuit(self) -> CircuitOpenError:
+        self._event("short_circuit")
+        return CircuitOpenError(f"{self.backend.model_name} is failing; not calling it for now",
+                                self.breaker.retry_after())
+
+    def _failed(self, error: BaseException):
+        was_open = self.breaker.opened_at is not None
+        self.breaker.record(False)
+        if not was_open and self.breaker.opened_at is not None:
+            self._event("circuit_opened")
+        MODEL_CIRCUIT_OPEN.set(1 if self.breaker.opened_at is not None else 0)
+
+    def _succeeded(self):
+        self.breaker.record(True)
+        MODEL_CIRCUIT_OPEN.set(0)
+
+    async def _retrying(self, attempt_fn):
+        """Run ``attempt_fn`` until it succeeds, retries or budget run out, or the breaker opens."""
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise self._short_circuit()
+            try:
+                result = await attempt_fn()
+            except asyncio.CancelledError:
+                raise
+            except QuotaExceededError:
+                # Out of quota is not unhealthy: it must not open the breaker for everyone
+                raise
+            except Exception as e:
+                self._failed(e)
+                if not _retryable(e) or attempt >= self.retries:
+                    raise
+                if not self.budget.withdraw():
+                    self._event("retry_budget_exhausted")
+                    raise
+                attempt += 1
+                self._event("retry")
+                await asyncio.sleep(self._retry_delay(attempt))
+                continue
+            self._succeeded()
+            return result
+
+    async def generate_async(self, prompt: str) -> str:
+        try:
+            return await self._retrying(lambda: self._hedged(prompt))
+        except (ValueError, TypeError):
+            raise
+        except ModelBackendError as e:
+            return await self._call_fallback(prompt, e)
+        except Exception as e:
+            error = ModelBackendError(f"{self.backend.model_name} failed: {e}")
+            error.__cause__ = e
+            return await self._call_fallback(prompt, error)
+
+    def generate(self, prompt: str) -> str:
+        # The blocking path is only used by scripts; it gets the breaker but not retries or hedging
+        if not self.breaker.allow():
+            raise self._short_circuit()
+        try:
+            text = self.backend.generate(prompt)
+        except Exception as e:
+            self._failed(e)
+            raise
+        self._succeeded()
+        return text
+
+    async def stream(self, prompt: str):
+        """Stream with the timeout applied to every chunk; retried only until the first chunk arrives.
+
+        Streams are not hedged: once text has been sent to the client, a
+        different answer cannot take its place.
+        """
+        async def first_chunk():
+            chunks = self.backend.stream(prompt).__aiter__()
+            try:
+                return chunks, await asyncio.wait_for(chunks.__anext__(), self.timeout)
+            except StopAsyncIteration:
+                return None, None
+            except asyncio.TimeoutError:
+                await chunks.aclose()
+                self._event("timeout")
+                raise ModelTimeoutError(f"{self.backend.model_name} sent nothing within {self.timeout:g}s")
+            except BaseException:
+                await chunks.aclose()
+                raise
+
+        try:
+            chunks, chunk = await self._retrying(first_chunk)
+        except ModelBackendError as e:
+            if self.fallback is None:
+                raise
+            yield await self._call_fallback(prompt, e)
+            return
+        if chunks is None:
+            return
+        try:
+            yield chunk
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    self._event("timeout")
+                    self._failed(None)
+                    raise ModelTimeoutError(f"{self.backend.model_name} stalled for {self.timeout:g}s mid-stream")
+                except Exception as e:
+                    self._failed(e)
+                    raise
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    def prewarm(self):
+        self.backend.prewarm()
+        if self.fallback is not None:
+            self.fallback.prewarm()
+
+    def close(self):
+        self.backend.close()
+        if self.fallback is not None:
+            self.fallback.close()
+
+
+def resilient_from_env(backend, fallback=None) -> ResilientBackend:
+    """Wrap ``backend`` (and an optional cheaper ``fallback``) using the MODEL_*/RETRY_*/HEDGE_*/BREAKER_* settings."""
+    env = os.environ.get
+    timeouts = parse_timeouts(env("MODEL_TIMEOUTS", ""))
+    default_timeout = float(env("MODEL_TIMEOUT", 60))
+    return ResilientBackend(
+        backend,
+        fallback=fallback,
+        timeout=timeouts.get(backend.model_name, default_timeout),
+        fallback_timeout=timeouts.get(fallback.model_name, default_timeout) if fallback else None,
+        retries=int(env("MODEL_RETRIES", 2)),
+        backoff=float(env("RETRY_BACKOFF", 0.2)),
+        budget=RetryBudget(ratio=float(env("RETRY_BUDGET", 0.2))),
+        hedge=env("MODEL_HEDGE", "0").lower() in ("1", "true", "yes"),
+        hedge_quantile=float(env("HEDGE_QUANTILE", 0.95)),
+        breaker=CircuitBreaker(failures=int(env("BREAKER_FAILURES", 5)),
+                               cooldown=float(env("BREAKER_COOLDOWN", 30))),
+    )
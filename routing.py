@@ -0,0 +1,340 @@
+"""Spread model calls over a pool of API keys and model tiers without running into their quotas.
+
+``RoutedBackend`` keeps the ``ModelBackend`` interface and owns one backend
+per API key and model, a *route*:
+
+* each route knows its key's limits for the model (``MODEL_LIMITS``:
+  requests and tokens per minute, and the largest prompt the model takes)
+  and what it has sent within the last minute, so calls go where there is
+  headroom before the upstream has to refuse them
+* a call goes to the first tier of ``MODEL_TIERS`` with a route ready for a
+  prompt of its estimated size, and within that tier to the key with the most
+  headroom left, then the fewest calls in flight, then the one idle longest
+* a key that answers with a quota error (HTTP 429) cools down for the
+  upstream's retry delay, or for ``KEY_COOLDOWN`` seconds doubling with each
+  repeated strike, and the call moves on to the next route
+* when no route is ready the call waits up to ``ROUTER_MAX_WAIT`` seconds for
+  one, then fails with ``QuotaExceededError`` so the API answers 503 with a
+  ``Retry-After`` instead of an error from the model
+
+Models without configured limits are routed on in-flight counts and quota
+errors alone. Prompt sizes are estimated (``compaction.estimate_tokens``), and
+answers are reserved at the route's recent average and settled afterwards.
+"""
+import asyncio
+import collections
+import hashlib
+import os
+import threading
+import time
+
+from compaction import estimate_tokens
+from metrics import MODEL_KEY_REQUESTS, MODEL_KEY_TOKENS
+from model_backends import BACKEND_ENV, QuotaExceededError, backend_from_env
+
+# Answer size reserved for a route until it has seen some answers
+DEFAULT_ANSWER_TOKENS = 1000
+# A key that keeps hitting its quota cools down for at most KEY_COOLDOWN * 2 ** this
+MAX_COOLDOWN_DOUBLINGS = 5
+
+
+def parse_limits(spec: str) -> dict:
+    """Parse ``"gemini-2.5-flash=10/250000,gemini-2.0-flash=15/1000000/1048576"`` into per-key limits per model.
+
+    Values are requests per minute, tokens per minute and optionally the
+    context window in tokens; 0 means unlimited.
+    """
+    limits = {}
+    for part in spec.split(","):
+        name, _, value = part.rpartition("=")
+        if name.strip() and value.strip():
+            numbers = [int(float(v)) for v in value.split("/")] + [0, 0]
+            limits[name.strip()] = {"rpm": numbers[0], "tpm": numbers[1], "context": numbers[2]}
+    return limits
+
+
+def key_label(api_key: str) -> str:
+    """A name for an API key that is safe to put in metrics and logs."""
+    if not api_key:
+        return "default"
+    return "key-" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+
+class Route:
+    """One API key and model: its backend, the calls inside its quota window, cool-down and usage counts.
+
+    The upstream counts quotas over a sliding window, so the route keeps a log
+    of its calls in the last ``window`` seconds rather than a token bucket,
+    which would let up to twice the quota through in a window after an idle
+    spell.
+    """
+
+    def __init__(self, backend, label: str, rpm: int = 0, tpm: int = 0, context: int = 0, window: float = 60.0):
+        self.backend = backend
+        self.label = label
+        self.model = backend.model_name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.context = context
+        self.window = window
+        self.log = collections.deque()  # [time, tokens] per call inside the window, oldest first
+        self.log_tokens = 0
+        self.answer_tokens = DEFAULT_ANSWER_TOKENS
+        self.cooldown_until = 0.0
+        self.strikes = 0
+        self.inflight = 0
+        self.last_used = 0.0
+        self.counts = collections.Counter()
+
+    def _expire(self, now: float):
+        while self.log and self.log[0][0] <= now - self.window:
+            self.log_tokens -= self.log.popleft()[1]
+
+    def fits(self, tokens: int) -> bool:
+        """Whether this model and key take a prompt of ``tokens`` at all."""
+        return (not self.context or tokens <= self.context) and (not self.tpm or tokens <= self.tpm)
+
+    def cost(self, tokens: int) -> int:
+        """Tokens reserved for a call: the prompt plus a typical answer, never more than the whole quota."""
+        cost = tokens + round(self.answer_tokens)
+        return min(cost, self.tpm) if self.tpm else cost
+
+    def wait(self, now: float, cost: int) -> float:
+        """Seconds until this route can take a call reserving ``cost`` tokens; 0 if it can now."""
+        self._expire(now)
+        wait = self.cooldown_until - now
+        if self.rpm and len(self.log) >= self.rpm:
+            wait = max(wait, self.log[-self.rpm][0] + self.window - now)
+        if self.tpm and self.log_tokens + cost > self.tpm:
+            excess = self.log_tokens + cost - self.tpm
+            for at, tokens in self.log:
+                excess -= tokens
+                if excess <= 0:
+                    wait = max(wait, at + self.window - now)
+                    break
+        return max(0.0, wait)
+
+    def headroom(self, now: float) -> float:
+        """Unused share of the tighter of the two quotas; 1 for a route without limits."""
+        self._expire(now)
+        shares = [1.0]
+        if self.rpm:
+            shares.append(1 - len(self.log) / self.rpm)
+        if self.tpm:
+            shares.append(1 - self.log_tokens / self.tpm)
+        return max(0.0, min(shares))
+
+    def reserve(self, now: float, cost: int):
+        """Count a call against the quota; returns its log entry, or None for a route without limits."""
+        self.inflight += 1
+        self.last_used = now
+        if not (self.rpm or self.tpm):
+            return None
+        entry = [now, cost]
+        self.log.append(entry)
+        self.log_tokens += cost
+        return entry
+
+    def settle(self, now: float, entry, used: int, answer: int):
+        """Replace the reservation with the tokens the call actually used, once the answer's size is known."""
+        self._expire(now)
+        if entry is not None and entry[0] > now - self.window:
+            self.log_tokens += used - entry[1]
+            entry[1] = used
+        self.answer_tokens += (answer - self.answer_tokens) / 8
+
+    def cool_down(self, now: float, retry_after: float, cooldown: float):
+        self.strikes += 1
+        if retry_after is None:
+            retry_after = cooldown * 2 ** min(self.strikes - 1, MAX_COOLDOWN_DOUBLINGS)
+        self.cooldown_until = max(self.cooldown_until, now + retry_after)
+
+    def stats(self, now: float) -> dict:
+        return {
+            "key": self.label,
+            "model": self.model,
+            "headroom": round(self.headroom(now), 3),
+            "cooldown": round(max(0.0, self.cooldown_until - now), 3),
+            "in_flight": self.inflight,
+            **{outcome: self.counts[outcome] for outcome in ("ok", "quota", "error", "cancelled")},
+            "prompt_tokens": self.counts["prompt_tokens"],
+            "answer_tokens": self.counts["answer_tokens"],
+        }
+
+
+class RoutedBackend:
+    """Sends each call to the best route of the first tier that has one ready; see the module docstring."""
+
+    def __init__(self, tiers: list, max_wait: float = 2.0, cooldown: float = 10.0):
+        self.tiers = [list(tier) for tier in tiers if tier]
+        if not self.tiers:
+            raise ValueError("RoutedBackend needs at least one route")
+        self.max_wait = max_wait
+        self.cooldown = cooldown
+        self.name = self.tiers[0][0].backend.name
+        self.model_name = self.tiers[0][0].model
+        self._lock = threading.Lock()
+
+    @property
+    def routes(self) -> list:
+        return [route for tier in self.tiers for route in tier]
+
+    def _pick(self, tokens: int):
+        """``(route, quota_entry, 0)``, or ``(None, None, seconds)`` until some route could take the call."""
+        now = time.monotonic()
+        tiers = [[route for route in tier if route.fits(tokens)] for tier in self.tiers]
+        if not any(tiers):
+            # Too large for every model as far as we know; let the upstream give the real error
+            tiers = self.tiers
+        soonest = None
+        with self._lock:
+            for tier in tiers:
+                best = None
+                for route in tier:
+                    cost = route.cost(tokens)
+                    wait = route.wait(now, cost)
+                    if wait > 0:
+                        soonest = wait if soonest is None else min(soonest, wait)
+                        continue
+                    rank = (-round(route.headroom(now), 2), route.inflight, route.last_used)
+                    if best is None or rank < best[0]:
+                        best = (rank, route, cost)
+                if best is not None:
+                    _, route, cost = best
+                    return route, route.reserve(now, cost), 0.0
+        return None, None, soonest
+
+    def _exhausted(self, wait: float) -> QuotaExceededError:
+        return QuotaExceededError(f"every API key is out of quota for {self.model_name}", retry_after=wait)
+
+    async def _acquire(self, tokens: int):
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            route, entry, wait = self._pick(tokens)
+            if route is not None:
+                return route, entry
+            if time.monotonic() + wait > deadline:
+                raise self._exhausted(wait)
+            await asyncio.sleep(wait)
+
+    def _acquire_blocking(self, tokens: int):
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            route, entry, wait = self._pick(tokens)
+            if route is not None:
+                return route, entry
+            if time.monotonic() + wait > deadline:
+                raise self._exhausted(wait)
+            time.sleep(wait)
+
+    def _finished(self, route: Route, entry, tokens: int, text: str, error: BaseException):
+        now = time.monotonic()
+        with self._lock:
+            route.inflight -= 1
+            if error is None:
+                outcome = "ok"
+                route.strikes = 0
+                answer = estimate_tokens(text)
+                route.settle(now, entry, tokens + answer, answer)
+            elif isinstance(error, QuotaExceededError):
+                outcome = "quota"
+                route.cool_down(now, error.retry_after, self.cooldown)
+            else:
+                outcome = "cancelled" if isinstance(error, (asyncio.CancelledError, GeneratorExit)) else "error"
+            route.counts[outcome] += 1
+            if outcome != "quota":
+                route.counts["prompt_tokens"] += tokens
+            if outcome == "ok":
+                route.counts["answer_tokens"] += answer
+        MODEL_KEY_REQUESTS.inc(key=route.label, model=route.model, outcome=outcome)
+        if outcome != "quota":
+            MODEL_KEY_TOKENS.inc(tokens, key=route.label, model=route.model, direction="prompt")
+        if outcome == "ok":
+            MODEL_KEY_TOKENS.inc(answer, key=route.label, model=route.model, direction="answer")
+
+    def generate(self, prompt: str) -> str:
+        tokens = estimate_tokens(prompt)
+        while True:
+            route, entry = self._acquire_blocking(tokens)
+            text = error = None
+            try:
+                text = route.backend.generate(prompt)
+                return text
+            except BaseException as e:
+                error = e
+                if not isinstance(e, QuotaExceededError):
+                    raise
+            finally:
+                self._finished(route, entry, tokens, text, error)
+
+    async def generate_async(self, prompt: str) -> str:
+        tokens = estimate_tokens(prompt)
+        while True:
+            route, entry = await self._acquire(tokens)
+            text = error = None
+            try:
+                text = await route.backend.generate_async(prompt)
+                return text
+            except BaseException as e:
+                error = e
+                # A key out of quota is cooled down and the call goes to the next route
+                if not isinstance(e, QuotaExceededError):
+                    raise
+            finally:
+                self._finished(route, entry, tokens, text, error)
+
+    async def stream(self, prompt: str):
+        """Stream from the best route; a quota error moves to another route only before any text was sent."""
+        tokens = estimate_tokens(prompt)
+        while True:
+            route, entry = await self._acquire(tokens)
+            chunks = route.backend.stream(prompt)
+            parts, error = [], None
+            try:
+                async for chunk in chunks:
+                    parts.append(chunk)
+                    yield chunk
+            except BaseException as e:
+                error = e
+                if not isinstance(e, QuotaExceededError) or parts:
+                    raise
+            finally:
+                await chunks.aclose()
+                self._finished(route, entry, tokens, "".join(parts), error)
+            if error is None:
+                return
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        with self._lock:
+            return [dict(route.stats(now), tier=i) for i, tier in enumerate(self.tiers) for route in tier]
+
+    def prewarm(self):
+        for route in self.routes:
+            route.backend.prewarm()
+
+    def close(self):
+        for route in self.routes:
+            route.backend.close()
+
+
+def router_from_env(default_backend: str = "gemini", default_model: str = "gemini-2.5-flash",
+                    model_name: str = None, window: float = 60.0) -> RoutedBackend:
+    """Route over ``GEMINI_API_KEYS`` (else ``GEMINI_API_KEY``) and ``MODEL_TIERS``, or ``model_name`` alone.
+
+    ``window`` is the quota period in seconds that ``MODEL_LIMITS`` refers to.
+    """
+    env = os.environ.get
+    keys = [key.strip() for key in (env("GEMINI_API_KEYS") or env("GEMINI_API_KEY") or "").split(",") if key.strip()]
+    if len(keys) > 1 and (env(BACKEND_ENV) or default_backend) == "gemini":
+        raise ValueError("google.generativeai takes one API key per process; use MODEL_BACKEND=genai for a key pool")
+    tiers = [model_name] if model_name else [m.strip() for m in env("MODEL_TIERS", "").split(",") if m.strip()]
+    limits = parse_limits(env("MODEL_LIMITS", ""))
+    routes = []
+    for model in tiers or [None]:
+        tier = []
+        for key in keys or [None]:
+            backend = backend_from_env(default_backend, default_model, model_name=model, api_key=key)
+            tier.append(Route(backend, key_label(key), window=window, **limits.get(backend.model_name, {})))
+        routes.append(tier)
+    return RoutedBackend(routes, max_wait=float(env("ROUTER_MAX_WAIT", 2)), cooldown=float(env("KEY_COOLDOWN", 10)))
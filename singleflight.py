@@ -0,0 +1,56 @@
+import asyncio
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one pending call.
+
+    The first caller for a key starts ``fn()`` as a task; callers arriving while
+    it runs await the same task and get the same result or exception. Each
+    waiter awaits through ``asyncio.shield``, so a cancelled waiter (say, a
+    client that went away) never cancels the shared call for everyone else;
+    only when the last waiter is cancelled is the call itself cancelled, since
+    nobody is left to use its result.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self.cancelled = 0
+        self._inflight = {}
+        self._waiters = {}
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def do(self, key, fn):
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            self._waiters[task] = 0
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.coalesced += 1
+        self._waiters[task] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters.get(task) == 1 and not task.done():
+                # Forget the call now so a caller arriving during its cancellation starts a fresh one
+                if self._inflight.get(key) is task:
+                    del self._inflight[key]
+                self.cancelled += 1
+                task.cancel()
+            raise
+        finally:
+            if task in self._waiters:
+                self._waiters[task] -= 1
+
+    def _finish(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        self._waiters.pop(task, None)
+        # Mark the exception retrieved in case every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,451 @@
+"""Local static pre-analysis of submissions.
+
+Python is parsed with ``ast``/``tokenize``; C++ and Java go through a small
+regex tokenizer that tracks braces. Both produce the same report shape:
+
+    {"language", "lines", "code_lines", "comment_lines", "functions": [...],
+     "max_loop_depth", "quadratic": [...], "parse_error"}
+
+The report is injected into the model prompt as compact facts, and rendered
+on its own for the offline fast mode.
+"""
+import ast
+import io
+import re
+import tokenize
+
+MAX_LISTED_FUNCTIONS = 30
+MAX_LISTED_PATTERNS = 15
+
+# List/sequence methods that are linear in the container size
+PY_LINEAR_METHODS = {"index", "count", "remove", "insert"}
+C_LINEAR_METHODS = {"erase", "insert", "indexOf", "lastIndexOf", "contains", "remove"}
+
+C_KEYWORDS = {
+    "if", "for", "while", "do", "switch", "case", "catch", "return", "new", "delete", "sizeof",
+    "throw", "else", "synchronized", "try", "static_assert", "decltype", "alignof", "typeid",
+}
+
+C_TOKEN = re.compile(r"""
+    (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+  | (?P<ident>[A-Za-z_]\w*)
+  | (?P<number>\d[\w.]*)
+  | (?P<op>&&|\|\||::|->|[{}()\[\];,?:<>=!+\-*/%&|^~.\#@])
+  | (?P<newline>\n)
+  | (?P<space>[ \t\r\f\v]+)
+  | (?P<other>.)
+""", re.S | re.X)
+
+
+def _empty_report(language, code):
+    return {
+        "language": language,
+        "lines": len(code.splitlines()),
+        "code_lines": 0,
+        "comment_lines": 0,
+        "functions": [],
+        "max_loop_depth": 0,
+        "quadratic": [],
+        "parse_error": None,
+    }
+
+
+def analyze(code: str, language: str) -> dict:
+    if language == "Python":
+        return analyze_python(code)
+    if language in ("C++", "Java"):
+        return analyze_c_like(code, language)
+    return _empty_report(language, code)
+
+
+# --- Python -----------------------------------------------------------------
+
+class _PyScope(ast.NodeVisitor):
+    """Walks one function body (or the module body) without descending into nested defs."""
+
+    def __init__(self, name, qualname, root):
+        self.name = name
+        self.qualname = qualname
+        self.root = root
+        self.decisions = 0
+        self.depth = 0
+        self.max_depth = 0
+        self.recursive = False
+        self.quadratic = []
+        self.list_names = set()
+
+    def _enter_loop(self, node):
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        if self.depth >= 2:
+            self.quadratic.append((node.lineno, f"loops nested {self.depth} deep"))
+
+    def _loop(self, node):
+        self.decisions += 1
+        self._enter_loop(node)
+        self.generic_visit(node)
+        self.depth -= 1
+
+    visit_For = visit_AsyncFor = visit_While = _loop
+
+    def _comprehension(self, node):
+        for generator in node.generators:
+            self.decisions += 1 + len(generator.ifs)
+            self._enter_loop(node)
+        self.generic_visit(node)
+        self.depth -= len(node.generators)
+
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = _comprehension
+
+    def _decision(self, node):
+        self.decisions += 1
+        self.generic_visit(node)
+
+    visit_If = visit_IfExp = visit_ExceptHandler = visit_match_case = _decision
+
+    def visit_BoolOp(self, node):
+        self.decisions += len(node.values) - 1
+        self.generic_visit(node)
+
+    def _nested(self, node):
+        if node is self.root:
+            self.generic_visit(node)
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = visit_Lambda = _nested
+
+    def visit_Assign(self, node):
+        if isinstance(node.value, (ast.List, ast.ListComp)) or (
+                isinstance(node.value, ast.Call) and isinstance(node.value.func, ast.Name)
+                and node.value.func.id == "list"):
+            self.list_names.update(t.id for t in node.targets if isinstance(t, ast.Name))
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        func = node.func
+        if self.name and (
+                (isinstance(func, ast.Name) and func.id == self.name)
+                or (isinstance(func, ast.Attribute) and func.attr == self.name
+                    and isinstance(func.value, ast.Name) and func.value.id in ("self", "cls"))):
+            self.recursive = True
+        if self.depth and isinstance(func, ast.Attribute):
+            if func.attr in PY_LINEAR_METHODS or (
+                    func.attr == "pop" and node.args and isinstance(node.args[0], ast.Constant)
+                    and node.args[0].value == 0):
+                self.quadratic.append((node.lineno, f"linear list.{func.attr}() inside a loop"))
+        self.generic_visit(node)
+
+    def visit_Compare(self, node):
+        if self.depth:
+            for op, right in zip(node.ops, node.comparators):
+                if isinstance(op, (ast.In, ast.NotIn)) and isinstance(right, ast.Name) and right.id in self.list_names:
+                    self.quadratic.append((node.lineno, f"membership test on list '{right.id}' inside a loop"))
+        self.generic_visit(node)
+
+
+def _python_functions(tree):
+    def walk(body, prefix):
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                yield node, prefix + node.name
+                yield from walk(node.body, prefix + node.name + ".")
+            elif isinstance(node, ast.ClassDef):
+                yield from walk(node.body, prefix + node.name + ".")
+            else:
+                for field in ("body", "orelse", "finalbody", "handlers"):
+                    yield from walk(getattr(node, field, None) or [], prefix)
+    yield from walk(tree.body, "")
+
+
+def analyze_python(code: str) -> dict:
+    report = _empty_report("Python", code)
+
+    lines_with_code, lines_with_comments = set(), set()
+    try:
+        for tok in tokenize.generate_tokens(io.StringIO(code).readline):
+            if tok.type == tokenize.COMMENT:
+                lines_with_comments.add(tok.start[0])
+            elif tok.type not in (tokenize.NL, tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT,
+                                  tokenize.ENDMARKER, tokenize.ENCODING):
+                lines_with_code.update(range(tok.start[0], tok.end[0] + 1))
+    except (tokenize.TokenError, SyntaxError):
+        pass
+    report["code_lines"] = len(lines_with_code)
+    report["comment_lines"] = len(lines_with_comments - lines_with_code)
+
+    try:
+        tree = ast.parse(code)
+        scopes = [(None, _PyScope(None, "<module>", tree))]
+        for node, qualname in _python_functions(tree):
+            scopes.append((node, _PyScope(node.name, qualname, node)))
+        for _, scope in scopes:
+            scope.visit(scope.root)
+    except SyntaxError as e:
+        report["parse_error"] = f"SyntaxError at line {e.lineno}: {e.msg}"
+        return report
+    except (RecursionError, MemoryError):
+        # Valid code, such as a long chain of '+', can still nest deeper than the parser or the walk can recurse
+        report["parse_error"] = "too deeply nested to analyze"
+        return report
+
+    for node, scope in scopes:
+        report["max_loop_depth"] = max(report["max_loop_depth"], scope.max_depth)
+        report["quadratic"].extend(
+            {"line": line, "function": scope.qualname, "pattern": pattern} for line, pattern in scope.quadratic)
+        if node is None:
+            continue
+        report["functions"].append({
+            "name": scope.qualname,
+            "line": node.lineno,
+            "end_line": node.end_lineno,
+            "params": len(node.args.posonlyargs) + len(node.args.args) + len(node.args.kwonlyargs),
+            "complexity": 1 + scope.decisions,
+            "loop_depth": scope.max_depth,
+            "recursive": scope.recursive,
+        })
+    report["quadratic"].sort(key=lambda q: q["line"])
+    return report
+
+
+# --- C++ / Java -----------------------------------------------------------
+
+def tokenize_c_like(code: str) -> list:
+    """Return ``(kind, value, line)`` tuples, dropping whitespace and comments."""
+    tokens = []
+    line = 1
+    for match in C_TOKEN.finditer(code):
+        kind, value = match.lastgroup, match.group()
+        if kind in ("ident", "number", "op", "string", "other"):
+            tokens.append((kind, value, line))
+        line += value.count("\n")
+    return tokens
+
+
+def _match(tokens, start, open_, close):
+    """Index of the token closing the bracket at ``start`` (or the last token if unbalanced)."""
+    depth = 0
+    for i in range(start, len(tokens)):
+        value = tokens[i][1]
+        if value == open_:
+            depth += 1
+        elif value == close:
+            depth -= 1
+            if depth == 0:
+                return i
+    return len(tokens) - 1
+
+
+def _function_body_start(tokens, close_paren):
+    """Index of the ``{`` opening a function body after its parameter list, or None for a declaration/call."""
+    depth = 0
+    for i in range(close_paren + 1, len(tokens)):
+        value = tokens[i][1]
+        if value in ("(", "["):
+            depth += 1
+        elif value in (")", "]"):
+            depth -= 1
+        elif depth == 0:
+            if value == "{":
+                return i
+            if value in (";", "=", "}", ","):
+                return None
+    return None
+
+
+def _count_params(tokens, open_paren, close_paren):
+    inner = tokens[open_paren + 1:close_paren]
+    if not inner or (len(inner) == 1 and inner[0][1] == "void"):
+        return 0
+    depth, params = 0, 1
+    for _, value, _ in inner:
+        if value in ("(", "<", "[", "{"):
+            depth += 1
+        elif value in (")", ">", "]", "}"):
+            depth -= 1
+        elif value == "," and depth == 0:
+            params += 1
+    return params
+
+
+def _scan_c_body(tokens, start, end, name, qualname):
+    decisions, max_depth = 0, 0
+    recursive = False
+    quadratic = []
+    loops = []  # ("brace", level) or ("stmt", level); level is the brace depth the loop body lives at
+    braces, parens = 0, 0
+
+    def open_loop(body_index, line):
+        nonlocal max_depth
+        level = braces + 1 if tokens[body_index][1] == "{" else braces
+        loops.append(("brace" if tokens[body_index][1] == "{" else "stmt", level))
+        max_depth = max(max_depth, len(loops))
+        if len(loops) >= 2:
+            quadratic.append((line, f"loops nested {len(loops)} deep"))
+
+    i = start
+    while i < end:
+        kind, value, line = tokens[i]
+        if value in ("for", "while"):
+            close = _match(tokens, i + 1, "(", ")")
+            if value == "while" and close + 1 < end and tokens[close + 1][1] == ";":
+                i = close + 2  # tail of a do/while, already counted at "do"
+                continue
+            decisions += 1
+            if close + 1 < end:
+                open_loop(close + 1, line)
+            i = close + 1
+            continue
+        if value == "do":
+            decisions += 1
+            open_loop(i + 1, line)
+        elif value in ("if", "case", "catch", "&&", "||", "?"):
+            decisions += 1
+        elif value == "{":
+            braces += 1
+        elif value == "}":
+            braces -= 1
+            while loops and loops[-1][0] == "brace" and loops[-1][1] > braces:
+                loops.pop()
+            if not (i + 1 < end and tokens[i + 1][1] == "else"):
+                while loops and loops[-1][0] == "stmt" and loops[-1][1] >= braces:
+                    loops.pop()
+        elif value == "(":
+            parens += 1
+        elif value == ")":
+            parens -= 1
+        elif value == ";" and parens == 0:
+            while loops and loops[-1][0] == "stmt" and loops[-1][1] >= braces:
+                loops.pop()
+        elif kind == "ident" and i + 1 < end and tokens[i + 1][1] == "(":
+            prev = tokens[i - 1][1] if i > start else ""
+            if value == name and (prev != "." or tokens[i - 2][1] == "this"):
+                recursive = True
+            if loops and ((prev == "." and value in C_LINEAR_METHODS) or (value == "find" and prev != ".")):
+                quadratic.append((line, f"linear {value}() inside a loop"))
+        i += 1
+    return 1 + decisions, max_depth, recursive, quadratic
+
+
+def analyze_c_like(code: str, language: str) -> dict:
+    report = _empty_report(language, code)
+    tokens = tokenize_c_like(code)
+    report["code_lines"] = len({line for _, _, line in tokens})
+    comment_lines = set()
+    line = 1
+    for match in C_TOKEN.finditer(code):
+        if match.lastgroup == "comment":
+            comment_lines.update(range(line, line + match.group().count("\n") + 1))
+        line += match.group().count("\n")
+    report["comment_lines"] = len(comment_lines - {line for _, _, line in tokens})
+
+    scopes = []  # names of enclosing class/struct/namespace blocks, None for anonymous blocks
+    pending_scope = None
+    i = 0
+    while i < len(tokens):
+        kind, value, line = tokens[i]
+        if value in ("class", "struct", "namespace", "interface", "enum") and i + 1 < len(tokens) \
+                and tokens[i + 1][0] == "ident":
+            pending_scope = tokens[i + 1][1]
+        elif value == ";":
+            pending_scope = None
+        elif value == "{":
+            scopes.append(pending_scope)
+            pending_scope = None
+        elif value == "}":
+            if scopes:
+                scopes.pop()
+        elif (kind == "ident" and value not in C_KEYWORDS and i + 1 < len(tokens) and tokens[i + 1][1] == "("
+              and (i == 0 or tokens[i - 1][1] not in (".", "new", "->"))):
+            close = _match(tokens, i + 1, "(", ")")
+            body = _function_body_start(tokens, close)
+            if body is not None:
+                end = _match(tokens, body, "{", "}")
+                owner = [s for s in scopes if s]
+                if i >= 2 and tokens[i - 1][1] == "::":
+                    owner.append(tokens[i - 2][1])
+                qualname = "::".join(owner + [value]) if language == "C++" else ".".join(owner + [value])
+                complexity, depth, recursive, quadratic = _scan_c_body(tokens, body + 1, end, value, qualname)
+                report["functions"].append({
+                    "name": qualname,
+                    "line": line,
+                    "end_line": tokens[end][2],
+                    "params": _count_params(tokens, i + 1, close),
+                    "complexity": complexity,
+                    "loop_depth": depth,
+                    "recursive": recursive,
+                })
+                report["max_loop_depth"] = max(report["max_loop_depth"], depth)
+                report["quadratic"].extend(
+                    {"line": q_line, "function": qualname, "pattern": pattern} for q_line, pattern in quadratic)
+                i = end + 1
+                continue
+        i += 1
+    return report
+
+
+# --- Output -------------------------------------------------------------------
+
+def estimated_complexity(function: dict) -> str:
+    if function["recursive"]:
+        return "recursive (depends on the recurrence)"
+    depth = function["loop_depth"]
+    return "O(1)" if depth == 0 else "O(n)" if depth == 1 else f"O(n^{depth})"
+
+
+def format_facts(report: dict, map_line=None) -> str:
+    """Compact fact list for the model prompt.
+
+    ``map_line`` translates original line numbers when the prompt carries a
+    compacted copy of the code.
+    """
+    map_line = map_line or (lambda line: line)
+    functions = report["functions"]
+    lines = [
+        "Local static analysis (computed exactly, treat as ground truth):",
+        f"- {report['lines']} lines ({report['code_lines']} code, {report['comment_lines']} comment), "
+        f"{len(functions)} functions, max loop nesting {report['max_loop_depth']}",
+    ]
+    if report["parse_error"]:
+        lines.append(f"- does not parse: {report['parse_error']}")
+    for f in functions[:MAX_LISTED_FUNCTIONS]:
+        flags = ", recursive" if f["recursive"] else ""
+        lines.append(f"- {f['name']} (line {map_line(f['line'])}): cyclomatic {f['complexity']}, "
+                     f"loop depth {f['loop_depth']}{flags}")
+    if len(functions) > MAX_LISTED_FUNCTIONS:
+        lines.append(f"- ... {len(functions) - MAX_LISTED_FUNCTIONS} more functions")
+    for q in report["quadratic"][:MAX_LISTED_PATTERNS]:
+        lines.append(f"- possible superlinear pattern, line {map_line(q['line'])} in {q['function']}: {q['pattern']}")
+    return "\n".join(lines)
+
+
+def render_markdown(report: dict) -> str:
+    """Stand-alone report for fast mode, when no model is called."""
+    out = [
+        f"## Local Analysis ({report['language']})",
+        "_Fast mode: computed locally without the AI model._",
+        "",
+        f"- **Lines:** {report['lines']} ({report['code_lines']} code, {report['comment_lines']} comment)",
+        f"- **Functions:** {len(report['functions'])}",
+        f"- **Deepest loop nesting:** {report['max_loop_depth']}",
+    ]
+    if report["parse_error"]:
+        out.append(f"- **Parse error:** {report['parse_error']}")
+
+    if report["functions"]:
+        out += ["", "### Functions", "",
+                "| Function | Line | Params | Cyclomatic | Loop depth | Estimated time |",
+                "| --- | --- | --- | --- | --- | --- |"]
+        for f in report["functions"]:
+            out.append(f"| `{f['name']}` | {f['line']} | {f['params']} | {f['complexity']} | "
+                       f"{f['loop_depth']} | {estimated_complexity(f)} |")
+        complex_functions = [f["name"] for f in report["functions"] if f["complexity"] > 10]
+        if complex_functions:
+            out += ["", "Cyclomatic complexity above 10 suggests splitting: "
+                    + ", ".join(f"`{name}`" for name in complex_functions) + "."]
+
+    out += ["", "### Potential Hotspots", ""]
+    if report["quadratic"]:
+        out += [f"- Line {q['line']} in `{q['function']}`: {q['pattern']}" for q in report["quadratic"]]
+    else:
+        out.append("- No obvious quadratic patterns found.")
+    return "\n".join(out) + "\n"
@@ -0,0 +1,127 @@
+"""Serves the front-end: the prebuilt bundle in ``static/`` or, without a build, a CDN page.
+
+``frontend/build.mjs`` writes content-hashed bundles with gzip and brotli
+variants plus ``manifest.json``. Everything listed in the manifest is read into
+memory once. Hashed assets are served as immutable for a year, and
+``index.html`` is revalidated on every visit, so a repeat visit costs one 304.
+
+When ``static/`` has not been built, ``/`` falls back to the development page:
+React, marked and Prism from CDNs and ``frontend/src/App.jsx`` transpiled in the
+browser, which still works but pays the Babel start-up on every load.
+"""
+import hashlib
+import json
+import os
+
+from fastapi import Request, Response
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+MEDIA_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".jsx": "text/babel; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".json": "application/json",
+}
+CDN_HEAD = """<link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/themes/prism-tomorrow.min.css">
+    <link rel="stylesheet" href="/dev/styles.css">"""
+CDN_SCRIPTS = """<script src="https://unpkg.com/react@18/umd/react.production.min.js"></script>
+    <script src="https://unpkg.com/react-dom@18/umd/react-dom.production.min.js"></script>
+    <script src="https://unpkg.com/babel-standalone@6/babel.min.js"></script>
+    <script src="https://cdn.jsdelivr.net/npm/marked/marked.min.js"></script>
+    <script src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/prism.min.js"></script>
+    <script type="text/babel" src="/dev/App.jsx"></script>"""
+
+
+class _Asset:
+    """One file and its precompressed variants, each with its own strong ETag."""
+
+    def __init__(self, name: str, variants: dict):
+        self.media_type = MEDIA_TYPES.get(os.path.splitext(name)[1], "application/octet-stream")
+        digest = hashlib.sha256(variants[None]).hexdigest()[:20]
+        self.variants = {encoding: (data, f'"{digest}{"-" + encoding if encoding else ""}"')
+                         for encoding, data in variants.items()}
+
+
+def accepted_encodings(header: str) -> set:
+    accepted = set()
+    for part in header.split(","):
+        token, *params = part.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(token.strip().lower())
+    return accepted
+
+
+class StaticAssets:
+    def __init__(self, directory: str = None, source_dir: str = None):
+        self.directory = directory = directory or os.path.join(ROOT, "static")
+        self.source_dir = source_dir or os.path.join(ROOT, "frontend")
+        self.assets = {}
+        self.built = False
+        manifest_path = os.path.join(directory, "manifest.json")
+        if os.path.isfile(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            for name, sizes in manifest["files"].items():
+                self.assets[name] = self._load(os.path.join(directory, name), name,
+                                               [e for e, suffix in ENCODINGS if e in sizes])
+            self.built = "index.html" in self.assets
+        if not self.built:
+            self._load_dev_page()
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _load(self, path: str, name: str, encodings=()) -> _Asset:
+        variants = {None: self._read(path)}
+        for encoding, suffix in ENCODINGS:
+            if encoding in encodings:
+                variants[encoding] = self._read(path + suffix)
+        return _Asset(name, variants)
+
+    def _load_dev_page(self):
+        template = self._read(os.path.join(self.source_dir, "index.html")).decode("utf-8")
+        html = template.replace("<!-- head -->", CDN_HEAD).replace("<!-- scripts -->", CDN_SCRIPTS)
+        self.assets["index.html"] = _Asset("index.html", {None: html.encode("utf-8")})
+        for name in ("App.jsx", "styles.css"):
+            self.assets[f"dev/{name}"] = self._load(os.path.join(self.source_dir, "src", name), name)
+
+    def response(self, name: str, request: Request, cache_control: str) -> Response:
+        """Serve ``name`` in the best encoding the client accepts, or 304 when its ETag still matches."""
+        asset = self.assets.get(name)
+        if asset is None:
+            return Response(status_code=404)
+        accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+        encoding = next((e for e, _ in ENCODINGS if e in accepted and e in asset.variants), None)
+        data, etag = asset.variants[encoding]
+        headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=data, media_type=asset.media_type, headers=headers)
+
+    def index(self, request: Request) -> Response:
+        return self.response("index.html", request, REVALIDATE)
+
+    def asset(self, name: str, request: Request) -> Response:
+        # Hashed names never change content; dev files are revalidated like the page
+        if self.built and name in self.assets and name != "index.html":
+            return self.response(name, request, IMMUTABLE)
+        return Response(status_code=404)
+
+    def dev_file(self, name: str, request: Request) -> Response:
+        return self.response(f"dev/{name}", request, REVALIDATE)